@@ -1,18 +1,44 @@
-from flask import Flask, render_template, request, jsonify
-import ja_to_smiles  # 名前を変えたメインロジックを読み込む
+import io
+import logging
+import os
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 import checker       # 法規制チェッカー
+import pipeline      # キャッシュ付きの検索の流れ
+import batch_screen  # 一括チェック
+import metrics       # 処理時間の計測
+import search_cache
+import async_search  # 非同期の検索 (同時実行数の制限・期限)
+import hot_reload    # 法律・辞書ファイルの読み直し
+import similarity    # 類似度検索
+
+# ログ出力 (CHEMREGU_LOG_LEVEL=DEBUG で検索ごとの途中経過も出す。WARNINGなどにすれば静かになる)
+logging.basicConfig(
+    level=os.environ.get("CHEMREGU_LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+MAX_SIMILAR_K = 100  # 類似度検索で返す件数の上限
+MAX_SIMILAR_BATCH = 100  # 類似度検索でまとめて受け付けるSMILESの件数の上限
+
 # --- サーバー起動時に1回だけDBを準備 ---
-print("システム起動中: 辞書をロードしています...")
+logger.info("システム起動中: 辞書をロードしています...")
 # jp_smiles_py側の辞書ロード (※必要なら関数を公開して呼ぶ形に修正)
 # ここでは簡単のため、モジュール読み込み時点でロードされているものを使います
 
-# checker側のDBロード
-REGULATION_DB = checker.load_and_merge_laws()
-main_checker = checker.check_regulations(REGULATION_DB)
-print("ロード完了！")
+# checker側のDBロード (スナップショットがあればそれを使う)
+# gunicorn --preload の場合はここで1回だけ読み込まれ、各ワーカーで共有される
+checker.get_checker()
+search_service = async_search.search_service(checker.get_checker)
+logger.info("ロード完了！")
+
+
+# 法律・辞書ファイルの更新を監視する (ワーカーごとに最初のリクエストで開始)
+@app.before_request
+def start_hot_reload():
+    hot_reload.ensure_started()
 
 
 # 1. トップページを表示する機能
@@ -22,61 +48,117 @@ def index():
 
 
 # 2. 検索リクエストを受け取る機能 (API)
+# 非同期ビュー: OPSINとチェックは別スレッドで行い、混雑時は503、期限切れは504を返す
 @app.route('/api/search', methods=['POST'])
-def search_api():
-    print("\n--- 【デバッグ】検索リクエスト受信 ---")
-    
-    # ブラウザから送られてきたデータを取り出す
-    data = request.json
-    input_text = data.get('text', '')
-    print(f"1. 受信したテキスト: {input_text}")
+async def search_api():
+    with metrics.timed("search_api"):
+        logger.debug("--- 検索リクエスト受信 ---")
+
+        # ブラウザから送られてきたデータを取り出す
+        data = request.json
+        input_text = data.get('text', '')
+        logger.debug(f"1. 受信したテキスト: {input_text}")
+
+        if not input_text:
+            return jsonify({"error": "文字を入力してください"}), 400
+
+        try:
+            # 日本語 -> 英語 -> SMILES -> 法規制チェック (段ごとにキャッシュあり)
+            result = await search_service.search(input_text)
+        except async_search.service_busy as e:
+            logger.warning("!! 混雑のため検索を受け付けませんでした")
+            return jsonify({"error": "混雑しています。しばらくしてから再度お試しください"}), 503, {"Retry-After": str(e.retry_after)}
+        except async_search.deadline_exceeded as e:
+            logger.warning(f"!! 検索が時間内に終わりませんでした: {e}")
+            return jsonify({"error": "時間内に検索が終わりませんでした。しばらくしてから再度お試しください"}), 504
+        except Exception as e:
+            logger.exception(f"!! エラー発生: {e}") # 詳細なエラー場所も出る
+            return jsonify({"error": str(e)}), 500
+
+        logger.debug(f"2. 入力の種類: {result['route']} / 変換された英語名: {result['english_name']}")
+        logger.debug(f"3. 変換されたSMILES: {result['smiles']}")
+
+        if not result["smiles"]:
+            logger.debug("!! SMILES変換失敗")
+        else:
+            logger.debug(f"4. 法規制チェック結果: {len(result['regulations'])} 件ヒット")
+            # 中身も見てみる
+            if logger.isEnabledFor(logging.DEBUG):
+                for res in result["regulations"]:
+                    logger.debug(f"   - {res['law']}: {res['detected_type']}")
+
+        # 結果をJSONで返す
+        return jsonify(result)
 
-    if not input_text:
-        return jsonify({"error": "文字を入力してください"}), 400
 
+# 3. 一括チェック (CSV/JSONLを受け取り、結果をNDJSONで順次返す)
+# multipartの "file" か、リクエスト本文そのものを入力とする。形式は ?format=csv|jsonl で指定可
+@app.route('/api/search/batch', methods=['POST'])
+def search_batch_api():
+    upload = request.files.get('file')
+    if upload is not None:
+        fmt = request.args.get('format') or batch_screen.guess_format(upload.filename)
+        source = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    else:
+        default = 'jsonl' if 'json' in (request.mimetype or '') else 'csv'
+        fmt = request.args.get('format') or default
+        source = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({"error": "format は csv か jsonl を指定してください"}), 400
+
+    results = batch_screen.screen_records(batch_screen.iter_records(source, fmt), checker.get_checker())
+    return Response(stream_with_context(batch_screen.to_ndjson(results)), mimetype='application/x-ndjson')
+
+
+# 3-2. 類似度検索 (構造が似ている登録物質を類似度の高い順に返す)
+# {"smiles": "..."} か {"smiles": ["...", ...]} (まとめて。最大100件), または {"text": "物質名"}。件数は "k" (既定10, 最大100)
+@app.route('/api/similar', methods=['POST'])
+def similar_api():
+    data = request.json or {}
     try:
-        # A. 日本語 -> 英語 -> SMILES
-        normalized = ja_to_smiles.normalize_text(input_text)
-        tokens = ja_to_smiles.tokenize_and_parse(normalized)
-        english_name = ja_to_smiles.translate_tokens_with_reorder(tokens)
-        smiles = ja_to_smiles.convert_name_to_smiles(english_name)
-        
-        print(f"2. 変換された英語名: {english_name}")
-        print(f"3. 変換されたSMILES: {smiles}")
+        k = min(int(data.get('k', similarity.DEFAULT_TOP_K)), MAX_SIMILAR_K)
+        min_similarity = float(data.get('min_similarity', 0.0))
+    except (TypeError, ValueError):
+        return jsonify({"error": "k と min_similarity は数値で指定してください"}), 400
+
+    reg_checker = checker.get_checker()
+    with metrics.timed("similar_api"):
+        smiles = data.get('smiles')
+        if isinstance(smiles, list):
+            if not all(isinstance(item, str) for item in smiles):
+                return jsonify({"error": "smiles のリストには文字列だけを指定してください"}), 400
+            if len(smiles) > MAX_SIMILAR_BATCH:
+                return jsonify({"error": f"smiles は一度に{MAX_SIMILAR_BATCH}件までです"}), 400
+            return jsonify({"results": reg_checker.similar_many(smiles, k, min_similarity)})
 
+        english_name = None
+        if not smiles and data.get('text'):
+            route, english_name, smiles = pipeline.resolve_input(data['text'])
+            if smiles is None:
+                smiles = pipeline.name_to_smiles(english_name)
+            if not smiles:
+                return jsonify({"english_name": english_name, "smiles": None, "similar": [], "message": "SMILES変換に失敗しました"})
         if not smiles:
-            print("!! SMILES変換失敗")
-            return jsonify({
-                "english_name": english_name,
-                "smiles": None,
-                "regulations": [],
-                "message": "SMILES変換に失敗しました"
-            })
-
-        # B. 法規制チェック
-        # ★ここでチェッカーの中にデータが入っているか確認
-        print(f"4. チェッカーの登録パターン数: {len(main_checker.patterns)}")
-        
-        check_results = main_checker.check(smiles)
-        print(f"5. 法規制チェック結果: {len(check_results)} 件ヒット")
-        
-        # 中身も見てみる
-        for res in check_results:
-            print(f"   - {res['law']}: {res['detected_type']}")
-
-        # C. 結果をJSONで返す
+            return jsonify({"error": "smiles か text を指定してください"}), 400
+
         return jsonify({
-            "original": input_text,
             "english_name": english_name,
             "smiles": smiles,
-            "regulations": check_results
+            "similar": reg_checker.similar(smiles, k, min_similarity)
         })
 
-    except Exception as e:
-        print(f"!! エラー発生: {e}")
-        import traceback
-        traceback.print_exc() # 詳細なエラー場所を表示
-        return jsonify({"error": str(e)}), 500
+
+# 4. 処理時間などの計測値 (Prometheus形式)
+@app.route('/metrics')
+def metrics_api():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+# 5. キャッシュのヒット数などを返す機能
+@app.route('/api/cache/stats')
+def cache_stats_api():
+    return jsonify(search_cache.cache_stats())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,177 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import checker
+import metrics
+import parallel_check
+import pipeline
+
+# 検索APIの非同期処理
+# 1件の検索を「日本語 -> 英語 (その場で) -> SMILES (OPSIN, スレッドで) -> 法規制チェック (スレッド/プロセスで)」と進める。
+# (入力がSMILESならOPSINを、英語名なら翻訳を飛ばす。pipeline.classify_input を参照)
+# - 同時に処理中の検索が MAX_PENDING 件を超えたら、待たせずに service_busy を送出する (APIは503 + Retry-After)
+# - OPSINを同時に呼ぶのは OPSIN_CONCURRENCY 件まで (キャッシュにあれば呼ばない)
+# - 1件の検索は REQUEST_DEADLINE 秒で打ち切り、deadline_exceeded を送出する (APIは504)
+#
+#
+# 受け付け件数はワーカーごと。1ワーカーが同時に受けるリクエストはgunicornの --threads 件までなので、
+# MAX_PENDING の既定はそれより RESERVED_THREADS 少なくする (混雑時も503を返すスレッドが残るように)。
+#
+# 設定は環境変数で変えられる:
+#   CHEMREGU_SERVER_THREADS (gunicornの --threads と同じ値), CHEMREGU_MAX_PENDING, CHEMREGU_OPSIN_CONCURRENCY,
+#   CHEMREGU_REQUEST_DEADLINE, CHEMREGU_CHECK_WORKERS (チェック用スレッド数), CHEMREGU_CHECK_PROCESSES (1以上ならプロセスでチェック)
+
+SERVER_THREADS = int(os.environ.get("CHEMREGU_SERVER_THREADS", "16"))
+RESERVED_THREADS = 4  # 検索以外のAPIと503の応答のために空けておくスレッド数
+MAX_PENDING = int(os.environ.get("CHEMREGU_MAX_PENDING", str(max(1, SERVER_THREADS - RESERVED_THREADS))))
+OPSIN_CONCURRENCY = int(os.environ.get("CHEMREGU_OPSIN_CONCURRENCY", "2"))
+REQUEST_DEADLINE = float(os.environ.get("CHEMREGU_REQUEST_DEADLINE", "15"))
+CHECK_WORKERS = int(os.environ.get("CHEMREGU_CHECK_WORKERS", "4"))
+CHECK_PROCESSES = int(os.environ.get("CHEMREGU_CHECK_PROCESSES", "0"))
+RETRY_AFTER = 2  # 混雑時に「何秒後に再試行してほしいか」
+
+
+
+
+# 混雑していて受け付けられない
+class service_busy(Exception):
+    def __init__(self, retry_after=RETRY_AFTER):
+        super().__init__(f"混雑しています ({retry_after}秒後に再試行してください)")
+        self.retry_after = retry_after
+
+
+# 期限までに終わらなかった
+class deadline_exceeded(Exception):
+    pass
+
+
+
+
+# プロセスプールでチェックする場合のチェッカー代わり (pipeline.check_smiles にそのまま渡せる)
+class _pooled_checker:
+    def __init__(self, reg_checker, pool, timeout):
+        self.reg_checker = reg_checker
+        self.pool = pool
+        self.timeout = timeout
+
+    @property
+    def db_version(self):
+        return self.reg_checker.db_version
+
+    def check(self, target_smiles, stats=None):
+        try:
+            return self.pool.check_one(target_smiles, self.timeout)
+        except multiprocessing.TimeoutError:
+            raise deadline_exceeded("法規制チェックが期限までに終わりませんでした") from None
+
+
+
+
+class search_service:
+    # get_checker: 検索ごとに呼んでチェッカーを受け取る (法律ファイルの読み直しで差し替わるため)
+    def __init__(self, get_checker=checker.get_checker, max_pending=MAX_PENDING, opsin_concurrency=OPSIN_CONCURRENCY,
+                 deadline=REQUEST_DEADLINE, check_workers=CHECK_WORKERS, check_processes=CHECK_PROCESSES):
+        self.get_checker = get_checker
+        self.max_pending = max_pending
+        self.deadline = deadline
+        self.check_workers = check_workers
+        self.check_processes = check_processes
+
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._opsin_slots = threading.BoundedSemaphore(opsin_concurrency)
+
+        # スレッド・プロセスはfork後に作る (gunicorn --preload で親プロセスに作らないように)
+        self._executors_pid = None
+        self._executors_lock = threading.Lock()
+        self._check_pool_version = None
+
+
+    def _executors(self, reg_checker):
+        with self._executors_lock:
+            if self._executors_pid != os.getpid():
+                # OPSIN待ちのスレッドは受け付け件数と同じだけ用意する (同時に変換する数は _opsin_slots で絞る)
+                self._opsin_executor = ThreadPoolExecutor(self.max_pending, thread_name_prefix="opsin")
+                self._check_executor = ThreadPoolExecutor(self.check_workers, thread_name_prefix="check")
+                self._check_pool = None
+                self._executors_pid = os.getpid()
+
+            # チェック用プロセスはチェッカーが差し替わったら作り直す (古いプールは処理中のものが終わってから閉じる)
+            if self.check_processes > 0 and self._check_pool_version != reg_checker.db_version:
+                old_pool = self._check_pool
+                self._check_pool = parallel_check.parallel_checker(workers=self.check_processes)
+                self._check_pool_version = reg_checker.db_version
+                if old_pool is not None:
+                    threading.Thread(target=old_pool.close, daemon=True).start()
+            return self._opsin_executor, self._check_executor, self._check_pool
+
+
+    # OPSINの枠に入る (期限までに空かなければ deadline_exceeded)
+    @contextmanager
+    def _opsin_slot(self, deadline):
+        if not self._opsin_slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            raise deadline_exceeded("OPSINの順番待ちで期限を過ぎました")
+        try:
+            yield
+        finally:
+            self._opsin_slots.release()
+
+
+    # executorで実行し、期限までに終わらなければ deadline_exceeded
+    # (実行中のものは止められないので、結果を待たずに戻るだけ。OPSIN側にも個別のタイムアウトがある)
+    async def _run(self, executor, deadline, func, *args):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise deadline_exceeded("期限を過ぎました")
+        future = asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        try:
+            return await asyncio.wait_for(future, remaining)
+        except asyncio.TimeoutError:
+            raise deadline_exceeded(f"{self.deadline}秒以内に終わりませんでした") from None
+
+
+    # 検索1件分 (pipeline.run_search と同じ形の辞書を返す)
+    async def search(self, input_text):
+        if not self._pending.acquire(blocking=False):
+            metrics.rejected_requests.inc("busy")
+            raise service_busy()
+
+        try:
+            deadline = time.monotonic() + self.deadline
+            reg_checker = self.get_checker()  # 1件の中では同じチェッカーを使う
+            opsin_executor, check_executor, check_pool = self._executors(reg_checker)
+
+            # 入力の判定と日本語 -> 英語は辞書を引くだけなので、その場で行う (SMILESの入力ならOPSINは飛ばす)
+            route, english_name, smiles = pipeline.resolve_input(input_text)
+            if smiles is None:
+                smiles = await self._run(opsin_executor, deadline, pipeline.name_to_smiles, english_name, self._opsin_slot(deadline))
+
+            if not smiles:
+                return {
+                    "route": route,
+                    "english_name": english_name,
+                    "smiles": None,
+                    "regulations": [],
+                    "message": "SMILES変換に失敗しました"
+                }
+
+            if check_pool is not None:
+                reg_checker = _pooled_checker(reg_checker, check_pool, max(0.0, deadline - time.monotonic()))
+            check_results = await self._run(check_executor, deadline, pipeline.check_smiles, reg_checker, smiles)
+
+            return {
+                "original": input_text,
+                "route": route,
+                "english_name": english_name,
+                "smiles": smiles,
+                "regulations": check_results
+            }
+        except deadline_exceeded:
+            metrics.rejected_requests.inc("deadline")
+            raise
+        finally:
+            self._pending.release()
@@ -0,0 +1,308 @@
+import argparse
+import contextlib
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import time
+
+from rdkit import Chem, rdBase
+
+import parallel_check
+import pipeline
+import result_store
+
+# 在庫リストなどの一括チェック
+# CSV / JSONL の各行(物質名 または SMILES)を順に読み、結果を1行1件のJSON(NDJSON)で流す。
+# 入力は少しずつ読むので、ファイルが大きくてもメモリ使用量は一定。
+#
+#   python -m batch_screen inventory.csv -o results.ndjson
+#
+# CSVは見出し行に smiles / name / text のどれかの列があればそれを使い、なければ1列目を物質名とみなす。
+# JSONLは1行ごとに {"smiles": ...} / {"name": ...} / {"text": ...} か、ただの文字列。
+#
+# --store results.sqlite を付けると判定結果を保存し、次回は新しい物質と法律の変更の影響を受ける物質だけ判定する
+# (result_store.py を参照。環境変数 CHEMREGU_RESULT_STORE でも指定できる)
+
+CHUNK_SIZE = 256  # OPSINにまとめて流す件数
+
+NAME_COLUMNS = ("name", "text")
+SMILES_COLUMNS = ("smiles",)
+
+
+
+
+# 入力形式の推定 (拡張子から)
+def guess_format(filename, default="csv"):
+    filename = (filename or "").lower()
+    if filename.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    if filename.endswith((".csv", ".tsv", ".txt")):
+        return "csv"
+    return default
+
+
+
+
+# 1件分を (種類, 値) にする  種類は "smiles" か "name"
+def _record_from_fields(fields):
+    lowered = {str(k).strip().lower(): v for k, v in fields.items() if k is not None}
+    for column in SMILES_COLUMNS:
+        value = lowered.get(column)
+        if value and str(value).strip():
+            return "smiles", str(value).strip()
+    for column in NAME_COLUMNS:
+        value = lowered.get(column)
+        if value and str(value).strip():
+            return "name", str(value).strip()
+    raise ValueError("smiles / name / text のいずれの値もありません")
+
+
+
+
+# CSVの読み込み (行番号, 種類, 値 または 例外)
+def iter_csv_records(text_stream):
+    reader = csv.reader(text_stream)
+    header = next(reader, None)
+    if header is None:
+        return
+
+    columns = [h.strip().lower() for h in header]
+    if not any(c in SMILES_COLUMNS + NAME_COLUMNS for c in columns):
+        # 見出しなし -> 1行目から物質名
+        columns = None
+        reader = _prepend(header, reader)
+
+    row_number = 0
+    for row in reader:
+        row_number += 1
+        if not any(cell.strip() for cell in row):
+            continue
+        try:
+            if columns is None:
+                yield row_number, "name", row[0].strip()
+            else:
+                yield row_number, *_record_from_fields(dict(zip(columns, row)))
+        except ValueError as e:
+            yield row_number, "error", e
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+
+
+# JSONLの読み込み
+def iter_jsonl_records(text_stream):
+    row_number = 0
+    for line in text_stream:
+        line = line.strip()
+        if not line:
+            continue
+        row_number += 1
+        try:
+            data = json.loads(line)
+            if isinstance(data, str):
+                if not data.strip():
+                    raise ValueError("空の行です")
+                yield row_number, "name", data.strip()
+            elif isinstance(data, dict):
+                yield row_number, *_record_from_fields(data)
+            else:
+                raise ValueError("JSONの形式が不正です")
+        except ValueError as e: # json.JSONDecodeErrorもValueError
+            yield row_number, "error", e
+
+
+def iter_records(text_stream, fmt):
+    if fmt == "jsonl":
+        return iter_jsonl_records(text_stream)
+    return iter_csv_records(text_stream)
+
+
+
+
+# 1チャンク分の処理 (物質名はまとめてOPSINに流す)
+# poolを渡すと、法規制チェックを複数プロセスで行う (この場合は判定結果のキャッシュは使わない)
+# storeを渡すと、保存済みの判定結果が使える物質はチェックしない
+def _screen_chunk(chunk, reg_checker, pool=None, store=None):
+    # 物質名の列も、SMILESや英語名ならそのまま使う (pipeline.classify_input)
+    resolved = {}
+    for row_number, kind, value in chunk:
+        if kind == "name":
+            try:
+                resolved[row_number] = pipeline.resolve_input(value)
+            except Exception as e:
+                resolved[row_number] = e
+
+    names = [r[1] for r in resolved.values() if not isinstance(r, Exception) and r[2] is None]
+    converted = dict(zip(names, pipeline.names_to_smiles(names)))
+
+    # 行ごとに英語名とSMILESを決める
+    rows = []
+    for row_number, kind, value in chunk:
+        result = {"row": row_number, "input": value if kind != "error" else None}
+        smiles = None
+        try:
+            if kind == "error":
+                raise value
+            if kind == "smiles":
+                route = pipeline.ROUTE_SMILES
+                english_name = None
+                smiles = value
+            else:
+                if isinstance(resolved[row_number], Exception):
+                    raise resolved[row_number]
+                route, english_name, smiles = resolved[row_number]
+                if smiles is None:
+                    smiles = converted.get(english_name)
+            result["route"] = route
+            result["english_name"] = english_name
+            result["smiles"] = smiles
+            if not smiles:
+                result["regulations"] = []
+                result["message"] = "SMILES変換に失敗しました"
+            elif not _parses(smiles):
+                raise ValueError(f"SMILESを解釈できません: {smiles}")
+        except Exception as e:
+            # 1行の失敗で全体を止めない
+            result["error"] = str(e)
+        rows.append(result)
+
+    # 法規制チェック
+    targets = [r for r in rows if "error" not in r and r["smiles"]]
+
+    def compute(smiles_list):
+        if pool is not None:
+            return pool.check_many(smiles_list)
+        return [_check_one(reg_checker, smiles) for smiles in smiles_list]
+
+    if store is not None:
+        checked = store.check_many(reg_checker, [r["smiles"] for r in targets], compute)
+    else:
+        checked = compute([r["smiles"] for r in targets])
+    for result, regulations in zip(targets, checked):
+        if isinstance(regulations, Exception):
+            result["error"] = str(regulations)
+        else:
+            result["regulations"] = regulations
+
+    return rows
+
+
+# 読めないSMILESは check() が空の結果を返すので、チェックの前に弾いてエラーにする
+def _parses(smiles):
+    with rdBase.BlockLogs():
+        return Chem.MolFromSmiles(smiles) is not None
+
+
+def _check_one(reg_checker, smiles):
+    try:
+        return pipeline.check_smiles(reg_checker, smiles)
+    except Exception as e:
+        return e
+
+
+
+
+# 一括チェック本体 (結果の辞書を1件ずつ返し、最後に集計を返す)
+def screen_records(records, reg_checker, chunk_size=CHUNK_SIZE, pool=None, store=None):
+    started = time.monotonic()
+    rows = 0
+    errors = 0
+    hits = 0
+
+    for chunk in parallel_check.chunked(records, chunk_size):
+        for result in _screen_chunk(chunk, reg_checker, pool, store):
+            rows += 1
+            if "error" in result:
+                errors += 1
+            elif result["regulations"]:
+                hits += 1
+            yield result
+
+    elapsed = time.monotonic() - started
+    summary = {
+        "rows": rows,
+        "errors": errors,
+        "regulated": hits,
+        "elapsed_sec": round(elapsed, 3),
+        "rows_per_sec": round(rows / elapsed, 1) if elapsed > 0 else None
+    }
+    if store is not None:
+        summary["store"] = store.stats()
+    yield {"summary": summary}
+
+
+def to_ndjson(results):
+    for result in results:
+        yield json.dumps(result, ensure_ascii=False) + "\n"
+
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m batch_screen", description="CSV/JSONLの物質リストを一括で法規制チェックする")
+    parser.add_argument("input", help="入力ファイル (- なら標準入力)")
+    parser.add_argument("-o", "--output", default="-", help="出力先NDJSONファイル (既定: 標準出力)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="入力形式 (既定: 拡張子から推定)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="OPSINにまとめて流す件数")
+    parser.add_argument("--workers", type=int, default=1, help="法規制チェックに使うプロセス数 (0ならCPU数)")
+    parser.add_argument("--check-chunk-size", type=int, default=parallel_check.DEFAULT_CHUNK_SIZE, help="ワーカーに1回で送るSMILESの数")
+    parser.add_argument("--store", default=os.environ.get("CHEMREGU_RESULT_STORE"), help="判定結果を保存するSQLiteファイル (前回の結果を使い回す)")
+    parser.add_argument("--invalidate", choices=result_store.INVALIDATE_MODES, default="selective",
+                        help="法律DBが変わったときに判定し直す範囲 (selective: 変更の影響を受ける物質だけ, all: すべて)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.environ.get("CHEMREGU_LOG_LEVEL", "WARNING").upper())
+
+    import checker
+    reg_checker = checker.get_checker()
+
+    fmt = args.format or guess_format(args.input)
+    if args.input == "-":
+        source = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig")
+    else:
+        source = open(args.input, "r", encoding="utf-8-sig", newline="")
+    if args.output == "-":
+        sink = sys.stdout
+    else:
+        sink = open(args.output, "w", encoding="utf-8")
+
+    pool = None
+    chunk_size = args.chunk_size
+    if args.workers != 1:
+        pool = parallel_check.parallel_checker(
+            workers=args.workers or None,
+            chunk_size=args.check_chunk_size
+        )
+        # 全ワーカーに仕事が行き渡るよう、1チャンクを十分大きくする
+        chunk_size = max(chunk_size, pool.workers * pool.chunk_size * 4)
+
+    store = result_store.result_store(args.store, args.invalidate) if args.store else None
+
+    try:
+        # 途中のメッセージ(print)がNDJSONに混ざらないよう標準エラーへ回す
+        with contextlib.redirect_stdout(sys.stderr):
+            for line in to_ndjson(screen_records(iter_records(source, fmt), reg_checker, chunk_size, pool, store)):
+                sink.write(line)
+                if line.startswith('{"summary"'):
+                    print(line.strip())
+        sink.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+        if store is not None:
+            store.close()
+        if args.input != "-":
+            source.close()
+        if args.output != "-":
+            sink.close()
+
+
+if __name__ == "__main__":
+    main()
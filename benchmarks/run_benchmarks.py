@@ -0,0 +1,419 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+
+from rdkit import Chem, RDLogger, rdBase
+
+# チェッカーと翻訳処理のベンチマーク
+# 合成した法規制DB(既定: 100 / 1,000 / 10,000パターン)と合成クエリで、
+# 構築時間・1件あたりの応答時間・一括処理のスループット・メモリ使用量を測る。
+# OPSINは名前から決まったSMILESを返すスタブに置き換えるので、ネットワークもJavaも不要で毎回同じ結果になる。
+#
+#   python -m benchmarks.run_benchmarks -o bench.json
+#   python -m benchmarks.run_benchmarks -o new.json --baseline bench.json
+#
+# リポジトリのルートで実行すること (laws/ や dicts/ を相対パスで読むため)
+
+DEFAULT_SIZES = [100, 1000, 10000]
+DEFAULT_SEED = 0
+REGRESSION_THRESHOLD = 0.10  # ベースラインよりこれ以上悪化したら警告
+
+
+
+
+# --- 合成データ ---
+
+# 置換基を差し込む骨格 ({}の位置に置換基が入る)
+SCAFFOLDS = [
+    "c1cc({})ccc1{}",
+    "c1cc({})cc({})c1{}",
+    "c1ncc({})cc1{}",
+    "C1CCN({})CC1{}",
+    "C1CCC({})CC1{}",
+    "O=C({})N{}",
+    "N({})C(C){}",
+    "C(Cc1ccccc1)N({}){}",
+    "CN1CCC[C@H]1c1cc({})cnc1{}",
+    "P(=S)(O{})(OC){}",
+    "CCOP(=O)(O{})O{}",
+    "c1ccc2c(c1)cc({})n2{}",
+    "C(=O)(O{}){}",
+    "S(=O)(=O)({})N{}",
+    "[Pb](C)(C)(C){}",
+]
+
+SUBSTITUENTS = [
+    "C", "CC", "CCC", "C(C)C", "O", "OC", "OCC", "N", "NC", "N(C)C", "F", "Cl", "Br",
+    "C(=O)O", "C(=O)OC", "C(=O)C", "C#N", "[N+](=O)[O-]", "S", "SC", "C(F)(F)F",
+    "c1ccccc1", "Cc1ccccc1", "OC(=O)C", "CCN(CC)CC", "C1CC1",
+]
+
+SCOPES = [
+    ["itself"],
+    ["itself", "salts"],
+    ["itself", "salts", "hydrates"],
+    ["itself", "isomers"],
+    ["compounds"],
+    ["organic_compounds", "inorganic_compounds"],
+    ["esters", "ethers"],
+    ["salts"],
+]
+
+SALT_PARTNERS = ["Cl", "[Cl-]", "[Na+]", "CC(=O)O", "OS(=O)(=O)O", "[K+]", "OC(=O)C(O)C(O)C(=O)O", "C#N"]
+
+
+def generate_patterns(size, rng):
+    patterns = []
+    seen = set()
+    attempts = 0
+    while len(patterns) < size:
+        attempts += 1
+        if attempts > size * 50:
+            raise RuntimeError(f"{size}件のパターンを生成できませんでした")
+        scaffold = rng.choice(SCAFFOLDS)
+        smiles = scaffold.format(*(rng.choice(SUBSTITUENTS) for _ in range(scaffold.count("{}"))))
+        mol = Chem.MolFromSmiles(smiles)
+        if mol is None:
+            continue
+        canon = Chem.MolToSmiles(mol)
+        if canon in seen:
+            continue
+        seen.add(canon)
+        patterns.append(smiles)
+    return patterns
+
+
+def generate_regulation_db(size, rng):
+    regulation_db = {}
+    laws = ["合成法A", "合成法B", "合成法C"]
+    for i, smiles in enumerate(generate_patterns(size, rng)):
+        entries = [{
+            "law": rng.choice(laws),
+            "name": f"合成パターン{i}",
+            "description": smiles,
+            "scope": rng.choice(SCOPES)
+        }]
+        # 一部は複数の法律に重複して登録されている
+        if rng.random() < 0.1:
+            entries.append(dict(entries[0], law=rng.choice(laws)))
+        regulation_db[smiles] = entries
+    return regulation_db
+
+
+# クエリ: 単体(DBそのもの/誘導体/無関係), 塩(複数フラグメント), 水和物
+def generate_queries(patterns, count, rng):
+    queries = {"single": [], "salt": [], "hydrate": []}
+    for _ in range(count):
+        base = rng.choice(patterns)
+        kind = rng.random()
+        if kind < 0.4:
+            single = base
+        elif kind < 0.7:
+            single = base + rng.choice(SUBSTITUENTS) # 端にくっつけた誘導体
+        else:
+            single = rng.choice(SCAFFOLDS).replace("{}", "C")
+        if Chem.MolFromSmiles(single) is None:
+            single = base
+        queries["single"].append(single)
+        partners = rng.sample(SALT_PARTNERS, rng.randint(1, 3))
+        queries["salt"].append(".".join([single] + partners))
+        queries["hydrate"].append(".".join([single] + ["O"] * rng.randint(1, 3)))
+    return queries
+
+
+def generate_japanese_names(count, rng):
+    import ja_to_smiles
+    prefixes = [k for k, v in ja_to_smiles.translation_dict.items() if "prefix" in v["roles"]]
+    modifiers = [k for k, v in ja_to_smiles.translation_dict.items() if "modifier" in v["roles"]]
+    cores = [k for k, v in ja_to_smiles.translation_dict.items() if "core" in v["roles"]]
+    suffixes = [k for k, v in ja_to_smiles.translation_dict.items() if "suffix" in v["roles"]]
+    synonyms = list(ja_to_smiles.synonym_dict)
+
+    names = []
+    for _ in range(count):
+        if synonyms and rng.random() < 0.2:
+            names.append(rng.choice(synonyms))
+            continue
+        parts = []
+        if suffixes and rng.random() < 0.3:
+            parts.append(rng.choice(suffixes))
+        for _ in range(rng.randint(1, 3)):
+            if prefixes and rng.random() < 0.4:
+                parts.append(rng.choice(prefixes))
+            parts.append(rng.choice(modifiers))
+        parts.append(rng.choice(cores))
+        names.append("".join(parts))
+    return names
+
+
+
+
+# --- 計測 ---
+
+def _peak_rss_mb():
+    # Linuxではキロバイト、macOSではバイト
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak /= 1024
+    return round(peak / 1024, 1)
+
+
+def _latency_summary(samples):
+    samples = sorted(samples)
+    return {
+        "median_ms": round(statistics.median(samples) * 1000, 4),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1] * 1000, 4) if len(samples) >= 20 else None,
+        "max_ms": round(samples[-1] * 1000, 4)
+    }
+
+
+# DBサイズ1つ分 (メモリを分けて測るため別プロセスで実行する)
+def bench_checker_size(size, query_count, seed):
+    RDLogger.DisableLog("rdApp.*")
+    import checker
+
+    rng = random.Random(seed * 1000003 + size)
+    regulation_db = generate_regulation_db(size, rng)
+    queries = generate_queries(list(regulation_db), query_count, rng)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    reg_checker = checker.check_regulations(regulation_db)
+    construction_sec = time.perf_counter() - started
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        "patterns": len(reg_checker.patterns),
+        "construction_sec": round(construction_sec, 4),
+        "construction_python_peak_mb": round(python_peak / 1024 / 1024, 2),
+    }
+
+    for kind, smiles_list in queries.items():
+        latencies = []
+        hits = 0
+        errors = 0
+        started = time.perf_counter()
+        for smiles in smiles_list:
+            t = time.perf_counter()
+            try:
+                hits += len(reg_checker.check(smiles))
+            except Exception:
+                errors += 1 # RDKitが例外を出す構造もある (件数だけ記録)
+            latencies.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - started
+        result[kind] = dict(
+            _latency_summary(latencies),
+            queries=len(smiles_list),
+            hits=hits,
+            errors=errors,
+            throughput_per_sec=round(len(smiles_list) / elapsed, 1)
+        )
+
+    # 類似度検索 (1回目は索引の作成を含む)
+    started = time.perf_counter()
+    reg_checker.similar(queries["single"][0])
+    result["similarity_first_sec"] = round(time.perf_counter() - started, 4)
+    latencies = []
+    started = time.perf_counter()
+    for smiles in queries["single"]:
+        t = time.perf_counter()
+        reg_checker.similar(smiles)
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+    result["similarity"] = dict(_latency_summary(latencies), throughput_per_sec=round(len(latencies) / elapsed, 1))
+
+    result["screen_stats"] = dict(reg_checker.screen_stats)
+    result["tree"] = dict(reg_checker.tree.stats)
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+
+# OPSINの代わり (名前のハッシュから決まったSMILESを返す。1割は変換失敗)
+def install_stub_opsin(smiles_pool):
+    import ja_to_smiles
+
+    def stub_convert(english_name):
+        digest = int(hashlib.sha1(english_name.encode("utf-8")).hexdigest(), 16)
+        if digest % 10 == 0:
+            return None
+        return smiles_pool[digest % len(smiles_pool)]
+
+    ja_to_smiles.convert_name_to_smiles = stub_convert
+    ja_to_smiles.convert_names_to_smiles = lambda names: [stub_convert(n) for n in names]
+
+
+def bench_translator(name_count, seed):
+    RDLogger.DisableLog("rdApp.*")
+    import checker
+    import ja_to_smiles
+    import pipeline
+    import search_cache
+
+    rng = random.Random(seed)
+    names = generate_japanese_names(name_count, rng)
+
+    result = {"names": len(names)}
+    for stage, func in [
+        ("normalize_text", ja_to_smiles.normalize_text),
+        ("tokenize_and_parse", lambda n: ja_to_smiles.tokenize_and_parse(ja_to_smiles.normalize_text(n))),
+        ("japanese_to_english", lambda n: ja_to_smiles.translate_tokens_with_reorder(ja_to_smiles.tokenize_and_parse(ja_to_smiles.normalize_text(n)))),
+        # 前もって訳語を決めた表で翻訳
+        ("translate_compiled", ja_to_smiles.tokenizer.translate),
+        # pipelineの翻訳 (段ごとの計測つき。キャッシュに入る前の1周目)
+        ("translate_pipeline", pipeline.japanese_to_english),
+    ]:
+        if stage == "translate_pipeline":
+            search_cache.name_cache.clear()
+        latencies = []
+        started = time.perf_counter()
+        for name in names:
+            t = time.perf_counter()
+            func(name)
+            latencies.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - started
+        result[stage] = dict(_latency_summary(latencies), throughput_per_sec=round(len(names) / elapsed, 1))
+
+    # 検索全体 (スタブOPSIN + 同梱の法律DB)。1回目はキャッシュなし、2回目はキャッシュあり
+    regulation_db = checker.load_and_merge_laws()
+    install_stub_opsin(list(regulation_db))
+    reg_checker = checker.check_regulations(regulation_db)
+    search_cache.clear_all()
+    for label in ("pipeline_cold", "pipeline_warm"):
+        started = time.perf_counter()
+        for name in names:
+            pipeline.run_search(name, reg_checker)
+        elapsed = time.perf_counter() - started
+        result[label] = {"throughput_per_sec": round(len(names) / elapsed, 1)}
+
+    # 入力の種類ごと (キャッシュなし): SMILES / 英語名 (日本語名を翻訳したもの) / 日本語名
+    english_names = [n for n in (ja_to_smiles.japanese_to_english(name) for name in names) if n.isascii()]
+    smiles_inputs = [pattern for pattern in regulation_db][:len(names)]
+    for route, inputs in [("smiles", smiles_inputs), ("name", english_names), ("japanese", names)]:
+        search_cache.clear_all()
+        latencies = []
+        started = time.perf_counter()
+        for text in inputs:
+            t = time.perf_counter()
+            pipeline.run_search(text, reg_checker)
+            latencies.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - started
+        result[f"route_{route}"] = dict(_latency_summary(latencies), throughput_per_sec=round(len(inputs) / elapsed, 1))
+
+    return result
+
+
+
+
+def _run_isolated(func, *args):
+    # 計測ごとに新しいプロセスを使い、メモリのピークが混ざらないようにする
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(func, args)
+
+
+def run_all(sizes, query_count, name_count, seed):
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "rdkit": rdBase.rdkitVersion,
+            "platform": platform.platform(),
+            "seed": seed,
+            "query_count": query_count,
+            "name_count": name_count,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "checker": {str(size): _run_isolated(bench_checker_size, size, query_count, seed) for size in sizes},
+        "translator": _run_isolated(bench_translator, name_count, seed),
+    }
+
+
+
+
+# --- ベースラインとの比較 ---
+
+# 数値の葉を "checker.100.single.median_ms" の形で平らにする
+def _flatten(data, prefix=""):
+    flat = {}
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+# 値が大きい方が良い指標か (throughputなど)。時間・メモリは小さい方が良い
+def _higher_is_better(metric):
+    return metric.endswith("_per_sec")
+
+
+def _is_timing(metric):
+    return metric.endswith(("_ms", "_sec", "_mb", "_per_sec"))
+
+
+def compare(current, baseline, threshold=REGRESSION_THRESHOLD):
+    now = _flatten({k: v for k, v in current.items() if k != "meta"})
+    before = _flatten({k: v for k, v in baseline.items() if k != "meta"})
+    rows = []
+    regressions = []
+    for metric in sorted(now):
+        if metric not in before or not _is_timing(metric) or not before[metric]:
+            continue
+        change = (now[metric] - before[metric]) / before[metric]
+        worse = -change if _higher_is_better(metric) else change
+        rows.append((metric, before[metric], now[metric], change))
+        if worse > threshold:
+            regressions.append(metric)
+    return rows, regressions
+
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run_benchmarks", description="チェッカーと翻訳処理のベンチマーク")
+    parser.add_argument("-o", "--output", help="結果を書き出すJSONファイル")
+    parser.add_argument("--baseline", help="比較するベースラインのJSONファイル")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="合成DBのパターン数")
+    parser.add_argument("--queries", type=int, default=200, help="クエリの種類ごとの件数")
+    parser.add_argument("--names", type=int, default=2000, help="翻訳ベンチマークの日本語名の件数")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="悪化とみなす割合")
+    parser.add_argument("--fail-on-regression", action="store_true", help="悪化があれば終了コード1")
+    args = parser.parse_args(argv)
+
+    results = run_all(args.sizes, args.queries, args.names, args.seed)
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        for key in ("seed", "query_count", "name_count", "rdkit"):
+            if baseline.get("meta", {}).get(key) != results["meta"][key]:
+                print(f"注意: ベースラインと条件({key})が異なります。", file=sys.stderr)
+        rows, regressions = compare(results, baseline, args.threshold)
+        for metric, before, now, change in rows:
+            mark = " !!" if metric in regressions else ""
+            print(f"{metric:60s} {before:>12} -> {now:>12} ({change:+.1%}){mark}", file=sys.stderr)
+        if regressions:
+            print(f"{len(regressions)}件の指標が{args.threshold:.0%}以上悪化しました。", file=sys.stderr)
+            if args.fail_on_regression:
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
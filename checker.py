@@ -1,8 +1,19 @@
+import hashlib
 import json
+import logging
 import os
-import re
 import sys
-from rdkit import Chem
+import threading
+import time
+import numpy as np
+from rdkit import Chem, DataStructs
+
+import match_profile
+import pattern_tree
+import search_cache
+import similarity
+
+logger = logging.getLogger(__name__)
 
 # 法律JSONのロード
 LAW_SOURCES = [
@@ -15,17 +26,22 @@ LAW_SOURCES = [
 
 
 
-def load_and_merge_laws():
+# missing_ok=False なら、ファイルが1つでもなければ FileNotFoundError にする (読み直し用)
+def load_and_merge_laws(missing_ok=True):
     # 構造: { "SMILES": { "law": "...", "name": "...", "scope": [...], "description": "..." } }
 
     merged_laws = {}
 
     for filepath, law_name in LAW_SOURCES:
         if not os.path.exists(filepath):
-            print(f"[Warning] {filepath} が見つかりません。")
+            if not missing_ok:
+                raise FileNotFoundError(f"{filepath} が見つかりません。")
+            logger.warning(f"{filepath} が見つかりません。")
             continue
         with open(filepath, 'r', encoding='utf-8') as f:
             data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError(f"{filepath} の形式が不正です (SMILESをキーにしたオブジェクトではありません)")
 
         # 辞書をマージする
         for pattern, info in data.items():
@@ -41,32 +57,283 @@ def load_and_merge_laws():
 
     return merged_laws
 
-REGULATION_DB = load_and_merge_laws()
 
-print(REGULATION_DB)
+
+
+MAX_ATOMIC_NUM = 118
+
+COMPOUND_TYPE_CACHE_SIZE = 8192  # 化合物の有機・無機判定を覚えておく件数
+
+
+
+
+# 水和物判定用 (水のフラグメントの正規化SMILES)
+WATER_SMILES = {"O", "[OH2]", "[OH2+]", "[OH3+]"}
+
+
+
+
+# 完全一致判定用のキー (Isomeric SMILES, 立体を除いたSMILES)
+# 同位体があると立体を除いたSMILESが同じでもマッチしないので、その場合は異性体キーを作らない
+def canonical_keys(mol):
+    try:
+        canon = Chem.MolToSmiles(mol, isomericSmiles=True)
+    except Exception:
+        return None, None
+    if any(atom.GetIsotope() for atom in mol.GetAtoms()):
+        return canon, None
+    try:
+        flat = Chem.MolToSmiles(mol, isomericSmiles=False)
+    except Exception:
+        flat = None
+    return canon, flat
+
+
+
+
+# 元素ごとの原子数 (原子番号 -> 数)
+# ダミー原子(*, 原子番号0)はどの元素にもマッチするので数えない
+def element_counts(mol):
+    counts = {}
+    for atom in mol.GetAtoms():
+        z = atom.GetAtomicNum()
+        if z:
+            counts[z] = counts.get(z, 0) + 1
+    return counts
+
+
+# 原子番号ごとの原子数の配列 (添字 = 原子番号)
+def element_vector(mol):
+    atomic_nums = np.fromiter((atom.GetAtomicNum() for atom in mol.GetAtoms()), dtype=np.intp)
+    return np.bincount(atomic_nums, minlength=MAX_ATOMIC_NUM + 1)
+
+
+
+
+# 登録SMILES 1つ分の前計算 (不正なSMILESならNone)
+def compile_pattern(smiles_pattern):
+    mol = Chem.MolFromSmiles(smiles_pattern)
+    if mol is None:
+        return None
+    canon, flat = canonical_keys(mol)
+    return {
+        "mol": mol,                              # 検索用オブジェクト
+        "fp": Chem.PatternFingerprint(mol),      # 足切り用指紋 (部分構造ならパターンのビットは必ず対象のビットに含まれる)
+        "canon": canon,                          # 完全一致判定用のIsomeric SMILES
+        "flat": flat,                            # 異性体判定用の立体なしSMILES
+        "num_atoms": mol.GetNumAtoms(),          # 原子数 (足切り用)
+        "elements": element_counts(mol)          # 元素ごとの原子数 (足切り用。原子番号 -> 数)
+    }
+
+
+
+
+# 登録1件分 (SMILESとその法律情報のリスト) の中身のハッシュ (作り直す前後の差分の確認用)
+def entry_hash(smiles_pattern, reg_list):
+    content = json.dumps([smiles_pattern, reg_list], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+# 2つの版の差分 (引数は 登録SMILES -> entry_hash() の辞書)
+# changed: SMILESは同じで法律情報(名前・scopeなど)が変わったもの
+def diff_entries(old_hashes, new_hashes):
+    return {
+        "added": sorted(k for k in new_hashes if k not in old_hashes),
+        "removed": sorted(k for k in old_hashes if k not in new_hashes),
+        "changed": sorted(k for k in new_hashes if k in old_hashes and new_hashes[k] != old_hashes[k])
+    }
+
+
+# DBの全登録SMILESを前計算する
+# previous: 以前の前計算 (登録SMILES -> compile_pattern()の結果)。同じSMILESはそれを使い回し、解析しない
+# 戻り値: (前計算の辞書, 不正なSMILESのリスト, {"reused": 使い回した数, "compiled": 解析した数})
+def compile_patterns(regulation_db, previous=None):
+    previous = previous or {}
+    compiled = {}
+    invalid = []
+    stats = {"reused": 0, "compiled": 0}
+    for smiles_pattern in regulation_db:
+        entry = previous.get(smiles_pattern)
+        if entry is not None:
+            stats["reused"] += 1
+        else:
+            entry = compile_pattern(smiles_pattern)
+            stats["compiled"] += 1
+        if entry is None:
+            invalid.append(smiles_pattern)
+        else:
+            compiled[smiles_pattern] = entry
+    return compiled, invalid, stats
+
+
+
+
+# scopeのキーワード -> ビット (判定に使うものだけ。それ以外のキーワードはビットなし)
+SCOPE_BITS = {
+    "itself": 1 << 0,               # それ
+    "isomers": 1 << 1,              # その異性体
+    "specific_isomers": 1 << 2,     # 特定の異性体
+    "salts": 1 << 3,                # 及びその塩類
+    "inorganic_salts": 1 << 4,      # その無機塩類
+    "organic_salts": 1 << 5,        # その有機塩類
+    "hydrates": 1 << 6,             # 及びその水和物
+    "esters": 1 << 7,               # そのエステル
+    "ethers": 1 << 8,               # そのエーテル
+    "compounds": 1 << 9,            # その化合物
+    "organic_compounds": 1 << 10,   # その有機化合物
+    "inorganic_compounds": 1 << 11  # その無機化合物
+}
+# 判定結果の注記
+ANNOTATION_EXCEPT_ITSELF = "です。(※法令上は化合物・塩類・水和物のみ規定の可能性あり)"
+ANNOTATION_ANALOGUES = "です。{規制物質(あるいはその異性体)の部分構造と一致} \n法令の該当箇所を確認してください。 \n(誤検知の可能性があります)"
+
+SCOPE_ISOMERS = SCOPE_BITS["isomers"] | SCOPE_BITS["specific_isomers"]
+SCOPE_DERIVATIVES = SCOPE_BITS["esters"] | SCOPE_BITS["ethers"]
+SCOPE_ANY_COMPOUNDS = SCOPE_BITS["compounds"] | SCOPE_BITS["organic_compounds"] | SCOPE_BITS["inorganic_compounds"]
+
+
+def scope_mask(scope):
+    mask = 0
+    for keyword in scope:
+        mask |= SCOPE_BITS.get(keyword, 0)
+    return mask
+
+
+
+
+# 登録パターンの表 (1行 = 登録SMILES 1つと法律情報 1つの組)
+# 列ごとのリスト/配列で持ち、molや指紋は同じSMILESの行どうしで共有する
+class pattern_table:
+    __slots__ = ("smiles", "mols", "fps", "canons", "laws", "infos", "scope_masks", "num_atoms",
+                 "elements", "element_columns", "element_counts", "pattern_ids", "pattern_rows", "_pattern_of")
+
+    def __init__(self):
+        self.smiles = []       # 登録SMILES文字列 (結果表示用)
+        self.mols = []         # 検索用オブジェクト
+        self.fps = []          # 足切り用指紋
+        self.canons = []       # 完全一致判定用のIsomeric SMILES
+        self.laws = []         # 法律名 (intern済み)
+        self.infos = []        # 法律情報 (DBの辞書そのもの。コピーしない)
+        self.scope_masks = []  # scopeのビット (freeze後はnumpy配列)
+        self.num_atoms = []    # 原子数 (freeze後はnumpy配列)
+        self.elements = []     # 元素ごとの原子数 (原子番号 -> 数。freeze後は element_counts にまとめる)
+        self.element_columns = None  # element_counts の列の原子番号 (DBに出てくる元素だけ)
+        self.element_counts = None   # 行 = パターン, 列 = 元素 の原子数の行列
+        self.pattern_ids = []  # 行 -> パターン番号 (同じSMILESの行は同じ番号)
+        self.pattern_rows = [] # パターン番号 -> そのSMILESの最初の行
+        self._pattern_of = {}  # 登録SMILES -> パターン番号 (freezeまで)
+
+
+    def append(self, smiles_pattern, entry, info):
+        self.smiles.append(smiles_pattern)
+        self.mols.append(entry["mol"])
+        self.fps.append(entry["fp"])
+        self.canons.append(entry["canon"])
+        self.laws.append(sys.intern(info["law"]))
+        self.infos.append(info)
+        self.scope_masks.append(scope_mask(info.get("scope", [])))
+        self.num_atoms.append(entry["num_atoms"])
+        self.elements.append(entry["elements"])
+
+        pattern_id = self._pattern_of.setdefault(smiles_pattern, len(self.pattern_rows))
+        if pattern_id == len(self.pattern_rows):
+            self.pattern_rows.append(len(self.smiles) - 1)
+        self.pattern_ids.append(pattern_id)
+
+
+    # 追加が終わったら数値の列を配列にする
+    def freeze(self):
+        self.scope_masks = np.array(self.scope_masks, dtype=np.int32)
+        self.num_atoms = np.array(self.num_atoms, dtype=np.int32)
+
+        self.element_columns = np.array(sorted({z for counts in self.elements for z in counts}), dtype=np.intp)
+        column_of = {z: j for j, z in enumerate(self.element_columns.tolist())}
+        self.element_counts = np.zeros((len(self.elements), len(column_of)), dtype=np.int16)
+        for i, counts in enumerate(self.elements):
+            for z, count in counts.items():
+                self.element_counts[i, column_of[z]] = count
+        self.elements = None
+        self._pattern_of = None
+
+
+    # フラグメントに部分構造として含まれ得るパターンの番号
+    # 原子数が多すぎるもの、フラグメントより多くの原子を持つ元素があるものを除く
+    # frag_elements: 原子番号ごとの原子数の配列 (element_vector()の結果)
+    def prefilter(self, num_atoms, frag_elements):
+        possible = self.num_atoms <= num_atoms
+        if self.element_columns.size:
+            possible &= (self.element_counts <= frag_elements[self.element_columns]).all(axis=1)
+        return np.flatnonzero(possible)
+
+
+    def __len__(self):
+        return len(self.smiles)
+
 
 
 
 #SMILESを受け取り、規制リストにヒットしたものを詳細情報付きで返す
 class check_regulations:
-    def __init__(self, regulation_db):
-        self.patterns = []
+    # compiled: 登録SMILES -> compile_pattern()の結果 (スナップショットや以前のチェッカーから渡すと、同じSMILESの前計算を省略できる)
+    # tree_parents: 以前の包含関係の木 (tree_parents() の結果)。渡すと木を変わった所だけ作り直す
+    def __init__(self, regulation_db, compiled=None, tree_parents=None):
+        self.patterns = pattern_table()
+
+        # 登録ごとの中身のハッシュと、DB全体のハッシュ (判定結果のキャッシュが古くなったかの判定用)
+        self.entry_hashes = {smiles_pattern: entry_hash(smiles_pattern, reg_list) for smiles_pattern, reg_list in regulation_db.items()}
+        content = "".join(sorted(self.entry_hashes.values()))
+        self.db_version = hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+        # 前計算 (作り直すときに次のチェッカーへ渡す)
+        self.compiled, invalid, self.compile_stats = compile_patterns(regulation_db, compiled)
+        for smiles_pattern in invalid:
+            reg_list = regulation_db[smiles_pattern]
+            if reg_list:
+                name_ref = reg_list[0].get('name', 'Unknown')
+            else:
+                name_ref = 'Unknown'
+            logger.warning(f"DB登録エラー: '{name_ref}' のSMILESが不正です。スキップします。")
+
+        # 完全一致・異性体の索引 (正規化SMILES -> パターン番号の集合)
+        self.exact_index = {}   # Isomeric SMILES (そのもの)
+        self.isomer_index = {}  # 立体を除いたSMILES (異性体)
 
         for smiles_pattern, reg_list in regulation_db.items():
-            mol = Chem.MolFromSmiles(smiles_pattern)
-            if mol:
-                for info in reg_list:
-                    self.patterns.append({
-                        "smiles": smiles_pattern,  # 結果表示用
-                        "mol": mol,                # 検索用オブジェクト
-                        "info": info               # 法律情報
-                    })
-            else:
-                if reg_list:
-                    name_ref = reg_list[0].get('name', 'Unknown')
+            entry = self.compiled.get(smiles_pattern)
+            if entry is None:
+                continue
+            canon = entry["canon"]
+            flat = entry["flat"]
+            for info in reg_list:
+                if canon is not None:
+                    self.exact_index.setdefault(canon, set()).add(len(self.patterns))
+                if flat is not None:
+                    self.isomer_index.setdefault(flat, set()).add(len(self.patterns))
+                self.patterns.append(smiles_pattern, entry, info)
+        self.patterns.freeze()
+
+        # 登録パターンの包含関係の木 (親が含まれない入力では、子孫の部分構造マッチを省略する)
+        rows = self.patterns.pattern_rows
+        known_parents = None
+        if tree_parents:
+            node_of = {self.patterns.smiles[row]: node for node, row in enumerate(rows)}
+            known_parents = []
+            for row in rows:
+                smiles_pattern = self.patterns.smiles[row]
+                if smiles_pattern not in tree_parents:
+                    known_parents.append(None)
+                elif tree_parents[smiles_pattern] is None:
+                    known_parents.append(-1)
                 else:
-                    name_ref = 'Unknown'
-                print(f"[Warning] DB登録エラー: '{name_ref}' のSMILESが不正です。スキップします。", file=sys.stderr)
+                    known_parents.append(node_of.get(tree_parents[smiles_pattern])) # 親が消えていれば探し直す
+        self.tree = pattern_tree.containment_tree(
+            [self.patterns.mols[row] for row in rows],
+            [self.patterns.fps[row] for row in rows],
+            self.patterns.num_atoms[rows],
+            self.patterns.element_counts[rows],
+            known_parents
+        )
+        logger.debug(f"包含関係の木: {self.tree.stats}")
 
 
         # 化合物側鎖判定用 (ダミー原子形: *)
@@ -78,6 +345,11 @@ class check_regulations:
             "S=C=S"         # 二硫化炭素 (これはそのまま)
         ]
         self.inorganic_sidechain_patterns = [Chem.MolFromSmarts(s) for s in inorganic_sidechains]
+        # これより原子の多い側鎖はどの例外パターンにも当てはまらない
+        self._max_sidechain_atoms = max(pat.GetNumAtoms() for pat in self.inorganic_sidechain_patterns) + 1
+
+        # 化合物の有機・無機判定の結果 (同じ物質・同じ登録SMILESの組み合わせは何度も出てくる)
+        self.compound_type_cache = search_cache.lru_ttl_cache("compound_type", maxsize=COMPOUND_TYPE_CACHE_SIZE)
 
 
         # 塩判定用
@@ -90,40 +362,77 @@ class check_regulations:
         ]
         self.inorganic_salt_patterns = [Chem.MolFromSmarts(s) for s in inorganic_exceptions]
 
+        # 照合コストの計測 (enable_profiling() で有効にする。Noneなら計測しない)
+        self.profiler = None
+
+        # 類似度検索の索引 (similar() を最初に使うときに作る)
+        self._similarity_index = None
+        self._similarity_lock = threading.Lock()
+
+        # 指紋による足切りの統計 (累計)
+        # candidates: 照合対象になったパターン数, prefiltered: 原子数・元素の数で除いた数
+        # pruned: 指紋で部分構造マッチを省略できた数
+        # indexed: 完全一致・異性体の索引だけで一致が確定した数, substructure: 部分構造マッチを実行した数
+        # tree_pruned: 包含関係の木で親が外れたため、部分構造マッチを省略したパターン数
+        self.screen_stats = {"queries": 0, "candidates": 0, "prefiltered": 0, "pruned": 0, "indexed": 0, "substructure": 0, "tree_pruned": 0}
+
+
+
+
+    # 照合コストの計測を始める (以後のチェックで登録SMILESごとに記録する)
+    def enable_profiling(self):
+        if self.profiler is None:
+            self.profiler = match_profile.match_profiler()
+        return self.profiler
+
+
+    def disable_profiling(self):
+        self.profiler = None
+
 
 
 
     # 化合物の場合の有機・無機チェック
-    def _analyze_compound_type(self, whole_mol, core_mol):
+    # core_smiles: 登録SMILES (照合コストの計測用)
+    def _analyze_compound_type(self, whole_mol, core_mol, core_smiles=None):
         # コア構造を除去して「側鎖(Side Chains)」だけを取り出す
-        side_chains_mol = Chem.ReplaceCore(whole_mol, core_mol) # ReplaceCoreは、除去した部分にダミー原子(*)を残して側鎖を返す
+        profiler = self.profiler
+        if profiler is None:
+            side_chains_mol = Chem.ReplaceCore(whole_mol, core_mol) # ReplaceCoreは、除去した部分にダミー原子(*)を残して側鎖を返す
+        else:
+            started = time.perf_counter()
+            side_chains_mol = Chem.ReplaceCore(whole_mol, core_mol)
+            profiler.record(core_smiles, "ReplaceCore", time.perf_counter() - started)
 
         if side_chains_mol is None:
             return None
 
-        # 鎖を個別のフラグメントに分解
-        fragments = Chem.GetMolFrags(side_chains_mol, asMols=True)
-
-        is_organic = False
+        # 原子ごとのフラグメント番号と原子番号を配列にして、フラグメントごとの炭素数・原子数をまとめて数える
+        # (ダミー原子(*)は原子番号0なので炭素に数えない)
+        frag_atoms = Chem.GetMolFrags(side_chains_mol)
+        if not frag_atoms:
+            return "無機化合物"
+        frag_ids = np.empty(side_chains_mol.GetNumAtoms(), dtype=np.intp)
+        for frag_id, atom_indices in enumerate(frag_atoms):
+            frag_ids[list(atom_indices)] = frag_id
+        atomic_nums = np.fromiter((atom.GetAtomicNum() for atom in side_chains_mol.GetAtoms()), dtype=np.intp)
+        c_counts = np.bincount(frag_ids, weights=(atomic_nums == 6), minlength=len(frag_atoms))
+        atom_counts = np.bincount(frag_ids, minlength=len(frag_atoms))
+
+        # 炭素がある側鎖 -> 基本的に有機 + 例外チェック
+        # 炭素数が3以上、または例外パターンより大きい側鎖は、パターンを試すまでもなく「有機」
+        has_carbon = c_counts > 0
+        surely_organic = has_carbon & ((c_counts > 2) | (atom_counts > self._max_sidechain_atoms))
+        if surely_organic.any():
+            return "有機化合物"
 
-        for frag in fragments:
-            # ダミー原子(*)以外の原子で、炭素(C)があるか探す
-            c_count = 0
-            atoms = frag.GetAtoms()
-            for atom in atoms:
-                # 原子番号0はダミー原子なので無視
-                if atom.GetAtomicNum() != 0 and atom.GetSymbol() == 'C':
-                    c_count += 1
-
-            if c_count > 0:
-                # 炭素がある場合 -> 基本的に有機 + 例外チェック
+        # 炭素数が少ない側鎖だけ、例外パターンにマッチするか確認
+        needs_smarts = np.flatnonzero(has_carbon)
+        if len(needs_smarts):
+            fragments = Chem.GetMolFrags(side_chains_mol, asMols=True)
+            for frag_id in needs_smarts:
+                frag = fragments[frag_id]
                 is_exception = False
-                # 炭素数が3以上なら、複雑なので「有機」
-                if c_count > 2:
-                    is_organic = True
-                    break
-
-                # 炭素数が少ない場合、例外パターンにマッチするか確認
                 for pat in self.inorganic_sidechain_patterns:
                     if frag.HasSubstructMatch(pat):
                         # マッチしたが、原子数がパターンとほぼ同じか確認(余計な有機鎖がないか)
@@ -133,13 +442,22 @@ class check_regulations:
                             break
 
                 if not is_exception:
-                    is_organic = True
-                    break # 一つでも有機基があれば、全体として「有機化合物」
+                    return "有機化合物" # 一つでも有機基があれば、全体として「有機化合物」
 
-        if is_organic:
-            return "有機化合物"
-        else:
-            return "無機化合物" # 炭素がない(Cl, S, Pのみ)、または例外無機炭素のみ
+        return "無機化合物" # 炭素がない(Cl, S, Pのみ)、または例外無機炭素のみ
+
+
+    # _analyze_compound_type の結果を (対象の正規化SMILES, 登録SMILES) ごとに覚えておく
+    def _compound_type(self, whole_mol, whole_canon, core_mol, core_smiles):
+        if whole_canon is None:
+            return self._analyze_compound_type(whole_mol, core_mol, core_smiles)
+
+        key = (whole_canon, core_smiles)
+        comp_type = self.compound_type_cache.get(key, self.db_version)
+        if comp_type is search_cache.MISS:
+            comp_type = self._analyze_compound_type(whole_mol, core_mol, core_smiles)
+            self.compound_type_cache.put(key, self.db_version, comp_type)
+        return comp_type
 
 
 
@@ -172,13 +490,50 @@ class check_regulations:
 
 
 
-    def check(self, target_smiles):
+    # 入力の各フラグメントの下調べ (checkの最初に1回だけ行う)
+    # 戻り値: フラグメントと同じ順の辞書のリスト
+    #   canon/flat: 索引用のSMILES, num_atoms: 原子数, elements: 原子番号ごとの原子数, is_water: 水かどうか,
+    #   salt_type: 塩として見た場合の種類 (より大きいフラグメントがあって塩になり得るものだけ。それ以外はNone)
+    def _analyze_fragments(self, fragments):
+        frag_infos = []
+        profiler = self.profiler
+        for frag in fragments:
+            if profiler is None:
+                canon, flat = canonical_keys(frag)
+            else:
+                started = time.perf_counter()
+                canon, flat = canonical_keys(frag)
+                profiler.record(match_profile.INPUT_KEY, "MolToSmiles", time.perf_counter() - started)
+            frag_infos.append({
+                "canon": canon,
+                "flat": flat,
+                "num_atoms": frag.GetNumAtoms(),
+                "elements": element_vector(frag),
+                "is_water": canon in WATER_SMILES,
+                "salt_type": None
+            })
+
+        largest = max((info["num_atoms"] for info in frag_infos), default=0)
+        for frag, info in zip(fragments, frag_infos):
+            if not info["is_water"] and info["num_atoms"] < largest:
+                info["salt_type"] = self._classify_salt_type(frag)
+        return frag_infos
+
+
+
+
+    # 指紋で足切りした数などをstatsに書き込む (statsに辞書を渡した場合)
+    def check(self, target_smiles, stats=None):
         # 入力チェック
         target_mol = Chem.MolFromSmiles(target_smiles)
         if target_mol is None:
-            print(f"[Error] 入力されたSMILES '{target_smiles}' は解析できませんでした。")
+            logger.error(f"入力されたSMILES '{target_smiles}' は解析できませんでした。")
             return [] 
+        return self.check_mol(target_mol, stats)
+
 
+    # 解析済みの分子をチェックする (SDFなどから読んだ分子をSMILESに戻さずに渡す用)
+    def check_mol(self, target_mol, stats=None):
         # 前処理
         try:
             fragments = Chem.GetMolFrags(target_mol, asMols=True, sanitizeFrags=True)
@@ -186,129 +541,168 @@ class check_regulations:
             fragments = [target_mol]
 
         
-        # 水和物判定用
-        water_patterns = {"O", "[OH2]", "[OH2+]", "[OH3+]"}
+        # フラグメントごとの下調べ (正規化SMILES・原子数・水かどうか・塩の種類) を1回だけ行う
+        frag_infos = self._analyze_fragments(fragments)
 
         found_regulations = []
+        candidates = 0
+        prefiltered = 0
+        pruned = 0
+        indexed = 0
+        counts = {"substructure": 0, "tree_pruned": 0}
 
         # 全フラグメント総当たりチェック
         for i, main_frag in enumerate(fragments):
+            frag_info = frag_infos[i]
+
+            # 足切り用の指紋 (作れなければ足切りしない)
+            try:
+                frag_fp = Chem.PatternFingerprint(main_frag)
+            except Exception:
+                frag_fp = None
+
+            # 索引で「そのもの・異性体」と分かるパターンは部分構造マッチを省略
+            frag_canon = frag_info["canon"]
+            known_hits = self.exact_index.get(frag_canon, set()) | self.isomer_index.get(frag_info["flat"], set())
 
-            # 塩類チェック
-            other_frags = [f for j, f in enumerate(fragments) if j != i]
+            # パターン番号 -> このフラグメントに含まれるか (同じSMILESの行・木の親子で使い回す)
+            memo = {self.patterns.pattern_ids[idx]: True for idx in known_hits}
+
+            # 塩類チェック (他のフラグメントの下調べ結果を使う)
             env_has_hydrate = False
             detected_salt_types = set()
 
-            for other in other_frags:
-                smi = Chem.MolToSmiles(other, isomericSmiles=True, canonical=True)
+            for j, other_info in enumerate(frag_infos):
+                if j == i:
+                    continue
                 # 水判定
-                if smi in water_patterns:
+                if other_info["is_water"]:
                     env_has_hydrate = True
                     continue
                 # 塩判定 (自分より小さいものを塩候補とする)
-                if other.GetNumAtoms() < main_frag.GetNumAtoms():
-                    salt_category = self._classify_salt_type(other)
-                    detected_salt_types.add(salt_category)
+                if other_info["num_atoms"] < frag_info["num_atoms"]:
+                    detected_salt_types.add(other_info["salt_type"])
 
 
 
 
             # DB照合
-            for pattern_data in self.patterns:
-                query_mol = pattern_data["mol"]     # 規制対象の構造
-                info = pattern_data["info"]         # 法律情報
-                db_smiles = pattern_data["smiles"]  # 登録SMILES文字列
-                scope = info.get("scope", [])
-                detected_type = None
+            # 原子数・元素ごとの原子数がフラグメントより多いパターンは部分構造になり得ないので、まとめて除く
+            table = self.patterns
+            candidates += len(table)
+            candidate_indices = table.prefilter(frag_info["num_atoms"], frag_info["elements"]).tolist()
+            prefiltered += len(table) - len(candidate_indices)
+
+            for idx in candidate_indices:
+                is_known_hit = idx in known_hits
+                if is_known_hit:
+                    indexed += 1
+
+                # パターンの指紋ビットが対象に揃っていなければ部分構造になり得ない
+                elif frag_fp is not None and not DataStructs.AllProbeBitsMatch(table.fps[idx], frag_fp):
+                    pruned += 1
+                    continue
 
-                controlled_isomers = ("isomers" in scope) or ("specific_isomers" in scope) #["その異性体", "特定の異性体"]
-                controlled_salts = ("salts" in scope) # ["及びその塩類"]
-                controlled_hydrate = ("hydrates" in scope) # ["及びその水和物"]
-                controlled_derivatives = ("esters" in scope) or ("ethers" in scope) # ["そのエステル", "そのエーテル"]
-                controlled_compounds = ("compounds" in scope) or ("organic_compounds" in scope) or ("inorganic_compounds" in scope) # ["その化合物", "その有機塩類", その無機塩類]
-                controlled_itself = ("itself" in scope) # ["それ"]
+                query_mol = table.mols[idx]  # 規制対象の構造
 
-                annotation_text_except_itself = "です。(※法令上は化合物・塩類・水和物のみ規定の可能性あり)"
-                annotation_text_analogues = "です。{規制物質(あるいはその異性体)の部分構造と一致} \n法令の該当箇所を確認してください。 \n(誤検知の可能性があります)"
-            
                 # RDKit 部分構造マッチ
-                if main_frag.HasSubstructMatch(query_mol):
-                
-                    # A. 完全一致判定 (Isomeric SMILESで比較)(原子数が同じなら、余計なものがついていない -> そのものか異性体)
-                    if main_frag.GetNumAtoms() == query_mol.GetNumAtoms():
-                        try:
-                            input_canon = Chem.MolToSmiles(main_frag, isomericSmiles=True)
-                            query_canon = Chem.MolToSmiles(query_mol, isomericSmiles=True)
-                        
-                            if input_canon == query_canon:
-                                base_name = "それ(完全一致)"
-                            else:
-                                base_name = "その異性体"
-
-                            if controlled_itself or controlled_isomers:
-                                detected_type = base_name
-                            else:
-                                # scopeに本体が含まれていないが、構造は完全に一致している(塩のみ規制などの場合)
-                                # 後で塩チェックに引っかかれば上書きされるよう、仮置き
-                                detected_type = f"{base_name} {annotation_text_except_itself}"
-                        except:
-                            detected_type = "それ(構造一致)"
-                
-                    # B. 部分一致 (誘導体・化合物)
+                if is_known_hit:
+                    matched = True
+                else:
+                    matched = self._match_pattern(table.pattern_ids[idx], main_frag, frag_fp, memo, counts)
+
+                if not matched:
+                    continue
+
+                info = table.infos[idx]         # 法律情報
+                db_smiles = table.smiles[idx]   # 登録SMILES文字列
+                scope = info.get("scope", [])
+                mask = int(table.scope_masks[idx])
+                detected_type = None
+
+                controlled_isomers = mask & SCOPE_ISOMERS #["その異性体", "特定の異性体"]
+                controlled_salts = mask & SCOPE_BITS["salts"] # ["及びその塩類"]
+                controlled_hydrate = mask & SCOPE_BITS["hydrates"] # ["及びその水和物"]
+                controlled_derivatives = mask & SCOPE_DERIVATIVES # ["そのエステル", "そのエーテル"]
+                controlled_compounds = mask & SCOPE_ANY_COMPOUNDS # ["その化合物", "その有機塩類", その無機塩類]
+                controlled_itself = mask & SCOPE_BITS["itself"] # ["それ"]
+
+                # A. 完全一致判定 (Isomeric SMILESで比較)(原子数が同じなら、余計なものがついていない -> そのものか異性体)
+                if frag_info["num_atoms"] == table.num_atoms[idx]:
+                    # 正規化SMILESは前計算済み (作れなかった場合はNone)
+                    input_canon = frag_canon
+                    query_canon = table.canons[idx]
+
+                    if input_canon is None or query_canon is None:
+                        detected_type = "それ(構造一致)"
                     else:
-                        if controlled_derivatives:
-                            detected_type = "その誘導体(エステル/エーテル等)"
-                        elif controlled_compounds:
-                            comp_type = self._analyze_compound_type(main_frag, query_mol)
-                            if "organic_compounds" in scope and comp_type == "有機化合物":
-                                detected_type = "その有機化合物"
-                            elif "inorganic_compounds" in scope and comp_type == "無機化合物":
-                                detected_type = "その無機化合物"
-                            else:
-                                # scopeで細分化されていない、またはscope外の場合
-                                detected_type = f"その化合物({comp_type})"
+                        if input_canon == query_canon:
+                            base_name = "それ(完全一致)"
                         else:
-                            detected_type = f"構造にこれを含む物質 {annotation_text_analogues}"
-
-                    # 塩・水和物の判定 (detected_typeに追記)
-                    suffix = []
-                    if env_has_hydrate:
-                        if controlled_hydrate:
-                            suffix.append("水和物")
-                        elif controlled_salts: 
-                            suffix.append("塩類(水和物)")
+                            base_name = "その異性体"
+
+                        if controlled_itself or controlled_isomers:
+                            detected_type = base_name
                         else:
-                            suffix.append("水和物(※対象の可能性)")
-
-                    if detected_salt_types:
-                        for stype in detected_salt_types:
-                            if "inorganic_salts" in scope and stype == "無機塩類":
-                                suffix.append("無機塩類")
-                            elif "organic_salts" in scope and stype == "有機塩類":
-                                suffix.append("有機塩類")
-                            elif "salts" in scope:
-                                suffix.append("塩類")
-                            elif "compounds" in scope:
-                                suffix.append(f"化合物({stype})")
-                            #else:
-                            #    suffix.append("塩類(※規制対象外の可能性あり)")
-
-                    # 塩類の場合の文字列結合
-                    if suffix:
-                        suffix_str = '/'.join(suffix)
-                        if detected_type:
-                            clean_name = detected_type.replace(annotation_text_except_itself, "").strip()
-                            if annotation_text_analogues in clean_name:
-                                detected_type = f"{clean_name} の{suffix_str}{annotation_text_analogues}"
-                            else:
-                                detected_type = f"{clean_name} の{suffix_str}"
+                            # scopeに本体が含まれていないが、構造は完全に一致している(塩のみ規制などの場合)
+                            # 後で塩チェックに引っかかれば上書きされるよう、仮置き
+                            detected_type = f"{base_name} {ANNOTATION_EXCEPT_ITSELF}"
+
+                # B. 部分一致 (誘導体・化合物)
+                else:
+                    if controlled_derivatives:
+                        detected_type = "その誘導体(エステル/エーテル等)"
+                    elif controlled_compounds:
+                        comp_type = self._compound_type(main_frag, frag_canon, query_mol, db_smiles)
+                        if mask & SCOPE_BITS["organic_compounds"] and comp_type == "有機化合物":
+                            detected_type = "その有機化合物"
+                        elif mask & SCOPE_BITS["inorganic_compounds"] and comp_type == "無機化合物":
+                            detected_type = "その無機化合物"
+                        else:
+                            # scopeで細分化されていない、またはscope外の場合
+                            detected_type = f"その化合物({comp_type})"
+                    else:
+                        detected_type = f"構造にこれを含む物質 {ANNOTATION_ANALOGUES}"
+
+                # 塩・水和物の判定 (detected_typeに追記)
+                suffix = []
+                if env_has_hydrate:
+                    if controlled_hydrate:
+                        suffix.append("水和物")
+                    elif controlled_salts:
+                        suffix.append("塩類(水和物)")
+                    else:
+                        suffix.append("水和物(※対象の可能性)")
+
+                if detected_salt_types:
+                    for stype in detected_salt_types:
+                        if mask & SCOPE_BITS["inorganic_salts"] and stype == "無機塩類":
+                            suffix.append("無機塩類")
+                        elif mask & SCOPE_BITS["organic_salts"] and stype == "有機塩類":
+                            suffix.append("有機塩類")
+                        elif controlled_salts:
+                            suffix.append("塩類")
+                        elif mask & SCOPE_BITS["compounds"]:
+                            suffix.append(f"化合物({stype})")
+                        #else:
+                        #    suffix.append("塩類(※規制対象外の可能性あり)")
+
+                # 塩類の場合の文字列結合
+                if suffix:
+                    suffix_str = '/'.join(suffix)
+                    if detected_type:
+                        clean_name = detected_type.replace(ANNOTATION_EXCEPT_ITSELF, "").strip()
+                        if ANNOTATION_ANALOGUES in clean_name:
+                            detected_type = f"{clean_name} の{suffix_str}{ANNOTATION_ANALOGUES}"
                         else:
-                            detected_type = f"その{suffix_str}"
+                            detected_type = f"{clean_name} の{suffix_str}"
+                    else:
+                        detected_type = f"その{suffix_str}"
 
                 # 結果リストに追加
                 if detected_type:
                     found_regulations.append({
-                        "law": info["law"],
+                        "law": table.laws[idx],
                         "name": info.get("name", "分類なし"),
                         "detected_type": detected_type,
                         "scope": scope,
@@ -316,11 +710,146 @@ class check_regulations:
                        "pattern_matched": db_smiles
                     })
 
+        self.screen_stats["queries"] += 1
+        self.screen_stats["candidates"] += candidates
+        self.screen_stats["prefiltered"] += prefiltered
+        self.screen_stats["pruned"] += pruned
+        self.screen_stats["indexed"] += indexed
+        self.screen_stats["substructure"] += counts["substructure"]
+        self.screen_stats["tree_pruned"] += counts["tree_pruned"]
+        if stats is not None:
+            stats["candidates"] = candidates
+            stats["prefiltered"] = prefiltered
+            stats["pruned"] = pruned
+            stats["indexed"] = indexed
+            stats["substructure"] = counts["substructure"]
+            stats["tree_pruned"] = counts["tree_pruned"]
+            stats["hits"] = len(found_regulations)
+
         return found_regulations
 
 
 
 
+    # パターンがフラグメントに含まれるか (包含関係の木を根の側から判定し、親が外れたら子は判定しない)
+    # memo: パターン番号 -> 含まれるか (フラグメントごと), counts: substructure / tree_pruned を数える
+    def _match_pattern(self, pattern_id, main_frag, frag_fp, memo, counts):
+        matched = memo.get(pattern_id)
+        if matched is not None:
+            return matched
+
+        # まだ判定していない祖先をたどる
+        parents = self.tree.parents
+        chain = []
+        node = pattern_id
+        while node >= 0 and node not in memo:
+            chain.append(node)
+            node = parents[node]
+        matched = node < 0 or memo[node]
+
+        table = self.patterns
+        for node in reversed(chain):
+            if not matched:
+                counts["tree_pruned"] += 1
+            else:
+                row = table.pattern_rows[node]
+                # 祖先の指紋は未確認 (パターン自身は呼び出し元で確認済み)
+                if node != pattern_id and frag_fp is not None and not DataStructs.AllProbeBitsMatch(table.fps[row], frag_fp):
+                    matched = False
+                else:
+                    counts["substructure"] += 1
+                    if self.profiler is None:
+                        matched = main_frag.HasSubstructMatch(table.mols[row])
+                    else:
+                        started = time.perf_counter()
+                        matched = main_frag.HasSubstructMatch(table.mols[row])
+                        self.profiler.record(table.smiles[row], "HasSubstructMatch", time.perf_counter() - started)
+            memo[node] = matched
+        return matched
+
+
+    # 包含関係の木の親 (登録SMILES -> 親の登録SMILES。親なしはNone)
+    # 次のチェッカーやスナップショットに渡して、木を作り直す手間を省く
+    def tree_parents(self):
+        smiles = [self.patterns.smiles[row] for row in self.patterns.pattern_rows]
+        return {smiles_pattern: smiles[parent] if parent >= 0 else None for smiles_pattern, parent in zip(smiles, self.tree.parents)}
+
+
+    # 一部の登録SMILESだけで判定するチェッカー (前計算は使い回す)
+    def subset(self, smiles_patterns):
+        wanted = set(smiles_patterns)
+        regulation_db = {}
+        for smiles_pattern, info in zip(self.patterns.smiles, self.patterns.infos):
+            if smiles_pattern in wanted:
+                regulation_db.setdefault(smiles_pattern, []).append(info)
+        return check_regulations(regulation_db, self.compiled, self.tree_parents())
+
+
+
+
+    # 類似度検索の索引 (作るのに少し時間がかかるので、最初に使うときに1回だけ作る)
+    def _get_similarity_index(self):
+        with self._similarity_lock:
+            if self._similarity_index is None:
+                index = similarity.similarity_index(self.compiled)
+                rows = {}
+                for idx, smiles_pattern in enumerate(self.patterns.smiles):
+                    rows.setdefault(smiles_pattern, []).append(idx)
+                self._similarity_rows = rows
+                self._similarity_index = index
+            return self._similarity_index
+
+
+    # 構造が似ている登録物質を、Morgan指紋のTanimoto係数の高い順に最大k件返す
+    # (部分構造としては一致しない類縁体を探す用。塩などは最大の成分で比べる)
+    def similar(self, target_smiles, k=similarity.DEFAULT_TOP_K, min_similarity=0.0):
+        target_mol = Chem.MolFromSmiles(target_smiles)
+        if target_mol is None:
+            logger.error(f"入力されたSMILES '{target_smiles}' は解析できませんでした。")
+            return []
+
+        return self._similar_results(self._get_similarity_index().top_k(target_mol, k, min_similarity))
+
+
+    # similar() を複数のSMILESに対してまとめて行う (結果は入力と同じ順。解析できないSMILESは空のリスト)
+    # 全入力の指紋を1つの行列にして、登録パターンの行列との類似度を1回で計算する
+    def similar_many(self, smiles_list, k=similarity.DEFAULT_TOP_K, min_similarity=0.0):
+        mols = []
+        for target_smiles in smiles_list:
+            target_mol = Chem.MolFromSmiles(target_smiles)
+            if target_mol is None:
+                logger.error(f"入力されたSMILES '{target_smiles}' は解析できませんでした。")
+            mols.append(target_mol)
+
+        parsed = [mol for mol in mols if mol is not None]
+        top = iter(self._get_similarity_index().top_k_many(parsed, k, min_similarity))
+        return [self._similar_results(next(top)) if mol is not None else [] for mol in mols]
+
+
+    # (登録SMILES, 類似度) のリストに法律情報を付ける
+    def _similar_results(self, hits):
+        table = self.patterns
+        results = []
+        for smiles_pattern, score in hits:
+            regulations = []
+            for idx in self._similarity_rows[smiles_pattern]:
+                info = table.infos[idx]
+                regulations.append({
+                    "law": table.laws[idx],
+                    "name": info.get("name", "分類なし"),
+                    "scope": info.get("scope", []),
+                    "description": info.get("description", "")
+                })
+            results.append({
+                "pattern_matched": smiles_pattern,
+                "similarity": round(score, 4),
+                "regulations": regulations
+            })
+        return results
+
+
+
+
 def print_report(results):
     if results:
         print("\n" + "-"*40)
@@ -339,8 +868,55 @@ def print_report(results):
 
 
 
-checker = check_regulations(REGULATION_DB)
+# --- プロセスごとに1回だけ作るDBとチェッカー (importしただけでは読み込まない) ---
+_regulation_db = None
+_checker = None
+_load_lock = threading.Lock()
+
+
+# forkした子ではロックを作り直す (親の別スレッドが握ったままforkされると、子ではずっと解けないため)
+def _reset_load_lock():
+    global _load_lock
+    _load_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_load_lock)
+
+
+def get_regulation_db():
+    global _regulation_db
+    with _load_lock:
+        if _regulation_db is None:
+            _regulation_db = load_and_merge_laws()
+        return _regulation_db
+
+
+# スナップショット(python -m regulation_snapshot で作成)があればそこから読み込む
+def get_checker():
+    global _checker, _regulation_db
+    with _load_lock:
+        if _checker is None:
+            import regulation_snapshot
+            loaded = regulation_snapshot.load_checker()
+            if loaded is None:
+                # 法律JSONが変わっていても、古いスナップショットにある登録SMILESの前計算と包含関係の木は使い回す
+                if _regulation_db is None:
+                    _regulation_db = load_and_merge_laws()
+                compiled, tree_parents = regulation_snapshot.load_previous()
+                loaded = check_regulations(_regulation_db, compiled, tree_parents)
+                logger.info(f"法規制DBを読み込みました (解析 {loaded.compile_stats['compiled']}件, 使い回し {loaded.compile_stats['reused']}件)")
+            _checker = loaded
+        return _checker
+
+
+# 作り直したDBとチェッカーに差し替える (hot_reload から使う)
+# 差し替え前に get_checker() で受け取ったチェッカーはそのまま使い続けられる
+def set_checker(new_checker, regulation_db):
+    global _checker, _regulation_db
+    with _load_lock:
+        _checker = new_checker
+        _regulation_db = regulation_db
+
 
 def run_check_and_print(smiles):
-    results = checker.check(smiles)
-    print_report(results)
\ No newline at end of file
+    results = get_checker().check(smiles)
+    print_report(results)
@@ -0,0 +1,226 @@
+import argparse
+import contextlib
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+
+from rdkit import Chem
+
+# SDF / SMILESファイル(.smi)の一括チェック
+# RDKitのサプライヤーで1件ずつ読み、読み込んだ分子をSMILESに戻さずにそのまま check_mol() に渡す。
+# 結果はNDJSONかCSVで1件ずつ書き出すので、数十万件のファイルでもメモリ使用量は一定。
+#
+#   python -m file_screen inventory.sdf -o results.csv
+#   python -m file_screen inventory.smi -o results.ndjson --threads 4
+#
+# --threads が1以上なら、読み込み(分子の組み立て)をRDKitの別スレッドで行い、チェックと並行させる。
+# この場合、結果は読み込みが終わった順に出る (行ごとの "record" が元のファイルでの番号)。
+# 進み具合は --progress 秒ごとに標準エラーへ出す。
+
+DEFAULT_THREADS = 2      # 読み込み用スレッド数 (0なら読み込みもメインスレッドで行い、ファイルの順に出す)
+PROGRESS_INTERVAL = 5.0  # 進み具合を出す間隔(秒)
+
+SDF_EXTENSIONS = (".sdf", ".sd", ".mol")
+SMILES_EXTENSIONS = (".smi", ".smiles", ".ism")
+
+CSV_COLUMNS = ["record", "name", "smiles", "regulated", "laws", "regulation_names", "detected_types", "patterns", "error"]
+
+
+
+
+# 入力形式の推定 (拡張子から)
+def guess_format(filename):
+    filename = filename.lower()
+    if filename.endswith(SDF_EXTENSIONS):
+        return "sdf"
+    if filename.endswith(SMILES_EXTENSIONS):
+        return "smi"
+    raise ValueError(f"入力形式が分かりません (--format で sdf か smi を指定してください): {filename}")
+
+
+def _mol_name(mol):
+    return mol.GetProp("_Name") if mol.HasProp("_Name") else None
+
+
+
+
+# ファイルを1件ずつ読む (番号(1から), 名前, 分子) 読めなかった分子はNone
+def iter_mols(path, fmt, threads=DEFAULT_THREADS, delimiter=" \t", smiles_column=0, name_column=1, title_line=False):
+    if threads > 0:
+        if fmt == "sdf":
+            supplier = Chem.MultithreadedSDMolSupplier(path, numWriterThreads=threads)
+        else:
+            supplier = Chem.MultithreadedSmilesMolSupplier(
+                path, delimiter, smiles_column, name_column, title_line, True, threads
+            )
+        yield from _iter_multithreaded(supplier)
+        return
+
+    if fmt == "sdf":
+        with open(path, "rb") as stream:
+            for record, mol in enumerate(Chem.ForwardSDMolSupplier(stream), 1):
+                yield record, _mol_name(mol) if mol is not None else None, mol
+    else:
+        supplier = Chem.SmilesMolSupplier(path, delimiter, smiles_column, name_column, title_line)
+        for record, mol in enumerate(supplier, 1):
+            yield record, _mol_name(mol) if mol is not None else None, mol
+
+
+# 別スレッドで読む場合
+# 終わり際に、中身が空のものや直前と同じ番号のNoneが返ってくることがあるので読み飛ばす
+def _iter_multithreaded(supplier, window=1024):
+    recent = deque(maxlen=window)
+    recent_set = set()
+    for mol in supplier:
+        record = supplier.GetLastRecordId()
+        if mol is None and (record in recent_set or not supplier.GetLastItemText().strip()):
+            continue
+        if len(recent) == recent.maxlen:
+            recent_set.discard(recent[0])
+        recent.append(record)
+        recent_set.add(record)
+        yield record, _mol_name(mol) if mol is not None else None, mol
+
+
+
+
+# 一括チェック本体 (結果の辞書を1件ずつ返し、最後に集計を返す)
+# progress: progress_interval秒ごとに呼ぶ関数 (集計途中の辞書を渡す)
+def screen_mols(records, reg_checker, progress=None, progress_interval=PROGRESS_INTERVAL):
+    started = time.monotonic()
+    next_report = started + progress_interval
+    rows = 0
+    errors = 0
+    hits = 0
+
+    for record, name, mol in records:
+        result = {"record": record, "name": name}
+        if mol is None:
+            result["error"] = "構造を読み込めませんでした"
+        else:
+            try:
+                result["smiles"] = Chem.MolToSmiles(mol)
+                result["regulations"] = reg_checker.check_mol(mol)
+            except Exception as e:
+                # 1件の失敗で全体を止めない
+                result["error"] = str(e)
+
+        rows += 1
+        if "error" in result:
+            errors += 1
+        elif result["regulations"]:
+            hits += 1
+        yield result
+
+        if progress is not None and time.monotonic() >= next_report:
+            elapsed = time.monotonic() - started
+            progress({"rows": rows, "errors": errors, "regulated": hits, "rows_per_sec": round(rows / elapsed, 1)})
+            next_report = time.monotonic() + progress_interval
+
+    elapsed = time.monotonic() - started
+    yield {
+        "summary": {
+            "rows": rows,
+            "errors": errors,
+            "regulated": hits,
+            "elapsed_sec": round(elapsed, 3),
+            "rows_per_sec": round(rows / elapsed, 1) if elapsed > 0 else None
+        }
+    }
+
+
+
+
+# CSVの1行 (1物質1行。法規制が複数あれば "; " でつなぐ)
+def _csv_row(result):
+    regulations = result.get("regulations") or []
+    return [
+        result["record"],
+        result.get("name") or "",
+        result.get("smiles") or "",
+        len(regulations),
+        "; ".join(reg["law"] for reg in regulations),
+        "; ".join(reg["name"] for reg in regulations),
+        "; ".join(reg["detected_type"] for reg in regulations),
+        "; ".join(reg["pattern_matched"] for reg in regulations),
+        result.get("error", "")
+    ]
+
+
+# 結果を書き出す (集計はNDJSONなら最後の行に書き、CSVには書かない。どちらでも戻り値として返す)
+def write_results(results, sink, output_format):
+    writer = None
+    if output_format == "csv":
+        writer = csv.writer(sink)
+        writer.writerow(CSV_COLUMNS)
+
+    summary = None
+    for result in results:
+        if "summary" in result:
+            summary = result["summary"]
+        if writer is None:
+            sink.write(json.dumps(result, ensure_ascii=False) + "\n")
+        elif "summary" not in result:
+            writer.writerow(_csv_row(result))
+    return summary
+
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m file_screen", description="SDF/SMILESファイルの物質を一括で法規制チェックする")
+    parser.add_argument("input", help="入力ファイル (.sdf / .smi)")
+    parser.add_argument("-o", "--output", default="-", help="出力先 (.csv ならCSV、それ以外はNDJSON。既定: 標準出力にNDJSON)")
+    parser.add_argument("--format", choices=["sdf", "smi"], help="入力形式 (既定: 拡張子から推定)")
+    parser.add_argument("--output-format", choices=["ndjson", "csv"], help="出力形式 (既定: 出力先の拡張子から推定)")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS, help="読み込み用スレッド数 (0ならファイルの順に1件ずつ)")
+    parser.add_argument("--delimiter", default=" \t", help="SMILESファイルの区切り文字")
+    parser.add_argument("--smiles-column", type=int, default=0, help="SMILESファイルのSMILESの列番号 (0から)")
+    parser.add_argument("--name-column", type=int, default=1, help="SMILESファイルの名前の列番号 (0から)")
+    parser.add_argument("--title-line", action="store_true", help="SMILESファイルの1行目が見出し")
+    parser.add_argument("--progress", type=float, default=PROGRESS_INTERVAL, help="進み具合を出す間隔(秒)。0なら出さない")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.environ.get("CHEMREGU_LOG_LEVEL", "WARNING").upper())
+
+    try:
+        fmt = args.format or guess_format(args.input)
+    except ValueError as e:
+        parser.error(str(e))
+    output_format = args.output_format or ("csv" if args.output.lower().endswith(".csv") else "ndjson")
+
+    import checker
+    reg_checker = checker.get_checker()
+
+    def report_progress(status):
+        print(
+            f"処理済み {status['rows']}件 ({status['rows_per_sec']}件/秒, "
+            f"該当 {status['regulated']}件, エラー {status['errors']}件)",
+            file=sys.stderr, flush=True
+        )
+
+    records = iter_mols(args.input, fmt, args.threads, args.delimiter, args.smiles_column, args.name_column, args.title_line)
+    results = screen_mols(records, reg_checker, report_progress if args.progress > 0 else None, args.progress)
+
+    if args.output == "-":
+        sink = sys.stdout
+    else:
+        sink = open(args.output, "w", encoding="utf-8", newline="" if output_format == "csv" else None)
+    try:
+        # 途中のメッセージ(print)が出力に混ざらないよう標準エラーへ回す
+        with contextlib.redirect_stdout(sys.stderr):
+            summary = write_results(results, sink, output_format)
+        sink.flush()
+    finally:
+        if args.output != "-":
+            sink.close()
+
+    print(f"完了: {summary['rows']}件 (該当 {summary['regulated']}件, エラー {summary['errors']}件, {summary['elapsed_sec']}秒)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
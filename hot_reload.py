@@ -0,0 +1,182 @@
+import logging
+import os
+import threading
+
+import checker
+import ja_to_smiles
+import metrics
+import search_cache
+
+logger = logging.getLogger(__name__)
+
+# 法律・辞書ファイルの読み直し (再起動なしで反映する)
+# laws/*.json と dicts/*.json の更新時刻を数秒ごとに確認し、変わっていたら裏で作り直して差し替える。
+# - 作り直している間も、検索は古いチェッカー・トークナイザーで続ける
+# - 差し替えはモジュール変数の置き換え1回だけなので、処理中の検索は古いものを最後まで使う
+# - 法律・辞書ファイルがない・JSONが壊れている・不正なSMILESがある場合は差し替えず、古いものを使い続ける
+#
+# gunicornのワーカーごとに1つ動く (最初のリクエストで ensure_started() が起動する)
+# 環境変数 CHEMREGU_RELOAD_INTERVAL で確認の間隔(秒)を変えられる。0なら確認しない。
+
+RELOAD_INTERVAL = float(os.environ.get("CHEMREGU_RELOAD_INTERVAL", "5"))
+
+
+
+
+# 読み直しをやめた (古いものを使い続ける)
+class reload_failed(Exception):
+    pass
+
+
+
+
+def law_paths():
+    return [filepath for filepath, law_name in checker.LAW_SOURCES]
+
+
+def dictionary_paths():
+    return [ja_to_smiles.SYNONYMS_PATH] + [filepath for filepath, role, trans_key in ja_to_smiles.DICTIONARY_SOURCES]
+
+
+# ファイルの更新時刻と大きさ (なければNone)
+def _stamp(paths):
+    stamps = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            stamps.append((path, st.st_mtime_ns, st.st_size))
+        except OSError:
+            stamps.append((path, None, None))
+    return tuple(stamps)
+
+
+
+
+# 法律JSONを読み直してチェッカーを差し替える
+# 変わっていない登録SMILESは今のチェッカーの前計算と包含関係の木を使い回す
+# 戻り値: 差分の報告 (checker.diff_entries() の結果に、解析した数・使い回した数を加えたもの)
+def reload_laws():
+    # 法律ファイルが1つでも欠けていれば差し替えない (その法律の登録が丸ごと抜けるため)
+    try:
+        regulation_db = checker.load_and_merge_laws(missing_ok=False)
+    except (ValueError, OSError) as e:
+        raise reload_failed(f"法律JSONを読み込めません: {e}") from e
+
+    # 1つでも不正なSMILESがあれば差し替えない (起動時と違い、黙って登録漏れにはしない)
+    current = checker.get_checker()
+    compiled, invalid, stats = checker.compile_patterns(regulation_db, current.compiled)
+    if invalid:
+        names = []
+        for smiles_pattern in invalid:
+            reg_list = regulation_db[smiles_pattern]
+            name_ref = reg_list[0].get('name', 'Unknown') if reg_list else 'Unknown'
+            names.append(f"{name_ref} ({smiles_pattern})")
+        raise reload_failed(f"不正なSMILESがあります: {', '.join(names)}")
+
+    new_checker = checker.check_regulations(regulation_db, compiled, current.tree_parents())
+    checker.set_checker(new_checker, regulation_db)
+    search_cache.result_cache.clear()
+
+    report = checker.diff_entries(current.entry_hashes, new_checker.entry_hashes)
+    report.update(stats)
+    return report
+
+
+# 辞書JSONを読み直してトークナイザーを差し替える
+# 辞書ファイルが1つでも欠けていれば差し替えない (その辞書の単語が丸ごと訳せなくなるため)
+def reload_dictionaries():
+    try:
+        new_tokenizer = ja_to_smiles.load_tokenizer(missing_ok=False)
+    except (ValueError, OSError) as e:
+        raise reload_failed(f"辞書JSONを読み込めません: {e}") from e
+
+    ja_to_smiles.set_tokenizer(new_tokenizer)
+    search_cache.name_cache.clear()
+    return new_tokenizer
+
+
+
+
+class file_watcher:
+    def __init__(self, interval=RELOAD_INTERVAL):
+        self.interval = interval
+        self._law_stamp = _stamp(law_paths())
+        self._dictionary_stamp = _stamp(dictionary_paths())
+        self._stop = threading.Event()
+        self._thread = None
+
+
+    # 1回分の確認 (読み直したものの名前のリストを返す)
+    # 失敗しても更新時刻は覚えておき、ファイルがもう一度変わるまで読み直さない
+    def poll(self):
+        reloaded = []
+        for kind, paths, attr, reload_func in [
+            ("laws", law_paths(), "_law_stamp", reload_laws),
+            ("dictionaries", dictionary_paths(), "_dictionary_stamp", reload_dictionaries),
+        ]:
+            stamp = _stamp(paths)
+            if stamp == getattr(self, attr):
+                continue
+            setattr(self, attr, stamp)
+
+            try:
+                report = reload_func()
+            except reload_failed as e:
+                metrics.reloads.inc("failed")
+                logger.error(f"{kind} の読み直しをやめました。以前の内容で続けます: {e}")
+                continue
+            except Exception:
+                metrics.reloads.inc("failed")
+                logger.exception(f"{kind} の読み直しに失敗しました。以前の内容で続けます")
+                continue
+
+            metrics.reloads.inc(kind)
+            if kind == "laws":
+                logger.info(
+                    f"{kind} を読み直しました (追加 {len(report['added'])}件, 削除 {len(report['removed'])}件, "
+                    f"変更 {len(report['changed'])}件, 解析 {report['compiled']}件, 使い回し {report['reused']}件)"
+                )
+                for key in ("added", "removed", "changed"):
+                    if report[key]:
+                        logger.info(f"  {key}: {', '.join(report[key])}")
+            else:
+                logger.info(f"{kind} を読み直しました。")
+            reloaded.append(kind)
+        return reloaded
+
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="hot_reload", daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+
+
+# --- プロセスごとに1つの監視 ---
+_watcher = None
+_watcher_pid = None
+_watcher_lock = threading.Lock()
+
+
+# 監視を始める (fork後のワーカーで呼ぶ。同じプロセスで2回目以降は何もしない)
+def ensure_started(interval=RELOAD_INTERVAL):
+    global _watcher, _watcher_pid
+    if interval <= 0 or _watcher_pid == os.getpid():
+        return _watcher
+    with _watcher_lock:
+        if _watcher_pid != os.getpid():
+            _watcher = file_watcher(interval)
+            _watcher.start()
+            _watcher_pid = os.getpid()
+        return _watcher
@@ -1,22 +1,46 @@
 # 辞書を充実させる。
 
+import hashlib
 import json
+import logging
 import os
-import re
 import subprocess
 import checker
+import opsin_engine
+
+logger = logging.getLogger(__name__)
+
+
+
+
+# 辞書ファイル
+SYNONYMS_PATH = "dicts/synonyms_dict.json"
+
+DICTIONARY_SOURCES = [
+    # (ファイルパス, 役割タグ, 辞書内キー)
+    ("dicts/prefixes_dict.json",  "prefix",   "prefix"),
+    ("dicts/modifiers_dict.json", "modifier", "modifier"),
+    ("dicts/cores_dict.json",     "core",     "core"),
+    ("dicts/suffixes_dict.json",  "suffix",   "suffix") 
+]
 
 
 
 
 # 表記揺れ対策の辞書
-def load_synonyms():
-    filepath = "dicts/synonyms_dict.json"
+# missing_ok=False なら、ファイルがなければ FileNotFoundError にする (読み直し用)
+def load_synonyms(missing_ok=True):
+    filepath = SYNONYMS_PATH
     if not os.path.exists(filepath):
+        if not missing_ok:
+            raise FileNotFoundError(f"{filepath} が見つかりません。")
         return {} # ファイルがなければ空の辞書を返す(エラーにしない)
         
     with open(filepath, 'r', encoding='utf-8') as f:
-        return json.load(f)
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"{filepath} の形式が不正です (オブジェクトではありません)")
+    return data
 
 
 
@@ -24,35 +48,27 @@ def load_synonyms():
 synonym_dict = load_synonyms()
  # シノニム辞書にある言葉が含まれていたら、扱える形に置換する
 def normalize_text(text):
-    sorted_keys = sorted(synonym_dict.keys(), key=len, reverse=True)
-    for common_name in sorted_keys:
-        formal_name = synonym_dict[common_name]
-        text = text.replace(common_name, formal_name)
-        
-    return text
+    return tokenizer.normalize(text)
 
 
 
 
 # 辞書統合
-def load_and_merge_dictionaries():
+# missing_ok=False なら、ファイルが1つでもなければ FileNotFoundError にする (読み直し用)
+def load_and_merge_dictionaries(missing_ok=True):
     combined_dict = {}
 
-    sources = [
-        # (ファイルパス, 役割タグ, 辞書内キー)
-        ("dicts/prefixes_dict.json",  "prefix",   "prefix"),
-        ("dicts/modifiers_dict.json", "modifier", "modifier"),
-        ("dicts/cores_dict.json",     "core",     "core"),
-        ("dicts/suffixes_dict.json",  "suffix",   "suffix") 
-    ]
-
-    for filepath, role, trans_key in sources:
+    for filepath, role, trans_key in DICTIONARY_SOURCES:
         if not os.path.exists(filepath):
-            print(f"Warning: {filepath} が見つかりません。スキップします。")
+            if not missing_ok:
+                raise FileNotFoundError(f"{filepath} が見つかりません。")
+            logger.warning(f"{filepath} が見つかりません。スキップします。")
             continue
 
         with open(filepath, 'r', encoding='utf-8') as f:
             data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError(f"{filepath} の形式が不正です (オブジェクトではありません)")
 
         for japanese, english in data.items():
 
@@ -73,36 +89,248 @@ def load_and_merge_dictionaries():
 
 
 translation_dict = load_and_merge_dictionaries()
+
+
+
+
+# 最長一致検索用のトライ木 (辞書を1文字ずつたどる入れ子の辞書)
+class longest_match_trie:
+    _END = None  # 単語の終わりの印 (文字キーと衝突しない)
+
+    def __init__(self, words):
+        self.root = {}
+        for word in words:
+            if not word:
+                continue # 空文字は無限ループの元なので登録しない
+            node = self.root
+            for char in word:
+                node = node.setdefault(char, {})
+            node[self._END] = word
+
+    # textのpos文字目から始まる最も長い単語 (なければNone)
+    def match(self, text, pos):
+        node = self.root
+        found = None
+        while pos < len(text):
+            node = node.get(text[pos])
+            if node is None:
+                break
+            if self._END in node:
+                found = node[self._END]
+            pos += 1
+        return found
+
+
+
+
+# シノニム置換を前から1回なめるだけで済ませてよいか確認する
+# 従来の置換は「長いキーから順に全体へstr.replace」なので、
+# 置換後の文字列に後から処理されるキーが現れる場合や、後から処理されるキーが
+# 先に処理されるキーの左側に重なる場合は結果が変わる。そういう辞書ならFalse。
+def _synonyms_allow_single_pass(sorted_keys, synonyms):
+    order = {key: i for i, key in enumerate(sorted_keys)}
+
+    # キーの部分文字列 -> それを含むキーの処理順 (最大/最小)
+    inner_max = {}       # 両端を除いた内側に含む
+    prefix_max = {}      # 真の接頭辞として含む
+    prefix_min = {}
+    suffix_max = {}      # 真の接尾辞として含む
+    for key, i in order.items():
+        n = len(key)
+        for a in range(1, n):
+            head = key[:a]
+            prefix_max[head] = max(prefix_max.get(head, -1), i)
+            prefix_min[head] = min(prefix_min.get(head, i), i)
+            tail = key[a:]
+            suffix_max[tail] = max(suffix_max.get(tail, -1), i)
+            for b in range(a + 1, n):
+                sub = key[a:b]
+                inner_max[sub] = max(inner_max.get(sub, -1), i)
+
+    last = len(sorted_keys) - 1
+    for key, i in order.items():
+        # 後から処理されるキーが、先に処理されるキーの左に重なっていないか
+        for a in range(1, len(key)):
+            if prefix_min.get(key[a:], i) < i:
+                return False
+
+        value = synonyms[key]
+        if not value:
+            # 空に置換すると前後がくっついて新しいキーができ得る
+            if i < last:
+                return False
+            continue
+
+        # 置換後の文字列に、後から処理されるキーが現れないか
+        n = len(value)
+        for a in range(n):
+            for b in range(a + 1, n + 1):
+                if order.get(value[a:b], -1) > i:
+                    return False
+            if prefix_max.get(value[a:], -1) > i:    # 値の末尾 + 後ろの文字
+                return False
+            if suffix_max.get(value[:a + 1], -1) > i: # 前の文字 + 値の先頭
+                return False
+        if inner_max.get(value, -1) > i:             # 前の文字 + 値 + 後ろの文字
+            return False
+
+    return True
+
+
+
+
+# 単語の訳語を前もって決めておく (translate_tokens_with_reorder と同じ選び方)
+# 戻り値: (後ろに回す訳語(接尾辞でなければNone), 文末に来たときの訳語, 文中に来たときの訳語)
+def _compile_word(token_info):
+    roles = token_info["roles"]
+    translations = token_info["translations"]
+
+    suffix = translations["suffix"] if "suffix" in roles else None
+    if "modifier" in translations:
+        in_middle = translations["modifier"]
+    elif "prefix" in translations:
+        in_middle = translations["prefix"]
+    else:
+        in_middle = list(translations.values())[0]
+    at_end = translations["core"] if "core" in translations else in_middle
+    return (suffix, at_end, in_middle)
+
+
+
+
+# 正規化とトークン化の下準備 (辞書のロード時に1回だけ作る)
+class ja_tokenizer:
+    def __init__(self, synonyms, translations):
+        self.synonyms = synonyms
+        self.translations = translations
+
+        self.sorted_synonyms = sorted(synonyms.keys(), key=len, reverse=True)
+        self.synonym_trie = longest_match_trie(self.sorted_synonyms)
+        self.single_pass = _synonyms_allow_single_pass(self.sorted_synonyms, synonyms)
+
+        self.word_trie = longest_match_trie(translations.keys())
+        self.compiled_words = {word: _compile_word(info) for word, info in translations.items()}
+
+        # 辞書の中身のハッシュ (翻訳結果のキャッシュが古くなったかの判定用)
+        content = json.dumps([synonyms, translations], ensure_ascii=False, sort_keys=True)
+        self.version = hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+    # シノニム置換
+    def normalize(self, text):
+        if not self.single_pass:
+            # 前から1回では結果が変わる辞書なので従来通り1語ずつ置換する
+            for common_name in self.sorted_synonyms:
+                text = text.replace(common_name, self.synonyms[common_name])
+            return text
+
+        parts = []
+        start = 0
+        pos = 0
+        while pos < len(text):
+            word = self.synonym_trie.match(text, pos)
+            if word:
+                parts.append(text[start:pos])
+                parts.append(self.synonyms[word])
+                pos += len(word)
+                start = pos
+            else:
+                pos += 1
+        if start == 0:
+            return text
+        parts.append(text[start:])
+        return "".join(parts)
+
+
+    # 最長一致でトークン化
+    def tokenize(self, text):
+        tokens = []
+        pos = 0
+        while pos < len(text):
+            word = self.word_trie.match(text, pos)
+            if word:
+                tokens.append({
+                    "original": word,
+                    "data": self.translations[word]
+                })
+                pos += len(word)
+            else:
+                # マッチしない文字があった場合(数字やハイフンなど)  「そのまま」英語として使う扱いにする(辞書にないから警告は付けたい)
+                char = text[pos]
+                tokens.append({"original": char, "data": {"type": "raw", "english": char}})
+                pos += 1
+        return tokens
+
+
+    # 正規化 -> トークン化 -> 並べ替えて英語に (normalize_text, tokenize_and_parse, translate_tokens_with_reorder と同じ結果)
+    # トークンの辞書は作らず、前もって決めた訳語のタプルだけで組み立てる
+    # (結果はpipeline側のキャッシュ(search_cache.name_cache)で覚えるので、ここでは覚えない)
+    def translate(self, text):
+        return self.join_words(self.tokenize_words(self.normalize(text)))
+
+
+    # 最長一致でトークン化 (tokenize と同じ切り方で、単語ごとに _compile_word() のタプルを返す)
+    def tokenize_words(self, text):
+        compiled_words = self.compiled_words
+        words = []
+        pos = 0
+        while pos < len(text):
+            word = self.word_trie.match(text, pos)
+            if word:
+                words.append(compiled_words[word])
+                pos += len(word)
+            else:
+                char = text[pos]
+                words.append((None, char, char)) # 辞書にない文字はそのまま
+                pos += 1
+        return words
+
+
+    # tokenize_words の結果を並べ替えて英語にする (translate_tokens_with_reorder と同じ並べ方)
+    def join_words(self, words):
+        english_parts = []
+        delayed_suffixes = []
+        last = len(words) - 1
+        for i, (suffix, at_end, in_middle) in enumerate(words):
+            if suffix is not None and i < last:
+                delayed_suffixes.append(suffix)
+            elif i == last:
+                english_parts.append(at_end)
+            else:
+                english_parts.append(in_middle)
+
+        return " ".join(english_parts + delayed_suffixes)
+
+
+
+
+tokenizer = ja_tokenizer(synonym_dict, translation_dict)
+
+
+# 辞書ファイルを読み直してトークナイザーを作る (差し替えは set_tokenizer で行う)
+# missing_ok=False なら、辞書ファイルが1つでもなければ FileNotFoundError にする
+def load_tokenizer(missing_ok=True):
+    return ja_tokenizer(load_synonyms(missing_ok), load_and_merge_dictionaries(missing_ok))
+
+
+# 作り直したトークナイザーに差し替える (hot_reload から使う)
+def set_tokenizer(new_tokenizer):
+    global tokenizer, synonym_dict, translation_dict
+    synonym_dict = new_tokenizer.synonyms
+    translation_dict = new_tokenizer.translations
+    tokenizer = new_tokenizer
+
 # 入力分割
+# 最長一致でトークン化する (「ジメチル」があるときに「ジ」で切れてしまうのを防ぐ)
 def tokenize_and_parse(text):
-    tokens = []
-
-    # 最長一致でトークン化する
-    # 辞書のキーを「文字数が長い順」にソートする  これにより「ジメチル」があるときに「ジ」で切れてしまうのを防ぐ
-    sorted_keys = sorted(translation_dict.keys(), key=len, reverse=True)
-
-    # 正規表現パターンを作成: (フェノール|アセチル|モルヒネ|...)
-    pattern = re.compile("|".join(map(re.escape, sorted_keys)))
-
-    # 文字列を前からローラー
-    pos = 0
-    while pos < len(text):
-        match = pattern.match(text, pos)
-        if match:
-            word = match.group(0)
-            token_data = translation_dict[word]
-            tokens.append({
-                "original": word,
-                "data": token_data
-            })
-            pos = match.end()
-        else:
-            # マッチしない文字があった場合(数字やハイフンなど)  「そのまま」英語として使う扱いにする(辞書にないから警告は付けたい)
-            char = text[pos]
-            tokens.append({"original": char, "data": {"type": "raw", "english": char}})
-            pos += 1
+    return tokenizer.tokenize(text)
+
+
+
 
-    return tokens
+# 日本語名 -> 英語名 (正規化・トークン化・結合をまとめて行う)
+def japanese_to_english(text):
+    return tokenizer.translate(text)
 
 
 
@@ -159,11 +387,35 @@ def translate_tokens_with_reorder(tokens):
 # SMILES化
 def convert_name_to_smiles(english_name):
 
-    jar_path = "libs/opsin-cli-2.8.0-jar-with-dependencies.jar"
+    jar_path = opsin_engine.OPSIN_JAR_PATH
 
     if not os.path.exists(jar_path):
-        print(f"エラー: {jar_path} が見つかりません。")
-        print("libsフォルダの中に opsin-cli.jar はあるか？")
+        logger.error(f"{jar_path} が見つかりません。libsフォルダの中に opsin-cli.jar はあるか？")
+        return None
+
+    # 空の名前や複数行の名前は常駐OPSINの1行1応答の約束が崩れるので従来の方法で
+    if english_name.strip() and "\n" not in english_name and "\r" not in english_name:
+        try:
+            return opsin_engine.get_engine().convert(english_name)
+        except opsin_engine.opsin_timeout as e:
+            # 時間のかかりすぎる名前は、java -jar でやり直しても同じなので失敗扱い
+            logger.warning(str(e))
+            return None
+        except opsin_engine.opsin_error as e:
+            logger.warning(f"常駐OPSINが使えません({e})。java -jar で変換します。")
+
+    return convert_name_to_smiles_subprocess(english_name)
+
+
+
+
+# SMILES化 (従来方式: 毎回JVMを起動する。常駐OPSINが使えない時の予備)
+def convert_name_to_smiles_subprocess(english_name):
+
+    jar_path = opsin_engine.OPSIN_JAR_PATH
+
+    if not os.path.exists(jar_path):
+        logger.error(f"{jar_path} が見つかりません。libsフォルダの中に opsin-cli.jar はあるか？")
         return None
 
     # コマンドの準備 (標準入力待ち受けモード)
@@ -187,16 +439,85 @@ def convert_name_to_smiles(english_name):
                 return None
         else:
             # エラー時
-            print(f"OPSIN変換エラー: {result.stderr.strip()}")
+            logger.info(f"OPSIN変換エラー: {result.stderr.strip()}")
             return None
 
     except Exception as e:
-        print(f"予期せぬエラー: {e}")
+        logger.error(f"予期せぬエラー: {e}")
         return None
 
 
 
 
+# まとめてSMILES化 (在庫リストなど大量の名前向け)
+# 入力と同じ長さ・同じ順番のリストを返す (失敗した位置はNone)
+def convert_names_to_smiles(english_names):
+    english_names = list(english_names)
+    results = [None] * len(english_names)
+
+    jar_path = opsin_engine.OPSIN_JAR_PATH
+
+    if not os.path.exists(jar_path):
+        logger.error(f"{jar_path} が見つかりません。libsフォルダの中に opsin-cli.jar はあるか？")
+        return results
+
+    # 常駐OPSINに流せるもの(1行の名前)だけ選ぶ  空の名前はNoneのまま
+    positions = []
+    for i, name in enumerate(english_names):
+        if not name.strip():
+            continue
+        if "\n" in name or "\r" in name:
+            results[i] = convert_name_to_smiles_subprocess(name)
+            continue
+        positions.append(i)
+
+    names = [english_names[i] for i in positions]
+    try:
+        converted = opsin_engine.get_engine().convert_many(names)
+    except opsin_engine.opsin_error as e:
+        logger.warning(f"常駐OPSINが使えません({e})。java -jar で変換します。")
+        done = getattr(e, "done", 0)
+        converted = getattr(e, "results", [None] * len(names))
+        converted[done:] = convert_names_to_smiles_subprocess(names[done:])
+
+    # 元の位置に戻す
+    for i, smiles in zip(positions, converted):
+        results[i] = smiles
+
+    return results
+
+
+
+
+# まとめてSMILES化 (従来方式: JVMを1回だけ起動し、改行区切りで全部流す)
+def convert_names_to_smiles_subprocess(english_names):
+    if not english_names:
+        return []
+
+    command = ["java", "-jar", opsin_engine.OPSIN_JAR_PATH, "-osmi"]
+
+    try:
+        result = subprocess.run(
+            command,
+            input="\n".join(english_names) + "\n",
+            capture_output=True,
+            text=True,
+            encoding='utf-8'
+        )
+    except Exception as e:
+        logger.error(f"予期せぬエラー: {e}")
+        return [None] * len(english_names)
+
+    lines = result.stdout.splitlines()
+    if result.returncode != 0 or len(lines) != len(english_names):
+        # 行数が合わない -> どの結果がどの名前か分からないので1件ずつやり直す
+        return [convert_name_to_smiles_subprocess(name) for name in english_names]
+
+    return [line.strip() or None for line in lines]
+
+
+
+
 # --- テスト実行 ---
 
 
@@ -0,0 +1,199 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+# 登録パターンごとの照合コストの計測 (重いDB登録を探す用)
+# check_regulations.enable_profiling() で有効にすると、チェック中の
+#   HasSubstructMatch (パターンとの部分構造マッチ), ReplaceCore (化合物判定の側鎖の切り出し),
+#   MolToSmiles (入力フラグメントの正規化。パターンによらないので INPUT_KEY にまとめる)
+# の回数と時間を登録SMILESごとに集計する。無効なとき(既定)は何も記録しない。
+# INPUT_KEY の分は順位に入れず、input_summary() で別に出す。
+#
+#   python -m match_profile queries.smi --top 20
+#   python -m match_profile --db-patterns --repeat 3 --json profile.json
+#
+# 入力は file_screen と同じく .sdf / .smi。--db-patterns なら登録SMILES自身(と誘導体・塩・水和物)を入力にする。
+# 化合物判定の結果はキャッシュされるので、同じ入力を繰り返すと ReplaceCore は2回目から呼ばれない。
+
+PATTERN_OPERATIONS = ("HasSubstructMatch", "ReplaceCore")  # 登録パターンごとの表に出すもの (MolToSmilesは入力の分だけ)
+INPUT_KEY = "(入力の正規化)"
+DEFAULT_TOP = 20
+
+# --db-patterns で登録SMILESに付け足すもの (そのもの, メチル誘導体, 塩, 水和物)
+DB_PATTERN_SUFFIXES = ["", "C", ".[Na+]", ".[Cl-]", ".O"]
+
+
+
+
+class match_profiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = {}  # (登録SMILES, 処理名) -> [回数, 合計秒, 最大秒]
+
+
+    def record(self, pattern, operation, seconds):
+        with self._lock:
+            entry = self._records.get((pattern, operation))
+            if entry is None:
+                self._records[(pattern, operation)] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                if seconds > entry[2]:
+                    entry[2] = seconds
+
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+
+    # 時間のかかった順の一覧 (登録パターンだけ。入力の正規化は input_summary() を参照)
+    # names: 登録SMILES -> 物質名 (表示用), top: 件数 (Noneなら全部)
+    # 各行: {"pattern", "name", "total_ms", "operations": {処理名: {"calls", "total_ms", "mean_ms", "max_ms"}}}
+    def report(self, names=None, top=DEFAULT_TOP):
+        with self._lock:
+            records = {key: list(value) for key, value in self._records.items()}
+
+        rows = {}
+        for (pattern, operation), (calls, total, longest) in records.items():
+            if pattern == INPUT_KEY:
+                continue
+            row = rows.setdefault(pattern, {
+                "pattern": pattern,
+                "name": (names or {}).get(pattern),
+                "total_ms": 0.0,
+                "operations": {}
+            })
+            row["total_ms"] += total * 1000
+            row["operations"][operation] = {
+                "calls": calls,
+                "total_ms": round(total * 1000, 3),
+                "mean_ms": round(total * 1000 / calls, 4),
+                "max_ms": round(longest * 1000, 3)
+            }
+
+        ranked = sorted(rows.values(), key=lambda row: row["total_ms"], reverse=True)
+        for row in ranked:
+            row["total_ms"] = round(row["total_ms"], 3)
+        return ranked if top is None else ranked[:top]
+
+
+    # 入力の正規化にかかった分 {"calls", "total_ms", "mean_ms", "max_ms"} (記録がなければNone)
+    def input_summary(self):
+        with self._lock:
+            entry = self._records.get((INPUT_KEY, "MolToSmiles"))
+            if entry is None:
+                return None
+            calls, total, longest = entry
+        return {
+            "calls": calls,
+            "total_ms": round(total * 1000, 3),
+            "mean_ms": round(total * 1000 / calls, 4),
+            "max_ms": round(longest * 1000, 3)
+        }
+
+
+
+
+# 表にして出す (割合は grand_total_ms に対するもの。省略時は表の合計)
+# input_summary: 入力の正規化の分 (match_profiler.input_summary())。あれば表の前に1行で出す
+def format_report(ranked, grand_total_ms=None, input_summary=None, out=sys.stdout):
+    grand_total = grand_total_ms or sum(row["total_ms"] for row in ranked) or 1.0
+    if input_summary is not None:
+        print(
+            f"入力の正規化 (MolToSmiles): {input_summary['calls']}回 / {input_summary['total_ms']:.3f}ms "
+            f"(平均 {input_summary['mean_ms']:.4f}ms, 最大 {input_summary['max_ms']:.3f}ms)",
+            file=out
+        )
+    header = f"{'順位':>4} {'合計ms':>10} {'割合':>6}  " + "  ".join(f"{op + '(回/ms)':>24}" for op in PATTERN_OPERATIONS) + "  登録SMILES / 物質名"
+    print(header, file=out)
+    for rank, row in enumerate(ranked, 1):
+        cells = []
+        for op in PATTERN_OPERATIONS:
+            stats = row["operations"].get(op)
+            cells.append(f"{stats['calls']:>10}/{stats['total_ms']:>12.3f}" if stats else f"{'-':>24}")
+        label = row["pattern"] if row["name"] is None else f"{row['pattern']} ({row['name']})"
+        print(f"{rank:>4} {row['total_ms']:>10.3f} {row['total_ms'] / grand_total:>6.1%}  " + "  ".join(cells) + f"  {label}", file=out)
+
+
+
+
+def _db_pattern_inputs(reg_checker):
+    from rdkit import Chem, rdBase
+    for record, smiles_pattern in enumerate(reg_checker.compiled, 1):
+        for suffix in DB_PATTERN_SUFFIXES:
+            with rdBase.BlockLogs(): # 付け足して原子価が合わなくなったものは数えるだけにする
+                mol = Chem.MolFromSmiles(smiles_pattern + suffix)
+            yield record, smiles_pattern, mol
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m match_profile", description="登録パターンごとの照合コストを計測し、時間のかかった順に出す")
+    parser.add_argument("input", nargs="?", help="入力ファイル (.sdf / .smi)")
+    parser.add_argument("--format", choices=["sdf", "smi"], help="入力形式 (既定: 拡張子から推定)")
+    parser.add_argument("--db-patterns", action="store_true", help="登録SMILES自身(と誘導体・塩・水和物)を入力にする")
+    parser.add_argument("--repeat", type=int, default=1, help="入力を繰り返す回数")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help="表示する件数 (0なら全部)")
+    parser.add_argument("--json", help="一覧をJSONで書き出すファイル")
+    args = parser.parse_args(argv)
+
+    if not args.input and not args.db_patterns:
+        parser.error("入力ファイルか --db-patterns を指定してください")
+
+    logging.basicConfig(level=os.environ.get("CHEMREGU_LOG_LEVEL", "WARNING").upper())
+
+    import checker
+    import file_screen
+    reg_checker = checker.get_checker()
+    profiler = reg_checker.enable_profiling()
+
+    started = time.perf_counter()
+    queries = 0
+    errors = 0
+    for _ in range(args.repeat):
+        if args.db_patterns:
+            records = _db_pattern_inputs(reg_checker)
+        else:
+            try:
+                fmt = args.format or file_screen.guess_format(args.input)
+            except ValueError as e:
+                parser.error(str(e))
+            records = file_screen.iter_mols(args.input, fmt, threads=0)
+
+        for record, name, mol in records:
+            if mol is None:
+                errors += 1
+                continue
+            queries += 1
+            try:
+                reg_checker.check_mol(mol)
+            except Exception:
+                errors += 1
+    elapsed = time.perf_counter() - started
+
+    names = {}
+    for smiles_pattern, info in zip(reg_checker.patterns.smiles, reg_checker.patterns.infos):
+        names.setdefault(smiles_pattern, info.get("name"))
+    ranked = profiler.report(names, top=None)
+    grand_total_ms = sum(row["total_ms"] for row in ranked)
+    input_summary = profiler.input_summary()
+    if args.top:
+        ranked = ranked[:args.top]
+
+    print(f"{queries}件をチェックしました ({elapsed:.2f}秒, 失敗 {errors}件)", file=sys.stderr)
+    format_report(ranked, grand_total_ms, input_summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "queries": queries, "errors": errors, "elapsed_sec": round(elapsed, 3),
+                "input": input_summary, "patterns": ranked
+            }, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import search_cache
+
+# 処理時間などの計測 (Prometheus形式で /metrics から出す)
+# 各段の処理時間はヒストグラム chemregu_stage_seconds{stage="..."} に記録する。
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+
+
+# ラベル1つ付きのヒストグラム
+class histogram:
+    def __init__(self, name, help_text, buckets, label):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.label = label
+        self._series = {}  # ラベル値 -> [各バケットの件数..., 合計, 件数]
+        self._lock = threading.Lock()
+
+
+    def observe(self, value, label_value):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * (len(self.buckets) + 2)
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_value, series in sorted(self._series.items()):
+                label = f'{self.label}="{label_value}"'
+                for i, upper in enumerate(self.buckets):
+                    lines.append(f'{self.name}_bucket{{{label},le="{upper}"}} {series[i]}')
+                lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {series[-1]}')
+                lines.append(f"{self.name}_sum{{{label}}} {series[-2]}")
+                lines.append(f"{self.name}_count{{{label}}} {series[-1]}")
+        return lines
+
+
+
+
+# ラベル1つ付きのカウンター
+class counter:
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+
+    def inc(self, label_value, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_value, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{{{self.label}="{label_value}"}} {value}')
+        return lines
+
+
+
+
+stage_seconds = histogram(
+    "chemregu_stage_seconds",
+    "検索の各段の処理時間(秒)",
+    STAGE_BUCKETS,
+    "stage"
+)
+
+# check_regulations.check 1回あたりのパターン数
+# candidates: 照合したパターン, prefiltered: 原子数・元素の数で除外, pruned: 指紋で省略, indexed: 索引で確定, substructure: 部分構造マッチを実行, tree_pruned: 包含関係の木で省略, hits: ヒット件数
+check_patterns = histogram(
+    "chemregu_check_patterns",
+    "法規制チェック1回あたりのパターン数",
+    COUNT_BUCKETS,
+    "kind"
+)
+
+# 検索APIで断った/打ち切ったリクエストの数
+# busy: 混雑で503を返した, deadline: 期限切れで504を返した
+rejected_requests = counter(
+    "chemregu_rejected_requests_total",
+    "混雑・期限切れで処理しなかった検索リクエストの数",
+    "reason"
+)
+
+# 入力の種類ごとの検索数 (pipeline.classify_input の振り分け先)
+# smiles: SMILESとしてそのままチェック, name: 英語名としてOPSINへ, japanese: 日本語名として翻訳から
+input_routes = counter(
+    "chemregu_input_routes_total",
+    "入力の種類ごとの検索数",
+    "route"
+)
+
+# 法律・辞書ファイルの読み直しの回数
+# laws/dictionaries: 差し替えた, failed: 不正な内容だったので差し替えなかった
+reloads = counter(
+    "chemregu_reloads_total",
+    "法律・辞書ファイルを読み直した回数",
+    "result"
+)
+
+
+
+
+# with timed("normalize_text"): ... の形で処理時間を記録する
+@contextmanager
+def timed(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - started, stage)
+
+
+def observe_check(stats):
+    for kind, value in stats.items():
+        check_patterns.observe(value, kind)
+
+
+
+
+# Prometheus形式のテキスト
+def render_prometheus():
+    lines = stage_seconds.render() + check_patterns.render() + rejected_requests.render() + reloads.render() + input_routes.render()
+
+    # キャッシュの統計
+    stats = search_cache.cache_stats()
+    for key, metric, metric_type, help_text in [
+        ("hits", "chemregu_cache_hits_total", "counter", "メモリキャッシュのヒット数"),
+        ("disk_hits", "chemregu_cache_disk_hits_total", "counter", "ディスクキャッシュのヒット数"),
+        ("misses", "chemregu_cache_misses_total", "counter", "キャッシュのミス数"),
+        ("evictions", "chemregu_cache_evictions_total", "counter", "LRUで追い出した数"),
+        ("size", "chemregu_cache_entries", "gauge", "メモリキャッシュの件数"),
+    ]:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {metric_type}")
+        for name, values in sorted(stats.items()):
+            lines.append(f'{metric}{{cache="{name}"}} {values[key]}')
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,248 @@
+import atexit
+import logging
+import os
+import queue
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 常駐OPSINエンジン
+# java -jar を毎回起動するとJVMの起動だけで数百ミリ秒かかるため、
+# ワーカープロセスごとにOPSINを1つ常駐させ、標準入出力で1行ずつやり取りする。
+# (OPSIN CLIは1行読むごとに1行出力し、変換失敗時は空行を返す)
+
+OPSIN_JAR_PATH = "libs/opsin-cli-2.8.0-jar-with-dependencies.jar"
+
+DEFAULT_TIMEOUT = 10.0   # 1回の変換で待つ秒数 (初回はJVM起動時間も含む)
+MAX_RESTARTS = 3         # 連続でこの回数落ちたら一旦あきらめる
+RETRY_INTERVAL = 60.0    # あきらめた後、再起動を試すまでの秒数
+
+
+
+
+class opsin_error(Exception):
+    pass
+
+
+# 応答待ちの時間切れ (エンジン自体は作り直し済み)
+class opsin_timeout(opsin_error):
+    pass
+
+
+
+
+class opsin_process:
+    def __init__(self, jar_path=OPSIN_JAR_PATH, timeout=DEFAULT_TIMEOUT, max_restarts=MAX_RESTARTS):
+        self.jar_path = jar_path
+        self.timeout = timeout
+        self.max_restarts = max_restarts
+
+        self.restart_count = 0      # 連続再起動回数 (成功するとリセット)
+        self.disabled_until = 0.0   # 再起動しすぎた場合の休止期限
+
+        self._proc = None
+        self._lines = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+
+    # OPSINプロセスの起動
+    def _start(self):
+        command = ["java", "-jar", self.jar_path, "-osmi"]
+        try:
+            proc = subprocess.Popen(
+                command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                encoding='utf-8',
+                bufsize=1
+            )
+        except OSError as e:
+            raise opsin_error(f"OPSINを起動できません: {e}")
+
+        lines = queue.Queue()
+
+        # 標準出力を読み続けるスレッド (EOFでNoneを入れる)
+        def read_stdout():
+            for line in proc.stdout:
+                lines.put(line.rstrip("\n"))
+            lines.put(None)
+
+        # 標準エラーも読み捨てないとパイプが詰まる
+        def read_stderr():
+            for line in proc.stderr:
+                line = line.strip()
+                if line:
+                    logger.info(f"OPSIN変換エラー: {line}")
+
+        threading.Thread(target=read_stdout, daemon=True).start()
+        threading.Thread(target=read_stderr, daemon=True).start()
+
+        self._proc = proc
+        self._lines = lines
+        self._pid = os.getpid()
+
+
+    # プロセスを止める
+    def _kill(self):
+        proc = self._proc
+        self._proc = None
+        self._lines = None
+        # fork後の子プロセスからは親のOPSINを止めない
+        if proc is None or self._pid != os.getpid():
+            return
+        try:
+            proc.kill()
+            proc.wait(timeout=5)
+        except Exception:
+            pass
+
+
+    # 生きているか確認し、落ちていれば再起動する (監視役)
+    def _ensure_running(self):
+        if self._proc is not None and self._pid != os.getpid():
+            # forkで親から引き継いだハンドルは使わない
+            self._proc = None
+            self._lines = None
+
+        if self._proc is not None and self._proc.poll() is None:
+            return
+
+        now = time.monotonic()
+        if now < self.disabled_until:
+            raise opsin_error("OPSINの再起動を休止中です")
+
+        if self._proc is not None:
+            # 異常終了していた
+            self._kill()
+            self.restart_count += 1
+
+        if self.restart_count >= self.max_restarts:
+            self.disabled_until = now + RETRY_INTERVAL
+            self.restart_count = 0
+            raise opsin_error("OPSINが繰り返し異常終了したため休止します")
+
+        try:
+            self._start()
+        except opsin_error:
+            self.restart_count += 1
+            raise
+
+
+    # 英語名 -> SMILES (失敗ならNone)
+    def convert(self, english_name):
+        with self._lock:
+            self._ensure_running()
+            try:
+                self._proc.stdin.write(english_name + "\n")
+                self._proc.stdin.flush()
+                line = self._lines.get(timeout=self.timeout)
+            except queue.Empty:
+                # 応答がない -> 出力がずれるので作り直す
+                self._kill()
+                raise opsin_timeout(f"OPSINが{self.timeout}秒以内に応答しませんでした")
+            except OSError as e:
+                self._kill()
+                self.restart_count += 1
+                raise opsin_error(f"OPSINとの通信に失敗しました: {e}")
+
+            if line is None:
+                self._kill()
+                self.restart_count += 1
+                raise opsin_error("OPSINが異常終了しました")
+
+            self.restart_count = 0
+
+        smiles = line.strip()
+        if smiles:
+            return smiles
+        else:
+            return None
+
+
+    # 複数の英語名をまとめて流し込む (入力と同じ順番で SMILES か None を返す)
+    def convert_many(self, english_names):
+        results = [None] * len(english_names)
+        pos = 0
+        while pos < len(english_names):
+            with self._lock:
+                try:
+                    self._ensure_running()
+                except opsin_error as e:
+                    # どこまで変換できたかを呼び出し側に伝える
+                    e.results = results
+                    e.done = pos
+                    raise
+                pos = self._stream(english_names, pos, results)
+        return results
+
+
+    # pos番目以降を書き込みスレッドで送りつつ、1行ずつ結果を受け取る
+    # (書き込みを別スレッドにしないと、OPSINが止まった時に書き込みで固まる)
+    def _stream(self, english_names, pos, results):
+        proc = self._proc
+        lines = self._lines
+
+        def write_names():
+            try:
+                for name in english_names[pos:]:
+                    proc.stdin.write(name + "\n")
+                proc.stdin.flush()
+            except (OSError, ValueError):
+                pass # 途中でプロセスを止めた場合
+
+        threading.Thread(target=write_names, daemon=True).start()
+
+        for i in range(pos, len(english_names)):
+            try:
+                line = lines.get(timeout=self.timeout)
+            except queue.Empty:
+                # この名前で固まった -> 失敗扱いにして次から再開
+                logger.warning(f"OPSINが{self.timeout}秒以内に応答しませんでした: {english_names[i]}")
+                self._kill()
+                return i + 1
+
+            if line is None:
+                # この名前で落ちた -> 失敗扱いにして次から再開
+                self._kill()
+                self.restart_count += 1
+                return i + 1
+
+            smiles = line.strip()
+            results[i] = smiles if smiles else None
+
+        self.restart_count = 0
+        return len(english_names)
+
+
+    def close(self):
+        with self._lock:
+            self._kill()
+
+
+
+
+# ワーカープロセスごとに1つだけ持つ
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None or _engine._pid not in (None, os.getpid()):
+            _engine = opsin_process()
+        return _engine
+
+
+def shutdown_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.close()
+            _engine = None
+
+atexit.register(shutdown_engine)
@@ -0,0 +1,114 @@
+import multiprocessing
+import os
+
+import checker
+
+# 複数コアでの法規制チェック
+# RDKitの部分構造マッチはGILを握ったままなので、スレッドではなくプロセスで並列化する。
+# 各ワーカーは起動時に1回だけ check_regulations を作り、以後はSMILESのチャンクを受け取って
+# 結果をまとめて返す。結果は入力と同じ順番で返る。
+#
+#   with parallel_checker(workers=8) as pool:
+#       for results in pool.check_many(smiles_list):
+#           ...
+
+DEFAULT_CHUNK_SIZE = 64  # 1回のやり取りで送るSMILESの数
+
+
+
+
+# 1件のチェックが例外で失敗した印 (raiseせずに結果の代わりに返す)
+class check_failed(Exception):
+    pass
+
+
+
+
+# --- ワーカー側 ---
+_worker_checker = None
+
+def _init_worker(regulation_db):
+    global _worker_checker
+    if regulation_db is not None:
+        _worker_checker = checker.check_regulations(regulation_db)
+    elif checker._checker is not None:
+        # forkで親から引き継いだチェッカーをそのまま使う
+        # (get_checker() は呼ばない。親の別スレッドがロックを握った瞬間にforkされると、子ではロックが解けない)
+        _worker_checker = checker._checker
+    else:
+        _worker_checker = checker.get_checker() # スナップショットがあればそれを使う
+
+
+def _check_chunk(smiles_chunk):
+    results = []
+    for smiles in smiles_chunk:
+        try:
+            results.append(_worker_checker.check(smiles))
+        except Exception as e:
+            results.append(check_failed(f"{type(e).__name__}: {e}"))
+    return results
+
+
+
+
+# size件ずつのリストに区切る
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+
+
+class parallel_checker:
+    # regulation_dbを省略すると、各ワーカーが checker.get_checker() と同じものを使う
+    def __init__(self, regulation_db=None, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self._pool = multiprocessing.Pool(
+            self.workers,
+            initializer=_init_worker,
+            initargs=(regulation_db,)
+        )
+
+
+    # SMILESを順に受け取り、チェック結果(check()と同じリスト)を同じ順番で返す
+    # 例外で失敗した要素は check_failed のインスタンスになる
+    def check_many(self, smiles_iterable):
+        for results in self._pool.imap(_check_chunk, chunked(smiles_iterable, self.chunk_size)):
+            yield from results
+
+
+    # 1件だけチェックする (複数スレッドから同時に呼んでよい)
+    # 例外で失敗した場合は check_failed を送出する。timeout秒で終わらなければ multiprocessing.TimeoutError
+    def check_one(self, smiles, timeout=None):
+        result = self._pool.apply_async(_check_chunk, ([smiles],)).get(timeout)[0]
+        if isinstance(result, check_failed):
+            raise result
+        return result
+
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+
+    def terminate(self):
+        self._pool.terminate()
+        self._pool.join()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
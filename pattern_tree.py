@@ -0,0 +1,122 @@
+import time
+
+import numpy as np
+from rdkit import DataStructs
+
+# 登録パターンの包含関係の木
+# 登録SMILESどうしで「AがBの部分構造」になっているとき、Aを親・Bを子とする
+# (親には、子に含まれる登録パターンのうち原子数が最大のものを1つ選ぶ)。
+# 部分構造の関係は推移的なので、入力に親が含まれなければ子孫も含まれない。
+# チェック時は親から順に判定し、親が外れたら部分木をまとめて飛ばす。
+#
+# 以前の木の親(known_parents)を渡すと、変わっていないノードは親を探し直さず、
+# 新しく加わったノードが「今の親より大きい親」にならないかだけを確かめる。
+
+
+
+
+# 足切り用指紋(ExplicitBitVect)のリストを、1行1パターンのビット行列(64ビット整数に詰めたもの)にする
+def _fingerprint_matrix(fps):
+    size = fps[0].GetNumBits() if fps else 0
+    bits = np.zeros((len(fps), -(-size // 64) * 64), dtype=np.uint8)
+    row = np.zeros(size, dtype=np.uint8)
+    for i, fp in enumerate(fps):
+        DataStructs.ConvertToNumpyArray(fp, row)
+        bits[i, :size] = row
+    return np.packbits(bits, axis=1).view(np.uint64)
+
+
+
+
+# 親を探して parents に書き込む (戻り値: 部分構造マッチの回数)
+# 親が分かっているノードは、今の親より大きい新しいノードだけを試す
+def _find_parents(mols, fps, num_atoms, element_counts, known_parents, unknown, parents):
+    fp_bits = _fingerprint_matrix(fps)
+    substructure_calls = 0
+
+    # 原子数の少ない順に並べておき、子より原子数の少ないものだけを候補にする
+    # (元素の列は1列ずつ比べるので転置しておく)
+    by_size = np.argsort(num_atoms, kind="stable")
+    sorted_atoms = num_atoms[by_size]
+    sorted_element_columns = np.ascontiguousarray(element_counts[by_size].T)
+    sorted_fp_bits = fp_bits[by_size]
+    bit_counts = np.bitwise_count(fp_bits).sum(axis=1)
+    sorted_bit_counts = bit_counts[by_size]
+    # 親を探し直すノードの並び順での位置 (親が分かっているノードの親候補はこれだけ)
+    sorted_unknown = np.flatnonzero(unknown[by_size])
+
+    for child in range(len(mols)):
+        smaller = int(np.searchsorted(sorted_atoms, num_atoms[child], side="left"))
+        known = known_parents[child]
+        if known is None:
+            if smaller == 0:
+                continue
+            candidates = slice(0, smaller)
+        else:
+            # 今の親より原子数が多く、子より少ないものだけ
+            larger = int(np.searchsorted(sorted_atoms, num_atoms[known], side="right")) if known >= 0 else 0
+            candidates = sorted_unknown[np.searchsorted(sorted_unknown, larger):np.searchsorted(sorted_unknown, smaller)]
+            if not candidates.size:
+                continue
+
+        # 親の候補: 原子数が少なく、どの元素も子より多くなく、指紋のビットが子に揃っているもの
+        possible = sorted_bit_counts[candidates] <= bit_counts[child]
+        for column, child_count in zip(sorted_element_columns, element_counts[child].tolist()):
+            possible &= column[candidates] <= child_count
+        possible = np.flatnonzero(possible)
+        if known is not None:
+            possible = candidates[possible]
+        possible = possible[(sorted_fp_bits[possible] & ~fp_bits[child]).max(axis=1, initial=0) == 0]
+        # 原子数の多いものから試し、最初に含まれていたものを親にする
+        for parent in by_size[possible[::-1]].tolist():
+            substructure_calls += 1
+            if mols[child].HasSubstructMatch(mols[parent]):
+                parents[child] = parent
+                break
+    return substructure_calls
+
+
+
+
+class containment_tree:
+    # パターンごと(同じSMILESは1つ)の mol, 足切り用指紋, 原子数, 元素ごとの原子数の行列
+    # known_parents: ノードごとの以前の親 (ノード番号。親なしは-1, 以前の木になかった・親が消えたものはNone)
+    def __init__(self, mols, fps, num_atoms, element_counts, known_parents=None):
+        started = time.perf_counter()
+        count = len(mols)
+        num_atoms = np.asarray(num_atoms)
+        if known_parents is None:
+            known_parents = [None] * count
+        unknown = np.array([parent is None for parent in known_parents], dtype=bool)
+
+        # 親探しが要るのは新しいノードがあるときだけ (なければ以前の木がそのまま使える)
+        parents = np.array([-1 if parent is None else parent for parent in known_parents], dtype=np.int32)
+        substructure_calls = 0
+        if unknown.any():
+            substructure_calls = _find_parents(mols, fps, num_atoms, element_counts, known_parents, unknown, parents)
+
+        # 深さ (親は必ず原子数が少ないので、原子数の少ない順に決まる)
+        depths = np.zeros(count, dtype=np.int32)
+        for node in np.argsort(num_atoms, kind="stable").tolist():
+            if parents[node] >= 0:
+                depths[node] = depths[parents[node]] + 1
+
+        # 部分木の大きさ (自分を含む。深い順に親へ足す)
+        subtree_sizes = np.ones(count, dtype=np.int32)
+        for node in np.argsort(-depths, kind="stable").tolist():
+            if parents[node] >= 0:
+                subtree_sizes[parents[node]] += subtree_sizes[node]
+
+        self.parents = parents.tolist()  # チェック中に1つずつ引くのでリストにしておく
+        self.depths = depths
+        self.subtree_sizes = subtree_sizes
+        self.stats = {
+            "patterns": count,
+            "linked": int((parents >= 0).sum()),
+            "max_depth": int(depths.max()) if count else 0,
+            "mean_depth": round(float(depths.mean()), 3) if count else 0.0,
+            "largest_subtree": int(subtree_sizes[parents < 0].max()) if count else 0,
+            "reused": int(count - unknown.sum()),
+            "build_substructure_calls": substructure_calls,
+            "build_sec": round(time.perf_counter() - started, 3)
+        }
@@ -0,0 +1,186 @@
+import re
+import unicodedata
+from contextlib import nullcontext
+
+from rdkit import Chem, rdBase
+
+import ja_to_smiles
+import metrics
+import opsin_engine
+import search_cache
+from search_cache import MISS
+
+# 検索の流れ (日本語名 -> 英語名 -> SMILES -> 法規制チェック)
+# 各段の前にキャッシュを置き、同じ物質の再検索では重い処理を飛ばす
+# 入力がSMILESや英語名なら、classify_input() で途中の段を飛ばす
+
+# 入力の種類 (検索結果の "route")
+ROUTE_SMILES = "smiles"      # SMILES -> 法規制チェック
+ROUTE_NAME = "name"          # 英語名 -> OPSIN -> 法規制チェック
+ROUTE_JAPANESE = "japanese"  # 日本語名 -> 翻訳 -> OPSIN -> 法規制チェック
+
+# SMILESに使われる文字だけか (空白を含むものは名前)
+SMILES_CHARS = re.compile(r"[A-Za-z0-9@+\-\[\]()=#$%:/\\.*~]+")
+
+NEGATIVE_CACHE_TTL = 60  # SMILESに変換できなかった英語名を覚えておく秒数
+
+
+
+
+# 入力の種類を判定する
+# 戻り値: (種類, 以降の段に渡す文字列)
+# 全角英数字だけの入力は半角にしてから判定する (日本語を含む入力はそのまま翻訳に回す)
+def classify_input(text):
+    text = text.strip()
+    ascii_text = unicodedata.normalize("NFKC", text)
+    if not ascii_text.isascii():
+        return ROUTE_JAPANESE, text
+
+    if SMILES_CHARS.fullmatch(ascii_text):
+        with rdBase.BlockLogs(): # 名前をSMILESとして読んだときのエラーは出さない
+            mol = Chem.MolFromSmiles(ascii_text)
+        if mol is not None:
+            return ROUTE_SMILES, ascii_text
+    return ROUTE_NAME, ascii_text
+
+
+
+
+# 日本語名 -> 英語名
+def japanese_to_english(text):
+    tokenizer = ja_to_smiles.tokenizer  # 途中で辞書が差し替わっても、1件の中では同じものを使う
+    version = tokenizer.version
+    english_name = search_cache.name_cache.get(text, version)
+    if english_name is not MISS:
+        return english_name
+
+    # tokenizer.translate() と同じ処理を段ごとに計測する
+    with metrics.timed("normalize_text"):
+        normalized = tokenizer.normalize(text)
+    with metrics.timed("tokenize_and_parse"):
+        words = tokenizer.tokenize_words(normalized)
+    with metrics.timed("translate_tokens_with_reorder"):
+        english_name = tokenizer.join_words(words)
+
+    search_cache.name_cache.put(text, version, english_name)
+    return english_name
+
+
+
+
+# 英語名 -> SMILES (変換失敗のNoneは NEGATIVE_CACHE_TTL 秒だけキャッシュする)
+# limiter: OPSINを呼ぶ間だけ入るコンテキスト (同時に変換する数を絞る場合。キャッシュにあれば入らない)
+def name_to_smiles(english_name, limiter=None):
+    version = opsin_engine.OPSIN_JAR_PATH  # OPSINの版が変わったら作り直す
+    smiles = search_cache.smiles_cache.get(english_name, version)
+    if smiles is not MISS:
+        return smiles
+
+    with limiter or nullcontext():
+        with metrics.timed("convert_name_to_smiles"):
+            smiles = ja_to_smiles.convert_name_to_smiles(english_name)
+
+    _remember_smiles(english_name, version, smiles)
+    return smiles
+
+
+
+
+# 変換できなかった(None)ときは、OPSINの起動失敗・時間切れなどの一時的なものと区別できないので
+# NEGATIVE_CACHE_TTL 秒だけ覚えておく (ディスクには書かない)
+def _remember_smiles(english_name, version, smiles):
+    if smiles is None:
+        search_cache.smiles_cache.put(english_name, version, None, ttl=NEGATIVE_CACHE_TTL)
+    else:
+        search_cache.smiles_cache.put(english_name, version, smiles)
+
+
+# 英語名のリスト -> SMILESのリスト (キャッシュにないものだけまとめてOPSINに流す)
+def names_to_smiles(english_names):
+    version = opsin_engine.OPSIN_JAR_PATH
+    results = []
+    missing = {} # 英語名 -> resultsでの位置のリスト
+    for i, english_name in enumerate(english_names):
+        smiles = search_cache.smiles_cache.get(english_name, version)
+        results.append(smiles)
+        if smiles is MISS:
+            missing.setdefault(english_name, []).append(i)
+
+    if missing:
+        names = list(missing)
+        with metrics.timed("convert_names_to_smiles"):
+            converted = ja_to_smiles.convert_names_to_smiles(names)
+        for english_name, smiles in zip(names, converted):
+            _remember_smiles(english_name, version, smiles)
+            for i in missing[english_name]:
+                results[i] = smiles
+
+    return results
+
+
+
+
+# SMILES -> 判定結果 (書き方の違うSMILESも同じ物質なら同じキャッシュを使う)
+def check_smiles(reg_checker, smiles):
+    with metrics.timed("parse_smiles"):
+        mol = Chem.MolFromSmiles(smiles)
+        key = Chem.MolToSmiles(mol) if mol is not None else None
+    if mol is None:
+        return reg_checker.check(smiles) # 解析できないSMILESはキャッシュしない
+
+    version = reg_checker.db_version
+    results = search_cache.result_cache.get(key, version)
+    if results is not MISS:
+        return results
+
+    stats = {}
+    with metrics.timed("check_regulations.check"):
+        results = reg_checker.check(smiles, stats)
+    metrics.observe_check(stats)
+
+    search_cache.result_cache.put(key, version, results)
+    return results
+
+
+
+
+# 入力 -> (種類, 英語名, SMILES)
+# SMILESの入力はそのままSMILESとし、OPSINは呼ばない (それ以外のSMILESはNone。英語名からOPSINで変換する)
+# SMILES・英語名の入力は、英語名欄に入力そのものを入れる
+def resolve_input(input_text):
+    with metrics.timed("classify_input"):
+        route, value = classify_input(input_text)
+    metrics.input_routes.inc(route)
+    if route == ROUTE_SMILES:
+        return route, value, value
+    if route == ROUTE_NAME:
+        return route, value, None
+    return route, japanese_to_english(value), None
+
+
+
+
+# 検索1件分 (APIの応答と同じ形の辞書を返す)
+def run_search(input_text, reg_checker):
+    route, english_name, smiles = resolve_input(input_text)
+    if smiles is None:
+        smiles = name_to_smiles(english_name)
+
+    if not smiles:
+        return {
+            "route": route,
+            "english_name": english_name,
+            "smiles": None,
+            "regulations": [],
+            "message": "SMILES変換に失敗しました"
+        }
+
+    check_results = check_smiles(reg_checker, smiles)
+
+    return {
+        "original": input_text,
+        "route": route,
+        "english_name": english_name,
+        "smiles": smiles,
+        "regulations": check_results
+    }
@@ -0,0 +1,197 @@
+import argparse
+import hashlib
+import logging
+import os
+import pickle
+
+from rdkit import Chem, DataStructs, rdBase
+
+import checker
+
+logger = logging.getLogger(__name__)
+
+# 法規制DBのスナップショット
+# 法律JSONの読み込みとSMILESの解析・指紋計算、登録パターンの包含関係の木を前もって済ませ、1つのファイルにまとめておく。
+# 起動時は解析も木の作成もしないので、DBが大きくてもワーカーの起動が速い
+# (索引や行列を組み立て直す分の時間はかかる)。
+#
+#   python -m regulation_snapshot            # build/regulation_db.pickle を作成
+#
+# 元の法律JSONが変わっていたら、スナップショットは使わずにJSONから読み込む
+# (その場合も、変わっていない登録SMILESの前計算と木の親子関係は使い回す)。
+
+SNAPSHOT_PATH = os.environ.get("CHEMREGU_SNAPSHOT", "build/regulation_db.pickle")
+SNAPSHOT_FORMAT = 1
+
+
+
+
+# 法律JSONの中身のハッシュ (スナップショットが古くないかの確認用)
+def source_hashes():
+    hashes = {}
+    for filepath, law_name in checker.LAW_SOURCES:
+        if os.path.exists(filepath):
+            with open(filepath, 'rb') as f:
+                hashes[filepath] = hashlib.sha1(f.read()).hexdigest()
+        else:
+            hashes[filepath] = None
+    return hashes
+
+
+
+
+# 以前のスナップショットに同じ登録SMILESがあれば、その前計算(バイナリ)と木の親をそのまま使う
+# 戻り値: 差分の報告 (checker.diff_entries() の結果に、解析した数・使い回した数を加えたもの)
+def build_snapshot(path=SNAPSHOT_PATH):
+    regulation_db = checker.load_and_merge_laws()
+
+    previous = _read_snapshot(path)
+    has_previous = previous is not None
+    previous = previous or {"regulation_db": {}, "compiled": {}}
+    previous_tree_parents = previous.get("tree_parents")
+    previous_compiled = previous["compiled"]
+
+    compiled = {}
+    stats = {"reused": 0, "compiled": 0, "invalid": 0}
+    for smiles_pattern in regulation_db:
+        if smiles_pattern in previous_compiled:
+            entry = previous_compiled[smiles_pattern]
+            if "elements" not in entry: # 古いスナップショットの前計算には原子数・元素の数を足しておく
+                mol = Chem.Mol(entry["mol"])
+                entry = dict(entry, num_atoms=mol.GetNumAtoms(), elements=checker.element_counts(mol))
+            compiled[smiles_pattern] = entry
+            stats["reused"] += 1
+            continue
+
+        stats["compiled"] += 1
+        entry = checker.compile_pattern(smiles_pattern)
+        if entry is None:
+            logger.warning(f"DB登録エラー: '{smiles_pattern}' は不正なSMILESです。スキップします。")
+            stats["invalid"] += 1
+            continue
+        # RDKitのオブジェクトはバイナリにして保存
+        compiled[smiles_pattern] = {
+            "mol": entry["mol"].ToBinary(),
+            "fp": entry["fp"].ToBinary(),
+            "canon": entry["canon"],
+            "flat": entry["flat"],
+            "num_atoms": entry["num_atoms"],
+            "elements": entry["elements"]
+        }
+
+    # 包含関係の木 (変わった登録SMILESの所だけ作り直す)
+    built = checker.check_regulations(regulation_db, _decode_compiled({"compiled": compiled}), previous_tree_parents)
+
+    data = {
+        "format": SNAPSHOT_FORMAT,
+        "rdkit": rdBase.rdkitVersion,
+        "sources": source_hashes(),
+        "regulation_db": regulation_db,
+        "compiled": compiled,
+        "tree_parents": built.tree_parents()
+    }
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # 書きかけのファイルを読まれないよう、別名で書いてから置き換える
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+    old_hashes = {k: checker.entry_hash(k, v) for k, v in previous["regulation_db"].items()}
+    new_hashes = {k: checker.entry_hash(k, v) for k, v in regulation_db.items()}
+    report = checker.diff_entries(old_hashes, new_hashes)
+    report.update(stats)
+    report["entries"] = len(regulation_db)
+    report["previous"] = has_previous  # 以前のスナップショットと比べたか
+    return report
+
+
+
+
+# スナップショットのファイルを読む (なければ/形式が違えばNone。法律JSONとの照合はしない)
+def _read_snapshot(path):
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+    except Exception as e:
+        logger.warning(f"スナップショット {path} を読み込めません({e})。")
+        return None
+
+    if data.get("format") != SNAPSHOT_FORMAT or data.get("rdkit") != rdBase.rdkitVersion:
+        logger.warning(f"スナップショット {path} の形式が古いため使いません。")
+        return None
+    return data
+
+
+# 原子数・元素ごとの原子数がない古いスナップショットは、ここで数えて補う
+def _decode_compiled(data):
+    compiled = {}
+    for smiles_pattern, entry in data["compiled"].items():
+        mol = Chem.Mol(entry["mol"])
+        compiled[smiles_pattern] = {
+            "mol": mol,
+            "fp": DataStructs.ExplicitBitVect(entry["fp"]),
+            "canon": entry["canon"],
+            "flat": entry["flat"],
+            "num_atoms": entry["num_atoms"] if "num_atoms" in entry else mol.GetNumAtoms(),
+            "elements": entry["elements"] if "elements" in entry else checker.element_counts(mol)
+        }
+    return compiled
+
+
+# スナップショットを読む (なければ/古ければNone)
+# 戻り値: (regulation_db, compiled, tree_parents)  check_regulationsにそのまま渡せる形
+def load_snapshot(path=SNAPSHOT_PATH):
+    data = _read_snapshot(path)
+    if data is None:
+        return None
+    if data.get("sources") != source_hashes():
+        logger.warning(f"法律JSONがスナップショット {path} の作成後に変更されています。JSONから読み込みます。")
+        return None
+    return data["regulation_db"], _decode_compiled(data), data.get("tree_parents")
+
+
+# スナップショットの前計算と木の親だけを読む (法律JSONが変わっていても使える。なければ空とNone)
+# 変わっていない登録SMILESの解析と親探しを省くために check_regulations に渡す
+def load_previous(path=SNAPSHOT_PATH):
+    data = _read_snapshot(path)
+    if data is None:
+        return {}, None
+    return _decode_compiled(data), data.get("tree_parents")
+
+
+
+
+def load_checker(path=SNAPSHOT_PATH):
+    loaded = load_snapshot(path)
+    if loaded is None:
+        return None
+    regulation_db, compiled, tree_parents = loaded
+    return checker.check_regulations(regulation_db, compiled, tree_parents)
+
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m regulation_snapshot", description="法規制DBのスナップショットを作成する")
+    parser.add_argument("-o", "--output", default=SNAPSHOT_PATH, help=f"出力先 (既定: {SNAPSHOT_PATH})")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.environ.get("CHEMREGU_LOG_LEVEL", "WARNING").upper())
+
+    report = build_snapshot(args.output)
+    print(f"スナップショットを作成しました: {args.output} (登録SMILES {report['entries']}件, 解析 {report['compiled']}件, 使い回し {report['reused']}件)")
+    if report["previous"]:
+        for key, label in [("added", "追加"), ("removed", "削除"), ("changed", "変更")]:
+            for smiles_pattern in report[key]:
+                print(f"  {label}: {smiles_pattern}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from rdkit import Chem
+
+import checker
+from search_cache import MISS
+
+logger = logging.getLogger(__name__)
+
+# 判定結果の保存先 (在庫リストなどを定期的にチェックし直す用)
+# 物質ごと(InChIKey)に「どの版の法律DBで」「どんな判定だったか」をSQLiteに残しておき、
+# 次回のチェックでは新しい物質と、法律の変更で結果が変わり得る物質だけを判定し直す。
+#
+# invalidate="selective" (既定) のとき、法律DBの版が違う保存結果は次のように扱う:
+# - 一致していた登録SMILESが削除・変更されていれば判定し直す
+# - 追加された登録SMILESだけで判定して1件でも一致すれば判定し直す
+# - どちらでもなければ保存結果をそのまま使い、版だけ新しくする
+# invalidate="all" なら、版が違う保存結果はすべて判定し直す。
+#
+# 同じInChIKeyでも正規化SMILESが違う(互変異性体など)ときは、保存結果を使わずに判定し直して上書きする。
+
+INVALIDATE_MODES = ("selective", "all")
+FETCH_BATCH = 500  # 1回のSELECTで問い合わせるInChIKeyの数
+
+
+
+
+class result_store:
+    def __init__(self, path, invalidate="selective"):
+        if invalidate not in INVALIDATE_MODES:
+            raise ValueError(f"invalidate は {' / '.join(INVALIDATE_MODES)} のどれかです: {invalidate}")
+        self.path = path
+        self.invalidate = invalidate
+        self._local = threading.local()  # 接続はスレッドごと
+        self._lock = threading.Lock()
+        self._changes = {}               # (古い版, 新しい版) -> 差分 (_change() を参照)
+        self._registered = set()         # 保存済みの版
+
+        self.hits = 0         # 同じ版の保存結果を使った
+        self.revalidated = 0  # 版は違うが、変更の影響がないので保存結果を使った
+        self.invalidated = 0  # 変更の影響があり、判定し直した
+        self.misses = 0       # 保存結果がなかった
+
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " inchikey TEXT PRIMARY KEY, smiles TEXT, db_version TEXT,"
+                " regulations TEXT, patterns TEXT, checked REAL)"
+            )
+            # 版ごとの 登録SMILES -> entry_hash() (版の間の差分を取るため)
+            conn.execute("CREATE TABLE IF NOT EXISTS versions (db_version TEXT PRIMARY KEY, entries TEXT, created REAL)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+
+
+    # --- 法律DBの版 ---
+    def _register_version(self, reg_checker):
+        if reg_checker.db_version in self._registered:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO versions (db_version, entries, created) VALUES (?, ?, ?)",
+                (reg_checker.db_version, json.dumps(reg_checker.entry_hashes), time.time())
+            )
+        self._registered.add(reg_checker.db_version)
+
+
+    # 古い版から今の版への差分
+    # 戻り値: {"affected": 削除・変更された登録SMILESの集合, "added_checker": 追加分だけのチェッカー (なければNone)}
+    #         古い版の中身が分からなければNone
+    def _change(self, reg_checker, old_version):
+        cache_key = (old_version, reg_checker.db_version)
+        with self._lock:
+            if cache_key in self._changes:
+                return self._changes[cache_key]
+
+        row = self._connect().execute("SELECT entries FROM versions WHERE db_version=?", (old_version,)).fetchone()
+        if row is None:
+            change = None
+        else:
+            diff = checker.diff_entries(json.loads(row[0]), reg_checker.entry_hashes)
+            added = diff["added"]
+            change = {
+                "affected": set(diff["removed"]) | set(diff["changed"]),
+                "added_checker": reg_checker.subset(added) if added else None
+            }
+            logger.info(
+                f"法律DBの版 {old_version[:8]} -> {reg_checker.db_version[:8]}: "
+                f"追加 {len(added)}件, 削除 {len(diff['removed'])}件, 変更 {len(diff['changed'])}件"
+            )
+
+        with self._lock:
+            self._changes[cache_key] = change
+        return change
+
+
+
+
+    # 物質のキー (InChIKey, 正規化SMILES)。作れなければNone (保存しない)
+    @staticmethod
+    def _key(smiles):
+        mol = Chem.MolFromSmiles(smiles)
+        if mol is None:
+            return None
+        try:
+            inchikey = Chem.MolToInchiKey(mol)
+        except Exception:
+            return None
+        if not inchikey:
+            return None
+        return inchikey, Chem.MolToSmiles(mol)
+
+
+    def _fetch(self, inchikeys):
+        rows = {}
+        conn = self._connect()
+        for start in range(0, len(inchikeys), FETCH_BATCH):
+            batch = inchikeys[start:start + FETCH_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            for inchikey, smiles, db_version, regulations, patterns in conn.execute(
+                f"SELECT inchikey, smiles, db_version, regulations, patterns FROM results WHERE inchikey IN ({placeholders})",
+                batch
+            ):
+                rows[inchikey] = (smiles, db_version, regulations, patterns)
+        return rows
+
+
+    # 保存結果が今の版でも使えるか (使えれば判定結果、使えなければMISS)
+    def _reuse(self, reg_checker, smiles, key, row):
+        if row is None:
+            self.misses += 1
+            return MISS, False
+        stored_smiles, stored_version, regulations, patterns = row
+        if stored_smiles != key[1]:
+            self.misses += 1
+            return MISS, False
+        if stored_version == reg_checker.db_version:
+            self.hits += 1
+            return json.loads(regulations), False
+        if self.invalidate == "all":
+            self.invalidated += 1
+            return MISS, False
+
+        change = self._change(reg_checker, stored_version)
+        if change is None or change["affected"].intersection(json.loads(patterns)):
+            self.invalidated += 1
+            return MISS, False
+        if change["added_checker"] is not None:
+            try:
+                newly_matched = change["added_checker"].check(smiles)
+            except Exception:
+                newly_matched = True
+            if newly_matched:
+                self.invalidated += 1
+                return MISS, False
+
+        self.revalidated += 1
+        return json.loads(regulations), True
+
+
+
+
+    # SMILESのリストを判定する (保存結果が使えないものだけ compute に渡す)
+    # compute: SMILESのリスト -> 判定結果のリスト (失敗した物質は例外オブジェクト。保存しない)
+    # 戻り値: 入力と同じ順の判定結果のリスト
+    def check_many(self, reg_checker, smiles_list, compute):
+        try:
+            self._register_version(reg_checker)
+            keys = [self._key(smiles) for smiles in smiles_list]
+            rows = self._fetch(sorted({key[0] for key in keys if key is not None}))
+        except sqlite3.Error as e:
+            logger.warning(f"判定結果の保存先を読めません。すべて判定します: {e}")
+            return compute(smiles_list)
+
+        results = [None] * len(smiles_list)
+        todo = []
+        revalidated = []
+        for i, (smiles, key) in enumerate(zip(smiles_list, keys)):
+            if key is None:
+                todo.append(i)
+                continue
+            regulations, was_revalidated = self._reuse(reg_checker, smiles, key, rows.get(key[0]))
+            if regulations is MISS:
+                todo.append(i)
+                continue
+            results[i] = regulations
+            if was_revalidated:
+                revalidated.append(key[0])
+
+        to_save = []
+        for i, regulations in zip(todo, compute([smiles_list[i] for i in todo])):
+            results[i] = regulations
+            key = keys[i]
+            if key is not None and not isinstance(regulations, Exception):
+                patterns = sorted({reg["pattern_matched"] for reg in regulations})
+                to_save.append((
+                    key[0], key[1], reg_checker.db_version,
+                    json.dumps(regulations, ensure_ascii=False), json.dumps(patterns, ensure_ascii=False), time.time()
+                ))
+
+        try:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO results (inchikey, smiles, db_version, regulations, patterns, checked)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    to_save
+                )
+                conn.executemany(
+                    "UPDATE results SET db_version=? WHERE inchikey=?",
+                    [(reg_checker.db_version, inchikey) for inchikey in revalidated]
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"判定結果の保存に失敗しました: {e}")
+
+        return results
+
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "invalidated": self.invalidated,
+            "misses": self.misses
+        }
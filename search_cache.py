@@ -0,0 +1,208 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# 検索結果のキャッシュ
+# 段階ごと(日本語名 -> 英語名, 英語名 -> SMILES, SMILES -> 判定結果)に1つずつ持つ。
+# 各キャッシュは「版」(辞書やDBの中身のハッシュ)付きで保存し、違う版のものは使わない。
+# (読み直しの途中で古い版と新しい版のリクエストが混ざっても、お互いのキャッシュを捨てないよう、
+#  メモリでは版もキーに含め、ディスクでは後から見た版のデータを消さない)
+# 環境変数 CHEMREGU_CACHE_DB にファイルパスを指定すると、SQLiteに書き出して
+# gunicornの全ワーカーで共有する。
+
+DISK_CACHE_PATH = os.environ.get("CHEMREGU_CACHE_DB")
+DISK_CACHE_TTL = 7 * 24 * 3600  # ディスク上のキャッシュの有効期間(秒)
+
+MISS = object()  # 「キャッシュになかった」の印 (Noneも結果として保存するため)
+
+
+
+
+# 複数プロセスで共有するSQLiteのキャッシュ
+class sqlite_cache_backend:
+    def __init__(self, path, ttl=DISK_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()  # 接続はスレッドごと
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " layer TEXT, version TEXT, key TEXT, value TEXT, created REAL,"
+                " PRIMARY KEY (layer, version, key))"
+            )
+            # 段ごとに見た版 (rowidの順 = 最初に見た順。新旧の判定用)
+            conn.execute("CREATE TABLE IF NOT EXISTS versions (layer TEXT, version TEXT, PRIMARY KEY (layer, version))")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, layer, version, key):
+        try:
+            row = self._connect().execute(
+                "SELECT value, created FROM cache WHERE layer=? AND version=? AND key=?",
+                (layer, version, key)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"キャッシュDBの読み込みに失敗しました: {e}")
+            return MISS
+        if row is None:
+            return MISS
+        value, created = row
+        if self.ttl is not None and time.time() - created > self.ttl:
+            return MISS
+        return json.loads(value)
+
+    def put(self, layer, version, key, value):
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (layer, version, key, value, created) VALUES (?, ?, ?, ?, ?)",
+                    (layer, version, key, json.dumps(value, ensure_ascii=False), time.time())
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"キャッシュDBへの書き込みに失敗しました: {e}")
+
+    # その段で version より前に見た版のデータと、期限切れのデータを消す
+    # (他のプロセスがまだ使っている、後から見た新しい版のデータは消さない)
+    def prune(self, layer, version):
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("INSERT OR IGNORE INTO versions (layer, version) VALUES (?, ?)", (layer, version))
+                conn.execute(
+                    "DELETE FROM cache WHERE layer=? AND version IN ("
+                    " SELECT version FROM versions WHERE layer=? AND rowid <"
+                    " (SELECT rowid FROM versions WHERE layer=? AND version=?))",
+                    (layer, layer, layer, version)
+                )
+                if self.ttl is not None:
+                    conn.execute("DELETE FROM cache WHERE created<?", (time.time() - self.ttl,))
+        except sqlite3.Error as e:
+            logger.warning(f"キャッシュDBの掃除に失敗しました: {e}")
+
+
+
+
+# 件数上限(LRU)と有効期間(TTL)つきのメモリキャッシュ
+class lru_ttl_cache:
+    def __init__(self, name, maxsize=1024, ttl=None, backend=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+
+        self._data = OrderedDict()  # (版, key) -> (値, 保存時刻, 有効期間 (Noneならキャッシュ全体のttl))
+        self._version = None        # 最後に初めて見た版
+        self._versions = set()      # このプロセスで見た版
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    # 初めて見た版ならTrue (古い版のメモリ上のものは捨てず、LRUで自然に追い出す)
+    def _see_version(self, version):
+        if version in self._versions:
+            return False
+        self._versions.add(version)
+        self._version = version
+        return True
+
+
+    def get(self, key, version):
+        with self._lock:
+            first_seen = self._see_version(version)
+            entry = self._data.get((version, key))
+            if entry is not None:
+                value, stored_at, ttl = entry
+                ttl = self.ttl if ttl is None else ttl
+                if ttl is None or time.monotonic() - stored_at <= ttl:
+                    self._data.move_to_end((version, key))
+                    self.hits += 1
+                    return value
+                del self._data[(version, key)]
+
+        if self.backend is not None:
+            if first_seen:
+                self.backend.prune(self.name, version)
+            value = self.backend.get(self.name, version, key)
+            if value is not MISS:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._store(key, version, value)
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return MISS
+
+
+    # ttl: この値だけの有効期間(秒)。短い間だけ覚えておくもの(失敗の結果など)なので、ディスクには書かない
+    def put(self, key, version, value, ttl=None):
+        with self._lock:
+            first_seen = self._see_version(version)
+            self._store(key, version, value, ttl)
+        if self.backend is not None and ttl is None:
+            if first_seen:
+                self.backend.prune(self.name, version)
+            self.backend.put(self.name, version, key, value)
+
+
+    def _store(self, key, version, value, ttl=None):
+        self._data[(version, key)] = (value, time.monotonic(), ttl)
+        self._data.move_to_end((version, key))
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+
+
+_disk_backend = sqlite_cache_backend(DISK_CACHE_PATH) if DISK_CACHE_PATH else None
+
+# 段ごとのキャッシュ
+name_cache = lru_ttl_cache("ja_to_english", maxsize=4096, backend=_disk_backend)        # 日本語名 -> 英語名
+smiles_cache = lru_ttl_cache("english_to_smiles", maxsize=4096, backend=_disk_backend)  # 英語名 -> SMILES
+result_cache = lru_ttl_cache("smiles_to_results", maxsize=4096, backend=_disk_backend)  # 正規化SMILES -> 判定結果
+
+ALL_CACHES = [name_cache, smiles_cache, result_cache]
+
+
+def cache_stats():
+    return {cache.name: cache.stats() for cache in ALL_CACHES}
+
+
+def clear_all():
+    for cache in ALL_CACHES:
+        cache.clear()
@@ -0,0 +1,90 @@
+import threading
+
+import numpy as np
+from rdkit import Chem
+from rdkit.Chem import rdFingerprintGenerator
+
+# 類似度検索 (部分構造では引っかからない類縁体向け)
+# 登録SMILESごとのMorgan指紋を1つの行列(ビットを64ビット整数に詰めたもの)にしておき、
+# 入力との Tanimoto 係数を全パターンに対してnumpyでまとめて計算する。
+
+MORGAN_RADIUS = 2
+FP_SIZE = 2048
+DEFAULT_TOP_K = 10
+SCORE_BLOCK_CELLS = 1 << 22  # 複数の入力をまとめて比べるとき、一度に作る (入力 x パターン x 64ビット) の配列の大きさの上限 (32MB)
+
+_generator = rdFingerprintGenerator.GetMorganGenerator(radius=MORGAN_RADIUS, fpSize=FP_SIZE)
+_generator_lock = threading.Lock()  # 指紋生成器はスレッド間で共有しない
+
+
+
+
+# Morgan指紋を64ビット整数の配列にする
+def packed_fingerprint(mol):
+    with _generator_lock:
+        bits = _generator.GetFingerprintAsNumPy(mol)
+    return np.packbits(bits).view(np.uint64)
+
+
+# 類似度を見る部分 (塩などの複数成分なら、原子数が最大の成分)
+def main_component(mol):
+    try:
+        fragments = Chem.GetMolFrags(mol, asMols=True, sanitizeFrags=True)
+    except Exception:
+        return mol
+    return max(fragments, key=lambda frag: frag.GetNumAtoms())
+
+
+
+
+class similarity_index:
+    # compiled: 登録SMILES -> compile_pattern()の結果
+    def __init__(self, compiled):
+        self.smiles = list(compiled)
+        self.matrix = np.zeros((len(self.smiles), FP_SIZE // 64), dtype=np.uint64)
+        for i, smiles_pattern in enumerate(self.smiles):
+            self.matrix[i] = packed_fingerprint(compiled[smiles_pattern]["mol"])
+        self.bit_counts = np.bitwise_count(self.matrix).sum(axis=1, dtype=np.int32)
+
+
+    # 全パターンとのTanimoto係数 (両方ともビットがなければ0)
+    def tanimoto(self, query_fp):
+        common = np.bitwise_count(self.matrix & query_fp).sum(axis=1, dtype=np.int32)
+        union = self.bit_counts + int(np.bitwise_count(query_fp).sum()) - common
+        return np.divide(common, union, out=np.zeros(len(common)), where=union > 0)
+
+
+    # 複数の入力 (packed_fingerprint() の結果を縦に並べた行列) と全パターンとのTanimoto係数 (行 = 入力)
+    # 入力 x パターンの配列が大きくなりすぎないよう、入力を何件かずつに分けて計算する
+    def tanimoto_many(self, query_fps):
+        scores = np.zeros((len(query_fps), len(self.smiles)))
+        query_counts = np.bitwise_count(query_fps).sum(axis=1, dtype=np.int32)
+        step = max(1, SCORE_BLOCK_CELLS // max(1, self.matrix.size))
+        for start in range(0, len(query_fps), step):
+            block = query_fps[start:start + step]
+            common = np.bitwise_count(self.matrix[np.newaxis] & block[:, np.newaxis]).sum(axis=2, dtype=np.int32)
+            union = self.bit_counts + query_counts[start:start + step, np.newaxis] - common
+            np.divide(common, union, out=scores[start:start + step], where=union > 0)
+        return scores
+
+
+    # 類似度の高い順に (登録SMILES, 類似度) を最大k件
+    def top_k(self, mol, k=DEFAULT_TOP_K, min_similarity=0.0):
+        if not self.smiles or k <= 0:
+            return []
+        return self._select(self.tanimoto(packed_fingerprint(main_component(mol))), k, min_similarity)
+
+
+    # top_k() を複数の分子に対してまとめて行う (全入力の類似度を1回の行列計算で求める。結果は入力と同じ順)
+    def top_k_many(self, mols, k=DEFAULT_TOP_K, min_similarity=0.0):
+        if not self.smiles or k <= 0 or not mols:
+            return [[] for _ in mols]
+        query_fps = np.stack([packed_fingerprint(main_component(mol)) for mol in mols])
+        return [self._select(scores, k, min_similarity) for scores in self.tanimoto_many(query_fps)]
+
+
+    def _select(self, scores, k, min_similarity):
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.smiles[i], float(scores[i])) for i in top if scores[i] >= min_similarity]
@@ -147,7 +147,12 @@ async function checkChemical() {
 
         // 結果HTMLの生成
         let html = `<h3>${escapeHtml(inputVal)}</h3>`;
-        html += `<p><strong>${escapeHtml(data.english_name)}</strong> <small>(独自の規則で翻訳されています。)</small></p>`;
+        // 日本語名のときだけ翻訳した英語名を出す (英語名・SMILESの入力はそのまま使っている)
+        if (data.route === "japanese") {
+            html += `<p><strong>${escapeHtml(data.english_name)}</strong> <small>(独自の規則で翻訳されています。)</small></p>`;
+        } else if (data.route === "name") {
+            html += `<p><strong>${escapeHtml(data.english_name)}</strong></p>`;
+        }
         html += `<p><strong>SMILES:</strong> ${data.smiles || "変換できませんでした"}</p>`;
         
         // まずデータがあるか確認し、nullなら空配列 [] に置き換える
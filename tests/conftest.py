@@ -0,0 +1,97 @@
+import os
+import sys
+
+# 法律・辞書ファイルは相対パスで読むので、リポジトリの直下で動かす
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import shutil
+
+import pytest
+
+import checker
+
+
+DATA_DIR = os.path.join(ROOT, "tests", "data")
+
+# 範囲(scope)の種類をすべて使い、包含関係が入れ子になったテスト用の法律JSON
+SCOPED_LAW_FILES = [
+    ("scoped_law_a.json", "テスト法A"),
+    ("scoped_law_b.json", "テスト法B")
+]
+
+# 電荷・明示の水素・塩・水和物・エステルなどを混ぜた入力
+PROBE_SMILES = [
+    "CC(N)Cc1ccccc1", "CNC(C)Cc1ccccc1", "C[C@H](N)Cc1ccccc1", "C[C@@H](N)Cc1ccccc1",
+    "CC(N)Cc1ccccc1.Cl", "CC([NH3+])Cc1ccccc1.[Cl-]", "CC(N)Cc1ccccc1.O.O", "CC(NC)Cc1ccccc1.Cl.O",
+    "C[C@H](N)Cc1ccccc1.OS(=O)(=O)O", "CCN(CC)C(C)Cc1ccccc1", "[2H]C([2H])([2H])NC(C)Cc1ccccc1",
+    "CCc1ccccc1", "Cc1ccccc1C", "CCc1ccccc1.O", "[CH3][CH2]c1ccccc1",
+    "Oc1ccccc1", "CC(=O)Oc1ccccc1", "COc1ccccc1", "[O-]c1ccccc1.[Na+]",
+    "CN1CCC[C@H]1c1cccnc1", "CN1CCC[C@H]1c1cccnc1.OC(=O)C(O)C(O)C(=O)O",
+    "ClC(Cl)Cl", "ClC(Cl)Cl.O", "[2H]C(Cl)(Cl)Cl",
+    "c1ccccc1", "c1ccc2ccccc2c1", "Cc1ccc2ccccc2c1", "[Hg]", "Cl[Hg]Cl", "C[Hg]Cl", "[Hg+2].[Cl-].[Cl-]",
+    "[Pb]", "CC[Pb](CC)(CC)CC", "CC(=O)O[Pb]OC(C)=O", "[Pb+2].[O-]S(=O)(=O)[O-]",
+    "C#N", "[K+].[C-]#N", "N#C[Na]", "[Na+].[O-]C(=O)c1ccccc1O", "OC(=O)c1ccccc1O.NCCO",
+    "O=[N+]([O-])c1ccccc1", "Cc1ccc([N+](=O)[O-])cc1", "CC(=O)O", "CC(=O)OC", "CC(=O)[O-].[Na+]",
+    "CCCC", "O", "[Na+].[Cl-]"
+]
+
+
+# テスト用の法律JSONを一時ディレクトリに写し、LAW_SOURCES をそちらに向ける
+# 戻り値: 写したファイルのパスのリスト (書き換えて差分の読み込みを試せる)
+@pytest.fixture
+def scoped_laws(tmp_path, monkeypatch):
+    sources = []
+    for filename, law_name in SCOPED_LAW_FILES:
+        path = tmp_path / filename
+        shutil.copy(os.path.join(DATA_DIR, filename), path)
+        sources.append((str(path), law_name))
+    monkeypatch.setattr(checker, "LAW_SOURCES", sources)
+    return [path for path, _ in sources]
+
+
+@pytest.fixture
+def probe_smiles():
+    return list(PROBE_SMILES)
+
+
+# OPSINの代わりに名前 -> SMILESの表で答える偽の java コマンド
+# "die" で異常終了、"slow" で応答しなくなる。表にない名前は空行 (変換失敗)
+FAKE_OPSIN = """#!{python}
+import sys
+import time
+
+answers = {{"ethanol": "CCO", "methanol": "CO", "benzene": "c1ccccc1"}}
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    name = line.strip()
+    if name == "die":
+        sys.exit(1)
+    if name == "slow":
+        time.sleep(30)
+    print(answers.get(name, ""), flush=True)
+"""
+
+
+# PATHの先頭に偽の java を置き、OPSINのjarもあることにする
+@pytest.fixture
+def fake_opsin(tmp_path, monkeypatch):
+    import opsin_engine
+
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    java = bin_dir / "java"
+    java.write_text(FAKE_OPSIN.format(python=sys.executable))
+    java.chmod(0o755)
+    jar = tmp_path / "opsin.jar"
+    jar.write_text("")
+
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}")
+    monkeypatch.setattr(opsin_engine, "OPSIN_JAR_PATH", str(jar))
+    engine = opsin_engine.opsin_process(jar_path=str(jar), timeout=2.0)
+    monkeypatch.setattr(opsin_engine, "get_engine", lambda: engine)
+    yield engine
+    engine.close()
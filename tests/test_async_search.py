@@ -0,0 +1,45 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app
+import async_search
+import hot_reload
+import pipeline
+
+
+def test_default_limit_leaves_threads_for_503():
+    assert async_search.MAX_PENDING < async_search.SERVER_THREADS
+
+
+def test_search_returns_503_when_all_slots_are_taken(monkeypatch):
+    release = threading.Event()
+    waiting = []
+
+    def slow_name_to_smiles(english_name, limiter=None):
+        waiting.append(english_name)
+        release.wait(10)
+        return None
+
+    monkeypatch.setattr(pipeline, "name_to_smiles", slow_name_to_smiles)
+    monkeypatch.setattr(hot_reload, "ensure_started", lambda: None)
+    monkeypatch.setattr(app, "search_service", async_search.search_service())
+
+    def post(text):
+        return app.app.test_client().post("/api/search", json={"text": text})
+
+    # gunicornの1ワーカーと同じく SERVER_THREADS 本のスレッドで受ける
+    with ThreadPoolExecutor(async_search.SERVER_THREADS) as executor:
+        pending = [executor.submit(post, f"test name {i}") for i in range(async_search.MAX_PENDING)]
+        deadline = time.monotonic() + 10
+        while len(waiting) < async_search.MAX_PENDING and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(waiting) == async_search.MAX_PENDING
+
+        busy = executor.submit(post, "one more name").result(10)
+        release.set()
+        accepted = [future.result(10) for future in pending]
+
+    assert busy.status_code == 503
+    assert busy.headers["Retry-After"] == str(async_search.RETRY_AFTER)
+    assert [response.status_code for response in accepted] == [200] * async_search.MAX_PENDING
@@ -0,0 +1,43 @@
+import io
+import json
+
+import app
+import batch_screen
+import checker
+
+
+REGULATION_DB = {
+    "c1ccccc1": [{"law": "テスト法", "name": "ベンゼン", "scope": [], "description": ""}]
+}
+
+
+def _screen(text):
+    reg_checker = checker.check_regulations(REGULATION_DB)
+    results = list(batch_screen.screen_records(batch_screen.iter_records(io.StringIO(text), "csv"), reg_checker))
+    return results[:-1], results[-1]["summary"]
+
+
+def test_unparseable_smiles_is_error():
+    rows, summary = _screen("smiles\nC1CC\nxyz\nc1ccccc1\n")
+
+    assert [row["row"] for row in rows] == [1, 2, 3]
+    for row in rows[:2]:
+        assert "error" in row
+        assert "regulations" not in row
+    assert rows[2]["regulations"]
+    assert summary["rows"] == 3
+    assert summary["errors"] == 2
+    assert summary["regulated"] == 1
+
+
+def test_batch_api_reports_unparseable_smiles(monkeypatch):
+    monkeypatch.setattr(checker, "get_checker", lambda: checker.check_regulations(REGULATION_DB))
+    client = app.app.test_client()
+
+    response = client.post("/api/search/batch?format=csv", data="smiles\nC1CC\nCCO\n", content_type="text/csv")
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    assert response.status_code == 200
+    assert "error" in lines[0]
+    assert lines[1]["regulations"] == []
+    assert lines[-1]["summary"]["errors"] == 1
@@ -0,0 +1,181 @@
+import json
+import os
+import random
+
+from rdkit import Chem, DataStructs
+
+import checker
+from conftest import DATA_DIR
+
+
+# 変更前のチェッカーで scoped_law_a/b.json を判定した結果 (入力 -> [登録SMILES, 法律, 名前, detected_type] のリスト)
+# ナフタレン類は変更前のチェッカーが側鎖の分解で例外になるため入れていない
+def _expected_results():
+    with open(os.path.join(DATA_DIR, "scoped_results.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_scope_mask_keeps_detected_types(scoped_laws):
+    built = checker.check_regulations(checker.load_and_merge_laws(missing_ok=False))
+
+    for smiles, expected in _expected_results().items():
+        results = built.check(smiles)
+        assert [[r["pattern_matched"], r["law"], r["name"], r["detected_type"]] for r in results] == expected, smiles
+
+
+def test_scope_mask_bits():
+    assert checker.scope_mask([]) == 0
+    assert checker.scope_mask(["itself", "salts"]) == checker.SCOPE_BITS["itself"] | checker.SCOPE_BITS["salts"]
+    # 知らないscopeは無視する
+    assert checker.scope_mask(["derivatives", "hydrates"]) == checker.SCOPE_BITS["hydrates"]
+
+
+# 部分構造として本当に含まれるパターンは、原子数・元素の足切りと指紋の足切りを必ず通ること
+def _assert_prefilter_keeps_matches(built, mol):
+    table = built.patterns
+    for frag in Chem.GetMolFrags(mol, asMols=True, sanitizeFrags=True):
+        matching = [idx for idx in range(len(table)) if frag.HasSubstructMatch(table.mols[idx])]
+        kept = set(table.prefilter(frag.GetNumAtoms(), checker.element_vector(frag)).tolist())
+        frag_fp = Chem.PatternFingerprint(frag)
+        for idx in matching:
+            assert idx in kept, (Chem.MolToSmiles(frag), table.smiles[idx])
+            assert DataStructs.AllProbeBitsMatch(table.fps[idx], frag_fp), (Chem.MolToSmiles(frag), table.smiles[idx])
+
+
+def test_prefilter_keeps_every_match(scoped_laws, probe_smiles):
+    built = checker.check_regulations(checker.load_and_merge_laws(missing_ok=False))
+
+    for smiles in probe_smiles:
+        mol = Chem.MolFromSmiles(smiles)
+        _assert_prefilter_keeps_matches(built, mol)
+        # 水素を原子として持つ分子 (SDFなど)
+        _assert_prefilter_keeps_matches(built, Chem.AddHs(mol))
+
+
+def test_prefilter_keeps_every_match_on_generated_db():
+    from benchmarks import run_benchmarks
+
+    rng = random.Random(11)
+    regulation_db = run_benchmarks.generate_regulation_db(200, rng)
+    queries = run_benchmarks.generate_queries(list(regulation_db), 40, rng)
+    built = checker.check_regulations(regulation_db)
+
+    for kind in ("single", "salt", "hydrate"):
+        for smiles in queries[kind]:
+            _assert_prefilter_keeps_matches(built, Chem.MolFromSmiles(smiles))
+            built.check(smiles)
+    # 足切りが実際に効いていること
+    assert built.screen_stats["prefiltered"] > 0
+    assert built.screen_stats["pruned"] > 0
+
+
+def test_fingerprint_screen_keeps_results(scoped_laws, probe_smiles, monkeypatch):
+    built = checker.check_regulations(checker.load_and_merge_laws(missing_ok=False))
+    screened = {smiles: built.check(smiles) for smiles in probe_smiles}
+    assert built.screen_stats["pruned"] > 0
+
+    # 指紋の足切りをしない場合
+    monkeypatch.setattr(checker.DataStructs, "AllProbeBitsMatch", lambda probe, target: True)
+    for smiles in probe_smiles:
+        assert built.check(smiles) == screened[smiles], smiles
+
+
+def test_exact_and_isomer_index_match_full_scan(scoped_laws, probe_smiles):
+    regulation_db = checker.load_and_merge_laws(missing_ok=False)
+    indexed = checker.check_regulations(regulation_db)
+    # 索引を空にして、すべて部分構造マッチで判定させる
+    scanned = checker.check_regulations(regulation_db)
+    scanned.exact_index = {}
+    scanned.isomer_index = {}
+
+    for smiles in probe_smiles:
+        assert indexed.check(smiles) == scanned.check(smiles), smiles
+    assert indexed.screen_stats["indexed"] > 0
+    assert scanned.screen_stats["indexed"] == 0
+
+
+def test_recompile_only_changed_entry(scoped_laws):
+    regulation_db = checker.load_and_merge_laws(missing_ok=False)
+    first = checker.check_regulations(regulation_db)
+
+    # 1件だけSMILESを書き換え、法律情報だけ変わった1件はそのまま使い回す
+    changed_db = dict(regulation_db)
+    changed_db["CCCc1ccccc1"] = changed_db.pop("CCc1ccccc1")
+    changed_db["ClC(Cl)Cl"] = [dict(info, name="改名") for info in changed_db["ClC(Cl)Cl"]]
+    second = checker.check_regulations(changed_db, first.compiled)
+
+    assert second.compile_stats == {"reused": len(regulation_db) - 1, "compiled": 1}
+    for smiles_pattern, entry in second.compiled.items():
+        if smiles_pattern != "CCCc1ccccc1":
+            assert entry is first.compiled[smiles_pattern]
+    assert "CCc1ccccc1" not in second.compiled
+    assert "CCCc1ccccc1" in [r["pattern_matched"] for r in second.check("CCCc1ccccc1")]
+    assert second.check("ClC(Cl)Cl")[0]["name"] == "改名"
+
+
+def test_fragments_are_analysed_once_per_query(scoped_laws, monkeypatch):
+    built = checker.check_regulations(checker.load_and_merge_laws(missing_ok=False))
+    mixture = "CC(N)Cc1ccccc1.Cl.O.O.[Na+].OC(=O)C(O)C(O)C(=O)O.CC(=O)O"
+    expected = built.check(mixture)
+
+    calls = {"canonical_keys": 0, "salt_type": 0}
+    canonical_keys = checker.canonical_keys
+    classify_salt_type = built._classify_salt_type
+
+    def counting_canonical_keys(mol):
+        calls["canonical_keys"] += 1
+        return canonical_keys(mol)
+
+    def counting_classify_salt_type(frag):
+        calls["salt_type"] += 1
+        return classify_salt_type(frag)
+
+    monkeypatch.setattr(checker, "canonical_keys", counting_canonical_keys)
+    monkeypatch.setattr(built, "_classify_salt_type", counting_classify_salt_type)
+
+    assert built.check(mixture) == expected
+    # 7フラグメント: 正規化は各1回。塩の種類は、水と最大の原子数(10)のアンフェタミン・酒石酸を除いた3つだけ
+    assert calls == {"canonical_keys": 7, "salt_type": 3}
+
+
+# (対象, 登録SMILES, 変更前のチェッカーの判定)
+COMPOUND_TYPES = [
+    ("C[Hg]Cl", "[Hg]", "有機化合物"),
+    ("CCC[Hg]Cl", "[Hg]", "有機化合物"),
+    ("CC(=O)CC[Hg]", "[Hg]", "有機化合物"),
+    ("Cl[Hg]Cl", "[Hg]", "無機化合物"),
+    ("CC(=O)O[Hg]OC(C)=O", "[Hg]", "無機化合物"),
+    ("N#C[Hg]C#N", "[Hg]", "無機化合物"),
+    ("OC(=O)O[Hg]", "[Hg]", "無機化合物"),
+    ("[Hg]", "[Hg]", "無機化合物"),
+    ("CC[Pb](CC)(CC)CC", "[Pb]", None),
+    ("CC(=O)Oc1ccccc1", "c1ccccc1", "無機化合物"),
+    ("CCc1ccccc1", "c1ccccc1", "有機化合物"),
+    ("S=C=S", "C", "無機化合物")
+]
+
+
+def test_compound_type_matches_side_chain_rules():
+    built = checker.check_regulations({})
+    for whole, core, expected in COMPOUND_TYPES:
+        assert built._analyze_compound_type(Chem.MolFromSmiles(whole), Chem.MolFromSmiles(core)) == expected, whole
+
+
+def test_compound_type_is_cached(scoped_laws, monkeypatch):
+    built = checker.check_regulations(checker.load_and_merge_laws(missing_ok=False))
+    expected = built.check("C[Hg]Cl")
+    assert expected[0]["detected_type"] == "その化合物(有機化合物)"
+
+    calls = []
+    analyze_compound_type = built._analyze_compound_type
+
+    def counting_analyze_compound_type(*args):
+        calls.append(args)
+        return analyze_compound_type(*args)
+
+    monkeypatch.setattr(built, "_analyze_compound_type", counting_analyze_compound_type)
+    assert built.check("C[Hg]Cl") == expected
+    assert calls == []
+    # 別の物質なら判定する (ベンゼンとアンフェタミンの化合物の2つ)
+    built.check("CNC(C)Cc1ccccc1")
+    assert [core_smiles for _, _, core_smiles in calls] == ["NC(C)CC1=CC=CC=C1", "c1ccccc1"]
@@ -0,0 +1,32 @@
+import pytest
+
+import pipeline
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("c1ccccc1", (pipeline.ROUTE_SMILES, "c1ccccc1")),
+    ("CC(=O)Oc1ccccc1C(=O)O", (pipeline.ROUTE_SMILES, "CC(=O)Oc1ccccc1C(=O)O")),
+    ("C[C@H](N)Cc1ccccc1", (pipeline.ROUTE_SMILES, "C[C@H](N)Cc1ccccc1")),
+    ("[Na+].[Cl-]", (pipeline.ROUTE_SMILES, "[Na+].[Cl-]")),
+    ("  CCO  ", (pipeline.ROUTE_SMILES, "CCO")),
+    ("Benzene", (pipeline.ROUTE_NAME, "Benzene")),
+    ("Cocaine", (pipeline.ROUTE_NAME, "Cocaine")),
+    ("2-propanol", (pipeline.ROUTE_NAME, "2-propanol")),
+    ("acetic acid", (pipeline.ROUTE_NAME, "acetic acid")),
+    # 全角英数字は半角にしてから判定する
+    ("ＣＣＯ", (pipeline.ROUTE_SMILES, "CCO")),
+    ("Ｂｅｎｚｅｎｅ", (pipeline.ROUTE_NAME, "Benzene")),
+    ("ベンゼン", (pipeline.ROUTE_JAPANESE, "ベンゼン")),
+    ("メチルＣ", (pipeline.ROUTE_JAPANESE, "メチルＣ")),
+])
+def test_classify_input(text, expected):
+    assert pipeline.classify_input(text) == expected
+
+
+def test_smiles_and_names_skip_translation(monkeypatch):
+    def fail(text):
+        raise AssertionError(f"翻訳に回りました: {text}")
+
+    monkeypatch.setattr(pipeline, "japanese_to_english", fail)
+    assert pipeline.resolve_input("c1ccccc1") == (pipeline.ROUTE_SMILES, "c1ccccc1", "c1ccccc1")
+    assert pipeline.resolve_input("Benzene") == (pipeline.ROUTE_NAME, "Benzene", None)
@@ -0,0 +1,53 @@
+import pytest
+from rdkit import Chem
+
+import checker
+import file_screen
+
+
+REGULATION_DB = {
+    "c1ccccc1": [{"law": "テスト法", "name": "ベンゼン", "scope": ["compounds"], "description": ""}]
+}
+
+
+def _write_smi(path):
+    path.write_text("c1ccccc1 benzene\nC1CC broken\nCCO ethanol\nxyz unknown\nCc1ccccc1 toluene\n")
+
+
+def _write_sdf(path):
+    blocks = []
+    for smiles, name in [("c1ccccc1", "benzene"), ("CCO", "ethanol"), ("CCO", "broken"), ("Cc1ccccc1", "toluene")]:
+        mol = Chem.MolFromSmiles(smiles)
+        mol.SetProp("_Name", name)
+        block = Chem.MolToMolBlock(mol)
+        if name == "broken":
+            block = block.replace(" O ", " Xx")  # 知らない元素
+        blocks.append(block + "$$$$\n")
+    path.write_text("".join(blocks))
+
+
+@pytest.mark.parametrize("fmt", ["smi", "sdf"])
+@pytest.mark.parametrize("threads", [0, 2])
+def test_streaming_counts_records_and_errors(tmp_path, fmt, threads):
+    path = tmp_path / f"inventory.{fmt}"
+    if fmt == "smi":
+        _write_smi(path)
+        expected_names = ["benzene", None, "ethanol", None, "toluene"]
+    else:
+        _write_sdf(path)
+        expected_names = ["benzene", "ethanol", None, "toluene"]
+    assert file_screen.guess_format(str(path)) == fmt
+
+    records = list(file_screen.iter_mols(str(path), fmt, threads=threads))
+    # 別スレッドで読む場合は読み終わった順なので、番号で並べ直して比べる
+    records.sort(key=lambda record: record[0])
+    assert [record for record, _, _ in records] == list(range(1, len(expected_names) + 1))
+    assert [name for _, name, _ in records] == expected_names
+
+    results = list(file_screen.screen_mols(records, checker.check_regulations(REGULATION_DB)))
+    summary = results.pop()["summary"]
+    assert summary["rows"] == len(expected_names)
+    assert summary["errors"] == expected_names.count(None)
+    assert summary["regulated"] == 2
+    for result, name in zip(results, expected_names):
+        assert ("error" in result) == (name is None)
@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import checker
+import hot_reload
+import ja_to_smiles
+
+
+def _write_law(path, smiles_pattern, name):
+    path.write_text(json.dumps({smiles_pattern: {"name": name, "scope": [], "description": ""}}), encoding="utf-8")
+
+
+@pytest.fixture
+def law_files(tmp_path, monkeypatch):
+    law1 = tmp_path / "law1.json"
+    law2 = tmp_path / "law2.json"
+    _write_law(law1, "c1ccccc1", "ベンゼン")
+    _write_law(law2, "CCO", "エタノール")
+    monkeypatch.setattr(checker, "LAW_SOURCES", [(str(law1), "法律1"), (str(law2), "法律2")])
+
+    regulation_db = checker.load_and_merge_laws()
+    monkeypatch.setattr(checker, "_checker", checker.check_regulations(regulation_db))
+    monkeypatch.setattr(checker, "_regulation_db", regulation_db)
+    return law1, law2
+
+
+def test_reload_applies_changes(law_files):
+    law1, law2 = law_files
+    _write_law(law2, "CCN", "エチルアミン")
+
+    report = hot_reload.reload_laws()
+
+    assert report["added"] == ["CCN"]
+    assert report["removed"] == ["CCO"]
+    assert set(checker.get_checker().compiled) == {"c1ccccc1", "CCN"}
+
+
+def test_reload_keeps_checker_when_law_file_missing(law_files):
+    law1, law2 = law_files
+    current = checker.get_checker()
+    law2.unlink()
+
+    with pytest.raises(hot_reload.reload_failed):
+        hot_reload.reload_laws()
+
+    assert checker.get_checker() is current
+    assert set(current.compiled) == {"c1ccccc1", "CCO"}
+
+
+def test_reload_keeps_checker_when_law_file_broken(law_files):
+    law1, law2 = law_files
+    current = checker.get_checker()
+    law1.write_text("[1, 2", encoding="utf-8")
+
+    with pytest.raises(hot_reload.reload_failed):
+        hot_reload.reload_laws()
+
+    assert checker.get_checker() is current
+
+
+@pytest.fixture
+def dictionary_files(tmp_path, monkeypatch):
+    synonyms = tmp_path / "synonyms_dict.json"
+    shutil.copy(ja_to_smiles.SYNONYMS_PATH, synonyms)
+    sources = []
+    for filepath, role, trans_key in ja_to_smiles.DICTIONARY_SOURCES:
+        copied = tmp_path / os.path.basename(filepath)
+        shutil.copy(filepath, copied)
+        sources.append((str(copied), role, trans_key))
+    monkeypatch.setattr(ja_to_smiles, "SYNONYMS_PATH", str(synonyms))
+    monkeypatch.setattr(ja_to_smiles, "DICTIONARY_SOURCES", sources)
+    monkeypatch.setattr(ja_to_smiles, "tokenizer", ja_to_smiles.load_tokenizer())
+    return synonyms, {os.path.basename(filepath): tmp_path / os.path.basename(filepath) for filepath, role, trans_key in sources}
+
+
+def test_dictionary_reload_keeps_tokenizer_when_file_missing(dictionary_files):
+    synonyms, dictionaries = dictionary_files
+    current = ja_to_smiles.tokenizer
+    expected = current.translate("ベンゼン")
+    dictionaries["cores_dict.json"].unlink()
+
+    with pytest.raises(hot_reload.reload_failed):
+        hot_reload.reload_dictionaries()
+
+    assert ja_to_smiles.tokenizer is current
+    assert ja_to_smiles.tokenizer.translate("ベンゼン") == expected
+
+
+def test_dictionary_reload_keeps_tokenizer_when_synonyms_missing(dictionary_files):
+    synonyms, dictionaries = dictionary_files
+    current = ja_to_smiles.tokenizer
+    synonyms.unlink()
+
+    with pytest.raises(hot_reload.reload_failed):
+        hot_reload.reload_dictionaries()
+
+    assert ja_to_smiles.tokenizer is current
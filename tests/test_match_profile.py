@@ -0,0 +1,26 @@
+import io
+
+import checker
+import match_profile
+
+
+def test_input_normalisation_is_not_ranked():
+    reg_checker = checker.check_regulations({
+        "c1ccccc1": [{"law": "テスト法", "name": "ベンゼン", "scope": ["compounds"], "description": ""}]
+    })
+    profiler = reg_checker.enable_profiling()
+    for smiles in ["c1ccccc1O", "CCc1ccccc1", "CCO"]:
+        reg_checker.check(smiles)
+
+    ranked = profiler.report(top=None)
+    summary = profiler.input_summary()
+
+    assert [row["pattern"] for row in ranked] == ["c1ccccc1"]
+    assert summary["calls"] >= 3
+
+    out = io.StringIO()
+    match_profile.format_report(ranked, input_summary=summary, out=out)
+    lines = out.getvalue().splitlines()
+    assert lines[0].startswith("入力の正規化")
+    assert match_profile.INPUT_KEY not in "\n".join(lines[1:])
+    assert "100.0%" in lines[2]
@@ -0,0 +1,63 @@
+import pytest
+
+import ja_to_smiles
+import opsin_engine
+
+
+def test_engine_restarts_after_process_dies(fake_opsin):
+    assert fake_opsin.convert("ethanol") == "CCO"
+    first_pid = fake_opsin._proc.pid
+
+    # 外から止められた場合
+    fake_opsin._proc.kill()
+    fake_opsin._proc.wait()
+    assert fake_opsin.convert("methanol") == "CO"
+    assert fake_opsin._proc.pid != first_pid
+
+    # 変換中に落ちた場合は、その名前だけ失敗して次は作り直したプロセスで答える
+    with pytest.raises(opsin_engine.opsin_error):
+        fake_opsin.convert("die")
+    assert fake_opsin.convert("benzene") == "c1ccccc1"
+    assert fake_opsin.restart_count == 0
+
+
+def test_engine_gives_up_after_repeated_crashes(fake_opsin):
+    for _ in range(fake_opsin.max_restarts):
+        with pytest.raises(opsin_engine.opsin_error):
+            fake_opsin.convert("die")
+    # 休止中は起動しない
+    with pytest.raises(opsin_engine.opsin_error, match="休止"):
+        fake_opsin.convert("ethanol")
+    assert fake_opsin._proc is None
+
+
+def test_timeout_returns_none(fake_opsin):
+    fake_opsin.timeout = 0.5
+    with pytest.raises(opsin_engine.opsin_timeout):
+        fake_opsin.convert("slow")
+    assert fake_opsin.convert("ethanol") == "CCO"
+
+    assert ja_to_smiles.convert_name_to_smiles("slow") is None
+    assert ja_to_smiles.convert_name_to_smiles("unknown") is None
+    assert ja_to_smiles.convert_name_to_smiles("ethanol") == "CCO"
+
+
+def test_batch_keeps_input_order(fake_opsin):
+    names = ["ethanol", "", "unknown", "benzene", "die", "methanol", "two\nlines", "ethanol"]
+    assert ja_to_smiles.convert_names_to_smiles(names) == ["CCO", None, None, "c1ccccc1", None, "CO", None, "CCO"]
+
+
+def test_batch_keeps_order_when_engine_is_unavailable(fake_opsin, monkeypatch):
+    # 常駐OPSINが休止中なら、残りを java -jar でまとめて変換する
+    monkeypatch.setattr(fake_opsin, "disabled_until", float("inf"))
+    names = ["methanol", "unknown", "benzene", "ethanol"]
+    assert ja_to_smiles.convert_names_to_smiles(names) == ["CO", None, "c1ccccc1", "CCO"]
+
+
+def test_pipeline_batch_mixes_cached_and_converted_names(fake_opsin, monkeypatch):
+    import pipeline
+    import search_cache
+
+    monkeypatch.setattr(search_cache, "smiles_cache", search_cache.lru_ttl_cache("english_to_smiles"))
+    assert pipeline.name_to_smiles("benzene") == "c1ccccc1"
+    assert pipeline.names_to_smiles(["ethanol", "benzene", "unknown", "ethanol", "methanol"]) == ["CCO", "c1ccccc1", None, "CCO", "CO"]
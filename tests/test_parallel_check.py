@@ -0,0 +1,47 @@
+import threading
+
+import checker
+import parallel_check
+import regulation_snapshot
+
+
+REGULATION_DB = {
+    "c1ccccc1": [{"law": "テスト法", "name": "ベンゼン", "scope": ["compounds"], "description": ""}]
+}
+
+
+def test_workers_start_while_checker_lock_is_held(monkeypatch):
+    reg_checker = checker.check_regulations(REGULATION_DB)
+    monkeypatch.setattr(checker, "_checker", reg_checker)
+
+    # 別スレッドが get_checker() の途中でforkされた状態
+    with checker._load_lock:
+        pool = parallel_check.parallel_checker(workers=1)
+    try:
+        assert pool.check_one("Cc1ccccc1", timeout=30) == reg_checker.check("Cc1ccccc1")
+        assert list(pool.check_many(["CCO", "c1ccccc1"])) == [reg_checker.check("CCO"), reg_checker.check("c1ccccc1")]
+    finally:
+        pool.terminate()
+
+
+def test_worker_loads_checker_when_parent_has_none(monkeypatch):
+    monkeypatch.setattr(checker, "_checker", None)
+    monkeypatch.setattr(regulation_snapshot, "load_checker", lambda: checker.check_regulations(REGULATION_DB))
+
+    held = threading.Event()
+    done = threading.Event()
+
+    def hold_lock():
+        with checker._load_lock:
+            held.set()
+            done.wait(30)
+
+    thread = threading.Thread(target=hold_lock)
+    thread.start()
+    held.wait(5)
+    try:
+        with parallel_check.parallel_checker(workers=1) as pool:
+            assert pool.check_one("c1ccccc1", timeout=30)
+    finally:
+        done.set()
+        thread.join()
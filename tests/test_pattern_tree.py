@@ -0,0 +1,118 @@
+import json
+import random
+
+import checker
+import regulation_snapshot
+
+
+def _db(*smiles_patterns):
+    return {s: [{"law": "テスト法", "name": s, "scope": [], "description": ""}] for s in smiles_patterns}
+
+
+def test_reused_tree_is_not_rebuilt():
+    db = _db("c1ccccc1", "Cc1ccccc1", "CCc1ccccc1", "CCO")
+    first = checker.check_regulations(db)
+    second = checker.check_regulations(db, first.compiled, first.tree_parents())
+
+    assert second.tree_parents() == first.tree_parents()
+    assert second.tree.stats["reused"] == 4
+    assert second.tree.stats["build_substructure_calls"] == 0
+
+
+def test_tree_updates_only_changed_nodes():
+    first = checker.check_regulations(_db("c1ccccc1", "CCc1ccccc1", "CCO"))
+    assert first.tree_parents()["CCc1ccccc1"] == "c1ccccc1"
+
+    # 間に入る親が増え、親だったパターンが消える
+    db = _db("Cc1ccccc1", "CCc1ccccc1", "CCCc1ccccc1", "CCO")
+    updated = checker.check_regulations(db, first.compiled, first.tree_parents())
+    fresh = checker.check_regulations(db)
+
+    assert updated.tree_parents() == fresh.tree_parents()
+    assert updated.tree_parents()["CCCc1ccccc1"] == "CCc1ccccc1"
+    for smiles in ["CCCc1ccccc1", "c1ccccc1C", "CCO", "c1ccccc1"]:
+        assert updated.check(smiles) == fresh.check(smiles)
+
+
+# 木を使わず、すべてのパターンに部分構造マッチをかけるチェッカー (比較用)
+def _flat_scan(regulation_db):
+    flat = checker.check_regulations(regulation_db)
+    flat.tree.parents = [-1] * len(flat.tree.parents)
+    return flat
+
+
+# 親は子より原子数が少なく、子の部分構造になっていること
+def _assert_valid_parents(built):
+    table = built.patterns
+    for node, parent in enumerate(built.tree.parents):
+        if parent < 0:
+            continue
+        row, parent_row = table.pattern_rows[node], table.pattern_rows[parent]
+        assert table.num_atoms[parent_row] < table.num_atoms[row]
+        assert table.mols[row].HasSubstructMatch(table.mols[parent_row])
+
+
+def test_tree_matches_flat_scan(scoped_laws, probe_smiles):
+    regulation_db = checker.load_and_merge_laws(missing_ok=False)
+    tree = checker.check_regulations(regulation_db)
+    flat = _flat_scan(regulation_db)
+
+    # 入れ子になっていること (ベンゼン -> エチルベンゼン -> アンフェタミン -> メタンフェタミン)
+    parents = tree.tree_parents()
+    assert parents["CNC(C)CC1=CC=CC=C1"] is not None
+    assert parents["CCc1ccccc1"] == "c1ccccc1"
+    _assert_valid_parents(tree)
+
+    for smiles in probe_smiles:
+        assert tree.check(smiles) == flat.check(smiles), smiles
+
+
+def test_tree_matches_flat_scan_on_generated_db():
+    from benchmarks import run_benchmarks
+
+    rng = random.Random(7)
+    regulation_db = run_benchmarks.generate_regulation_db(150, rng)
+    queries = run_benchmarks.generate_queries(list(regulation_db), 60, rng)
+    tree = checker.check_regulations(regulation_db)
+    flat = _flat_scan(regulation_db)
+
+    _assert_valid_parents(tree)
+    for kind in ("single", "salt", "hydrate"):
+        for smiles in queries[kind]:
+            assert tree.check(smiles) == flat.check(smiles), smiles
+
+
+def test_snapshot_rebuild_updates_parents(scoped_laws, probe_smiles, tmp_path):
+    snapshot_path = str(tmp_path / "regulation_db.pickle")
+    regulation_snapshot.build_snapshot(snapshot_path)
+
+    # 根のベンゼンを消し、間に入るトルエンと、ナフタレンの子を足す
+    law_b = scoped_laws[1]
+    with open(law_b, encoding="utf-8") as f:
+        data = json.load(f)
+    del data["c1ccccc1"]
+    data["Cc1ccccc1"] = {"name": "テスト十七", "description": "トルエンの化合物", "scope": ["compounds"]}
+    data["Cc1ccc2ccccc2c1"] = {"name": "テスト十八", "description": "メチルナフタレン", "scope": ["itself", "hydrates"]}
+    with open(law_b, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+    regulation_db = checker.load_and_merge_laws(missing_ok=False)
+    previous_compiled, previous_parents = regulation_snapshot.load_previous(snapshot_path)
+    updated = checker.check_regulations(regulation_db, previous_compiled, previous_parents)
+    # 木は変わった所だけ作り直す
+    assert 0 < updated.tree.stats["reused"] < len(updated.tree.parents)
+    assert updated.tree_parents()["Cc1ccc2ccccc2c1"] == "c1ccc2ccccc2c1"
+    assert updated.tree_parents()["CCc1ccccc1"] == "Cc1ccccc1"  # 消えた親の代わりに、間に入ったトルエンが親になる
+    _assert_valid_parents(updated)
+
+    report = regulation_snapshot.build_snapshot(snapshot_path)
+    assert report["previous"]
+    assert report["compiled"] == 2
+
+    loaded = regulation_snapshot.load_checker(snapshot_path)
+    assert loaded.tree_parents() == updated.tree_parents()
+
+    flat = _flat_scan(regulation_db)
+    for smiles in probe_smiles:
+        assert updated.check(smiles) == flat.check(smiles), smiles
+        assert loaded.check(smiles) == flat.check(smiles), smiles
@@ -0,0 +1,63 @@
+import pytest
+
+import ja_to_smiles
+import pipeline
+import search_cache
+
+
+@pytest.fixture
+def smiles_cache(tmp_path, monkeypatch):
+    cache = search_cache.lru_ttl_cache("english_to_smiles", backend=search_cache.sqlite_cache_backend(str(tmp_path / "cache.sqlite")))
+    monkeypatch.setattr(search_cache, "smiles_cache", cache)
+    return cache
+
+
+def test_failed_conversion_is_remembered_briefly(smiles_cache, monkeypatch):
+    answers = [None, "CCO"]
+    monkeypatch.setattr(ja_to_smiles, "convert_name_to_smiles", lambda name: answers.pop(0))
+
+    assert pipeline.name_to_smiles("ethanol") is None
+    assert pipeline.name_to_smiles("ethanol") is None
+    assert answers == ["CCO"]
+
+
+def test_failed_conversion_is_retried_after_negative_ttl(smiles_cache, monkeypatch):
+    answers = [None, "CCO"]
+    monkeypatch.setattr(ja_to_smiles, "convert_name_to_smiles", lambda name: answers.pop(0))
+    monkeypatch.setattr(pipeline, "NEGATIVE_CACHE_TTL", 0)
+
+    assert pipeline.name_to_smiles("ethanol") is None
+    assert pipeline.name_to_smiles("ethanol") == "CCO"
+    assert pipeline.name_to_smiles("ethanol") == "CCO"
+    assert answers == []
+
+
+def test_failed_conversions_are_not_written_to_disk(smiles_cache, monkeypatch):
+    monkeypatch.setattr(ja_to_smiles, "convert_names_to_smiles", lambda names: [None if name == "unknown" else "CCO" for name in names])
+
+    assert pipeline.names_to_smiles(["unknown", "ethanol"]) == [None, "CCO"]
+
+    version = smiles_cache._version
+    assert smiles_cache.backend.get(smiles_cache.name, version, "ethanol") == "CCO"
+    assert smiles_cache.backend.get(smiles_cache.name, version, "unknown") is search_cache.MISS
+
+
+def test_translation_records_each_stage(monkeypatch):
+    stages = []
+    timed = pipeline.metrics.timed
+
+    def recording_timed(stage):
+        stages.append(stage)
+        return timed(stage)
+
+    monkeypatch.setattr(pipeline.metrics, "timed", recording_timed)
+    monkeypatch.setattr(search_cache, "name_cache", search_cache.lru_ttl_cache("ja_to_english"))
+
+    text = "酢酸エチル"
+    expected = ja_to_smiles.translate_tokens_with_reorder(ja_to_smiles.tokenize_and_parse(ja_to_smiles.normalize_text(text)))
+    assert pipeline.japanese_to_english(text) == expected
+    assert stages == ["normalize_text", "tokenize_and_parse", "translate_tokens_with_reorder"]
+
+    # 2回目はキャッシュから (翻訳しない)
+    assert pipeline.japanese_to_english(text) == expected
+    assert len(stages) == 3
@@ -0,0 +1,25 @@
+import checker
+import regulation_snapshot
+
+
+def test_snapshot_checker_matches_fresh_checker(scoped_laws, probe_smiles, tmp_path):
+    snapshot_path = str(tmp_path / "regulation_db.pickle")
+    report = regulation_snapshot.build_snapshot(snapshot_path)
+    assert not report["previous"]
+
+    loaded = regulation_snapshot.load_checker(snapshot_path)
+    fresh = checker.check_regulations(checker.load_and_merge_laws(missing_ok=False))
+
+    assert loaded.db_version == fresh.db_version
+    assert loaded.compile_stats["compiled"] == 0
+    for smiles in probe_smiles:
+        assert loaded.check(smiles) == fresh.check(smiles), smiles
+
+
+def test_snapshot_is_ignored_after_law_change(scoped_laws, tmp_path):
+    snapshot_path = str(tmp_path / "regulation_db.pickle")
+    regulation_snapshot.build_snapshot(snapshot_path)
+
+    with open(scoped_laws[0], "a", encoding="utf-8") as f:
+        f.write("\n")
+    assert regulation_snapshot.load_checker(snapshot_path) is None
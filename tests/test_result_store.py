@@ -0,0 +1,63 @@
+import checker
+import result_store
+
+
+SMILES_LIST = ["ClC(Cl)Cl", "CN1CCC[C@H]1c1cccnc1", "C[Hg]Cl", "CCc1ccccc1", "CC(=O)O", "O"]
+
+
+# 判定した SMILES を覚えておく compute
+def _recording_compute(reg_checker, computed):
+    def compute(smiles_list):
+        computed.extend(smiles_list)
+        return [reg_checker.check(smiles) for smiles in smiles_list]
+    return compute
+
+
+def _changed_db(regulation_db):
+    changed = dict(regulation_db)
+    changed["ClC(Cl)Cl"] = [dict(info, description="クロロホルム (改正)") for info in changed["ClC(Cl)Cl"]]  # 変更
+    del changed["[Hg]"]                                                                                       # 削除
+    changed["CN1CCCC1"] = [{"law": "テスト法B", "name": "テスト十九", "scope": ["itself"], "description": "ピロリジン"}]  # 追加
+    return changed
+
+
+def _store_checked_with_first_version(tmp_path, invalidate="selective"):
+    regulation_db = checker.load_and_merge_laws(missing_ok=False)
+    first = checker.check_regulations(regulation_db)
+    store = result_store.result_store(str(tmp_path / "results.sqlite"), invalidate)
+    computed = []
+    store.check_many(first, SMILES_LIST, _recording_compute(first, computed))
+    assert computed == SMILES_LIST
+
+    # 同じ版なら判定しない
+    computed.clear()
+    assert store.check_many(first, SMILES_LIST, _recording_compute(first, computed)) == [first.check(s) for s in SMILES_LIST]
+    assert computed == []
+    assert store.stats()["hits"] == len(SMILES_LIST)
+    return store, checker.check_regulations(_changed_db(regulation_db))
+
+
+def test_selective_invalidation_rechecks_only_affected(scoped_laws, tmp_path):
+    store, second = _store_checked_with_first_version(tmp_path)
+
+    computed = []
+    results = store.check_many(second, SMILES_LIST, _recording_compute(second, computed))
+
+    # 変更・削除された登録SMILESに一致していたものと、追加された登録SMILESに一致するものだけ判定し直す
+    assert computed == ["ClC(Cl)Cl", "CN1CCC[C@H]1c1cccnc1", "C[Hg]Cl"]
+    assert results == [second.check(s) for s in SMILES_LIST]
+    assert store.stats()["revalidated"] == 3
+    assert store.stats()["invalidated"] == 3
+
+    # 使い回した結果は新しい版として保存されている
+    computed.clear()
+    store.check_many(second, SMILES_LIST, _recording_compute(second, computed))
+    assert computed == []
+
+
+def test_invalidate_all_rechecks_everything(scoped_laws, tmp_path):
+    store, second = _store_checked_with_first_version(tmp_path, invalidate="all")
+
+    computed = []
+    store.check_many(second, SMILES_LIST, _recording_compute(second, computed))
+    assert computed == SMILES_LIST
@@ -0,0 +1,36 @@
+import search_cache
+
+
+def _backend(tmp_path):
+    return search_cache.sqlite_cache_backend(str(tmp_path / "cache.sqlite"))
+
+
+def test_versions_do_not_evict_each_other():
+    cache = search_cache.lru_ttl_cache("test")
+    cache.put("ethanol", "v1", "CCO")
+    cache.put("ethanol", "v2", "OCC")
+
+    # 読み直し中に古い版と新しい版のリクエストが交互に来ても、どちらのキャッシュも残る
+    for _ in range(3):
+        assert cache.get("ethanol", "v1") == "CCO"
+        assert cache.get("ethanol", "v2") == "OCC"
+    assert cache.get("methanol", "v2") is search_cache.MISS
+    assert cache.stats()["hits"] == 6
+
+
+def test_disk_keeps_newer_version_of_other_workers(tmp_path):
+    backend = _backend(tmp_path)
+    old_worker = search_cache.lru_ttl_cache("test", backend=backend)
+    new_worker = search_cache.lru_ttl_cache("test", backend=backend)
+
+    old_worker.put("ethanol", "v1", "CCO")
+    new_worker.put("ethanol", "v2", "OCC")
+
+    # 新しい版を初めて見たワーカーが、前に見た版のデータを消す
+    assert backend.get("test", "v1", "ethanol") is search_cache.MISS
+    # まだ古い版のワーカーや、古い版で起動したワーカーは新しい版のデータを消さない
+    old_worker.put("methanol", "v1", "CO")
+    late_worker = search_cache.lru_ttl_cache("test", backend=backend)
+    assert late_worker.get("methanol", "v1") == "CO"
+    assert backend.get("test", "v2", "ethanol") == "OCC"
+    assert search_cache.lru_ttl_cache("test", backend=backend).get("ethanol", "v2") == "OCC"
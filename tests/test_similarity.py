@@ -0,0 +1,34 @@
+import app
+import checker
+import similarity
+
+
+def test_similar_many_matches_similar(scoped_laws, probe_smiles, monkeypatch):
+    built = checker.check_regulations(checker.load_and_merge_laws(missing_ok=False))
+    smiles_list = probe_smiles + ["xyz"]
+
+    # 入力を何件かずつに分けて計算する場合も同じ結果になること
+    monkeypatch.setattr(similarity, "SCORE_BLOCK_CELLS", 1)
+    results = built.similar_many(smiles_list, k=5, min_similarity=0.1)
+
+    assert len(results) == len(smiles_list)
+    assert results[-1] == []
+    for smiles, result in zip(probe_smiles, results):
+        assert result == built.similar(smiles, k=5, min_similarity=0.1), smiles
+
+
+def test_similar_api_rejects_bad_smiles_list(scoped_laws, monkeypatch):
+    built = checker.check_regulations(checker.load_and_merge_laws(missing_ok=False))
+    monkeypatch.setattr(checker, "get_checker", lambda: built)
+    client = app.app.test_client()
+
+    response = client.post("/api/similar", json={"smiles": ["CCO", 1]})
+    assert response.status_code == 400
+    response = client.post("/api/similar", json={"smiles": ["CCO"] * (app.MAX_SIMILAR_BATCH + 1)})
+    assert response.status_code == 400
+
+    response = client.post("/api/similar", json={"smiles": ["CC(N)Cc1ccccc1", "xyz"], "k": 3})
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert results[0][0]["pattern_matched"] == "NC(C)CC1=CC=CC=C1"
+    assert results[1] == []